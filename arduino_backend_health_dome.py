@@ -1,14 +1,28 @@
 import machine
-import urequests
 import network
+import uasyncio as asyncio
+import json
+import struct
 from picozero import pico_led
 import time
 
 # Define the list of servers
-last_call_time = time.ticks_ms()
 servers = ["http://vedicvarma.com:5000", "http://192.168.205.1:5000","http://192.168.205.157:5000"]
 ssid = "Hotspot"
 password = "password"
+# "poll" asks every server for changes once a second, "packed" polls the binary
+# /beds/packed endpoint instead, "stream" holds /beds/stream open; every server gets its own task.
+# "gateway" polls GATEWAY_SERVER alone, which federates all the servers (backend GATEWAY_UPSTREAMS)
+CLIENT_MODE = "stream"
+GATEWAY_SERVER = "http://vedicvarma.com:7000"
+# HOSPITAL_NAME of each server, in the same order as servers; the gateway keys beds by it
+hospitals = ["Vasant Kunj Hospital", "Hospital 2", "Hospital 3"]
+PACKED_STATUS = (None, "Available", "Reserved", "Occupied")
+STREAM_IDLE_TIMEOUT_MS = 45000  # server heartbeats every 15 s; reconnect if silent for longer
+POLL_INTERVAL_MS = 1000  # between polls of a healthy server
+SERVER_TIMEOUT_MS = 5000  # per request (or stream connect); a dead server never blocks the others
+BACKOFF_MIN_MS = 1000  # first retry delay after a failure, doubled on each further failure
+BACKOFF_MAX_MS = 60000
 
 def connect():
     # Connect to WLAN
@@ -30,6 +44,8 @@ def connect():
         print('Failed to connect to WiFi')
 # Create a dynamic dictionary to hold the GPIO pins for the bed LEDs
 bed_leds = {}
+# Last bed-state version seen from each server; 0 asks for a full resync
+bed_versions = {}
 
 def initialize_leds():
     global bed_leds
@@ -87,37 +103,261 @@ def set_led_color(server_index, bed_id, status):
         bed_leds[server_index][bed_id]["yellow"].value(0)
         bed_leds[server_index][bed_id]["green"].value(0)
 
-def check_beds():
-    for server_index, server in enumerate(servers):
+class HttpConnection:
+    # Persistent HTTP/1.1 connection to one server, reused across polls so each
+    # poll skips DNS and the TCP handshake. Reopened transparently when it drops.
+    def __init__(self, server):
+        self.host, self.port = parse_server(server)
+        self.reader = self.writer = None
+
+    async def close(self):
+        writer, self.reader, self.writer = self.writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def get(self, path):
+        # Returns (status code, body bytes)
+        if self.writer is not None:
+            try:
+                return await self._request(path)
+            except (OSError, ValueError, IndexError):
+                # The server may have closed the idle socket; retry once on a fresh one
+                await self.close()
         try:
-            print(f"Sending Request to {server}",end='')
-            response = urequests.get(f"{server}/beds?filters=bedID>0,bedID<4", timeout=15)
-            
-            if response.status_code == 200:
-                try:
-                    beds = response.json()
-                    for bed in beds:
-                        bed_id = bed[0]
-                        status = bed[3]
-                        set_led_color(server_index, bed_id, status)
-                except ValueError as ve:
-                    print(f"❌\nJSON parsing error from server {server}: {ve}")
-            else:
-                print(f"❌\nError {response.status_code} from server: {server}")
-
-        except OSError as e:
-            print(f"❌\nNetwork error connecting to server {server}: {e}")
-        #except Exception as e:
-        #    print(f"Failed to connect to server {server}: {e}")
-        finally:
+            return await self._request(path)
+        except Exception:
+            await self.close()
+            raise
+
+    async def _request(self, path):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f"GET {path} HTTP/1.1\r\nHost: {self.host}\r\n\r\n".encode())
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise OSError("connection closed by server")
+        status = int(line.split()[1])
+        length, chunked, keep_alive = None, False, True
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, value = line.split(b":", 1)
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == b"content-length":
+                length = int(value)
+            elif name == b"transfer-encoding":
+                chunked = value == b"chunked"
+            elif name == b"connection":
+                keep_alive = value != b"close"
+        if status in (204, 304):
+            body = b""
+        elif chunked:
+            body = await self._read_chunked()
+        elif length is not None:
+            body = await self.reader.readexactly(length)
+        else:
+            body = await self.reader.read(-1)  # Body runs to the end of the connection
+            keep_alive = False
+        if not keep_alive:
+            await self.close()
+        return status, body
+
+    async def _read_chunked(self):
+        body = b""
+        while True:
+            size = int((await self.reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                await self.reader.readline()  # Blank line after the last chunk
+                return body
+            body += await self.reader.readexactly(size)
+            await self.reader.readline()  # CRLF after each chunk
+
+def apply_changes(server_index, body):
+    changes = json.loads(body)
+    for bed in changes["beds"]:
+        set_led_color(server_index, bed[0], bed[3])
+    bed_versions[server_index] = changes["version"]
+
+def apply_packed(server_index, body):
+    version, beds = decode_packed(body)
+    for bed_id, status in beds:
+        set_led_color(server_index, bed_id, status)
+    bed_versions[server_index] = version
+
+async def poll_server(server_index):
+    # One task per server: a slow or dead server only delays its own LEDs
+    server = servers[server_index]
+    endpoint, apply = ("/beds/packed", apply_packed) if CLIENT_MODE == "packed" else ("/beds/changes", apply_changes)
+    connection = HttpConnection(server)
+    backoff = BACKOFF_MIN_MS
+    while True:
+        try:
+            since = bed_versions.get(server_index, 0)
+            status, body = await asyncio.wait_for_ms(connection.get(f"{endpoint}?since={since}&from=1&to=3"), SERVER_TIMEOUT_MS)
+            if status == 200:
+                apply(server_index, body)
+            elif status != 204:  # 204: nothing changed since our last poll
+                raise OSError(f"HTTP {status}")
+            backoff = BACKOFF_MIN_MS
+            await asyncio.sleep_ms(POLL_INTERVAL_MS)
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            # A timed-out request leaves the socket mid-response; start the next one afresh
+            await connection.close()
+            print(f"❌ {server}: {repr(e)}, retrying in {backoff} ms")
+            await asyncio.sleep_ms(backoff)
+            backoff = min(backoff * 2, BACKOFF_MAX_MS)
+
+async def poll_gateway():
+    # One request covers every hospital; the gateway deals with slow ones
+    connection = HttpConnection(GATEWAY_SERVER)
+    version = 0
+    backoff = BACKOFF_MIN_MS
+    while True:
+        try:
+            status, body = await asyncio.wait_for_ms(connection.get(f"/gateway/beds?since={version}&from=1&to=3"), SERVER_TIMEOUT_MS)
+            if status == 200:
+                view = json.loads(body)
+                for server_index, hospital in enumerate(hospitals):
+                    # A stale hospital still carries its last known beds
+                    for bed in view["hospitals"].get(hospital, {}).get("beds", []):
+                        set_led_color(server_index, bed[0], bed[3])
+                version = view["version"]
+            elif status != 204:  # 204: nothing changed anywhere since our last poll
+                raise OSError(f"HTTP {status}")
+            backoff = BACKOFF_MIN_MS
+            await asyncio.sleep_ms(POLL_INTERVAL_MS)
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            await connection.close()
+            print(f"❌ {GATEWAY_SERVER}: {repr(e)}, retrying in {backoff} ms")
+            await asyncio.sleep_ms(backoff)
+            backoff = min(backoff * 2, BACKOFF_MAX_MS)
+
+def decode_packed(buf):
+    # 13-byte header (format, version, first BedID, count), then 2 bits per bed, high bits first
+    fmt, version, first, count = struct.unpack(">BQHH", buf[:13])
+    beds = []
+    for i in range(count):
+        code = (buf[13 + i // 4] >> (6 - 2 * (i % 4))) & 3
+        beds.append((first + i, PACKED_STATUS[code]))
+    return version, beds
+
+def benchmark_decoders(bed_count=3, rounds=100):
+    # Compare parse time of the JSON /beds payload with the packed one on this device
+    statuses = ("Available", "Reserved", "Occupied")
+    json_payload = json.dumps([[i, "General", "A/110", statuses[i % 3], None] for i in range(1, bed_count + 1)])
+    body = bytearray((bed_count + 3) // 4)
+    for i in range(bed_count):
+        body[i // 4] |= (i % 3 + 1) << (6 - 2 * (i % 4))
+    packed_payload = struct.pack(">BQHH", 1, 0, 1, bed_count) + bytes(body)
+
+    start = time.ticks_us()
+    for _ in range(rounds):
+        for bed in json.loads(json_payload):
+            bed_id, status = bed[0], bed[3]
+    json_us = time.ticks_diff(time.ticks_us(), start) / rounds
+
+    start = time.ticks_us()
+    for _ in range(rounds):
+        for bed_id, status in decode_packed(packed_payload)[1]:
+            pass
+    packed_us = time.ticks_diff(time.ticks_us(), start) / rounds
+
+    print(f"{bed_count} beds: JSON {len(json_payload)} B {json_us:.0f} us, packed {len(packed_payload)} B {packed_us:.0f} us")
+
+async def benchmark_polls(server_index=0, rounds=20):
+    # Average /beds/changes poll latency on this device: a new connection per
+    # poll (the old urequests pattern) versus one kept-alive connection
+    connection = HttpConnection(servers[server_index])
+    path = f"/beds/changes?since={bed_versions.get(server_index, 0)}&from=1&to=3"
+    results = {}
+    for mode in ("new connection", "keep-alive"):
+        start = time.ticks_ms()
+        for _ in range(rounds):
+            await connection.get(path)
+            if mode == "new connection":
+                await connection.close()
+        results[mode] = time.ticks_diff(time.ticks_ms(), start) / rounds
+    await connection.close()
+    print(f"{servers[server_index]}: new connection {results['new connection']:.0f} ms, keep-alive {results['keep-alive']:.0f} ms per poll")
+
+def parse_server(server):
+    # "http://host:port" -> ("host", port)
+    host = server.split("://", 1)[-1].split("/", 1)[0]
+    if ":" in host:
+        host, port = host.split(":", 1)
+        return host, int(port)
+    return host, 80
+
+async def open_stream(server_index):
+    host, port = parse_server(servers[server_index])
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        since = bed_versions.get(server_index, 0)
+        writer.write(f"GET /beds/stream?since={since}&from=1&to=3 HTTP/1.0\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode())
+        await writer.drain()
+        status = await reader.readline()
+        if b" 200 " not in status:
+            raise OSError(f"unexpected response {status}")
+        while await reader.readline() not in (b"\r\n", b"\n", b""):
+            pass  # Skip headers
+        return reader, writer
+    except Exception:
+        writer.close()
+        raise
+
+async def stream_server(server_index):
+    # Hold one event stream to this server, reconnecting with backoff when it drops
+    server = servers[server_index]
+    backoff = BACKOFF_MIN_MS
+    while True:
+        try:
+            reader, writer = await asyncio.wait_for_ms(open_stream(server_index), SERVER_TIMEOUT_MS)
+            print(f"✅ Streaming from {server}")
+            backoff = BACKOFF_MIN_MS
             try:
-                response.close()
-                print('✅')
-            except:
-                print("Failed to close the response properly.")
-        #time.sleep(0.1)
-        
-        
+                while True:
+                    # The server heartbeats every 15 s, so a long silence means a dead link
+                    line = await asyncio.wait_for_ms(reader.readline(), STREAM_IDLE_TIMEOUT_MS)
+                    if not line:
+                        raise OSError("stream closed")
+                    if line.startswith(b"data:"):
+                        try:
+                            changes = json.loads(line[5:])
+                            for bed in changes.get("beds", []):
+                                set_led_color(server_index, bed[0], bed[3])
+                            if "version" in changes:
+                                bed_versions[server_index] = changes["version"]
+                        except ValueError as ve:
+                            print(f"❌\nJSON parsing error from server {server}: {ve}")
+            finally:
+                writer.close()
+                await writer.wait_closed()
+        except (OSError, asyncio.TimeoutError) as e:
+            print(f"❌ {server}: {repr(e)}, reconnecting in {backoff} ms")
+        await asyncio.sleep_ms(backoff)
+        backoff = min(backoff * 2, BACKOFF_MAX_MS)
+
+async def blink():
+    # Heartbeat on the onboard LED; shows the scheduler is alive
+    while True:
+        pico_led.toggle()
+        await asyncio.sleep_ms(1000)
+
+async def main():
+    if CLIENT_MODE == "gateway":
+        asyncio.create_task(poll_gateway())
+    else:
+        worker = stream_server if CLIENT_MODE == "stream" else poll_server
+        for server_index in range(len(servers)):
+            asyncio.create_task(worker(server_index))
+    await blink()
+
 def test_leds():
     # Define the list of all GPIO pins used for LEDs
     led_pins = list(range(0, 23)) +[26]	  # GPIO pins 0-22 and 26-28
@@ -148,12 +388,6 @@ initialize_leds()
 # Turn off all LEDs initially
 turn_off_all_leds()
 #print(bed_leds)
-# Main loop to check beds periodically every 5 seconds
-while True:
-    current_time = time.ticks_ms()
-    if not time.ticks_diff(current_time, last_call_time) >= 1000:
-        continue
-    pico_led.toggle()
-    check_beds()
-    time.sleep(0.1)
-    #time.sleep(1)  # Check every 5 seconds
+# Every server is polled by its own task; between events the scheduler sleeps
+# in select.poll() instead of spinning, so the CPU idles between polls
+asyncio.run(main())
@@ -1,9 +1,32 @@
-from flask import Flask, jsonify, request, send_from_directory
-from initiate import retrieve_connection, execute_query, insert_random_data
+from os import getenv
+if getenv('SERVER_MODE') == 'gevent':
+    # Patch before anything creates locks, so idle stream subscribers are greenlets, not OS threads.
+    # Under gunicorn (gunicorn.conf.py) the gevent worker class does this instead.
+    from gevent import monkey
+    monkey.patch_all()
+
+from flask import Flask, Response, jsonify, request, send_from_directory
+from initiate import retrieve_connection, execute_query, insert_random_data, seed_bulk, stream_query, import_rows
 from flask_swagger_ui import get_swaggerui_blueprint
+from bedfeed import bed_feed, bed_summary, pack_bed_status
+from bedstore import bed_store
+from medicines import expiring_query, fetch_medicines, low_stock_query, medicine_cache
+from filters import TABLE_COLUMNS, FilterError, check_scan, compile_filters, parse_conditions
+from pool import statement_cache_stats
+from timeline import TIMELINE_MAX_HISTORY, build_timeline, timeline_cache, timeline_query
+from writebatch import WRITE_BATCH_COLLAPSE, WRITE_BATCH_TIMEOUT, WRITE_BATCHING, WriteBatcher, execute_groups, group_writes
+from gateway import gateway
+from search import SEARCH_CANDIDATES_PER_RESULT, SEARCH_MAX_RESULTS, SearchError, patient_search_query, rank_patients, search_terms
+import metrics
+import replicas
+import slowlog
+from transfer import TransferError, encode_rows, gzip_chunks, open_text, read_rows, resolve_table_format
 import logging
 from flask_cors import CORS
-from os import getenv
+import json
+import threading
+import time
+from datetime import date
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})  # Allow all origins
@@ -17,54 +40,262 @@ swaggerui_blueprint = get_swaggerui_blueprint(
 )
 
 app.register_blueprint(swaggerui_blueprint, url_prefix='/apidocs')
+metrics.instrument_app(app)
+
+# Read-your-writes with replicas: a client that just wrote gets a cookie
+# keeping its replica-eligible reads on the primary for READ_YOUR_WRITES_WINDOW
+# seconds, whichever worker or container serves them.
+PRIMARY_UNTIL_COOKIE = 'primary_until'
 
+@app.before_request
+def pin_reads_after_writes():
+    try:
+        until = float(request.cookies.get(PRIMARY_UNTIL_COOKIE, 0))
+    except ValueError:
+        until = 0.0
+    replicas.pin_primary(until)
+
+@app.after_request
+def remember_write(response):
+    wrote = request.method not in ('GET', 'HEAD', 'OPTIONS') or request.endpoint == 'insert_data'
+    if replicas.MYSQL_REPLICAS and wrote and response.status_code < 400:
+        until = time.time() + replicas.READ_YOUR_WRITES_WINDOW
+        response.set_cookie(PRIMARY_UNTIL_COOKIE, f"{until:.3f}", max_age=int(replicas.READ_YOUR_WRITES_WINDOW) + 1)
+    return response
 
-def parse_filters(filters):
+
+def list_table(table, primary_key):
     """
-    Parse filter strings and return conditions and values for SQL queries.
+    Shared implementation of the list endpoints.
+
+    - `filters` is compiled by filters.compile_filters against the table's
+      known columns; unknown columns or unindexed scans of big tables get a 400.
+    - `limit` and `after` page through the table in primary-key order; when a
+      page is full its last key is returned in the X-Next-After header.
+    - `stream=1` fetches in batches and writes the JSON array incrementally,
+      so memory stays flat however large the table is.
+    - Database reads may be served by a replica (see MYSQL_REPLICAS).
     """
-    base_query = ''
-    conditions = []
-    values = []
+    filters = request.args.get('filters', default='')
+    try:
+        where, values = compile_filters(table, filters)
+    except FilterError as e:
+        return jsonify({"error": str(e)}), 400
+    conditions = [where] if where else []
+    try:
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+        if limit is not None and limit < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "'limit' must be a positive integer."}), 400
+    try:
+        # MySQL would compare a malformed cursor as 0 and silently restart from the first page
+        after = int(request.args['after']) if 'after' in request.args else None
+    except ValueError:
+        return jsonify({"error": "'after' must be an integer, the X-Next-After of the previous page."}), 400
+    stream = request.args.get('stream', '').lower() in ('1', 'true', 'yes')
 
-    for filter_str in filters:
-        if '=' in filter_str:
-            column, value = filter_str.split('=', 1)
-            operator = '='
-        elif '>' in filter_str:
-            column, value = filter_str.split('>', 1)
-            operator = '>'
-        elif '<' in filter_str:
-            column, value = filter_str.split('<', 1)
-            operator = '<'
-        else:
-            continue  # skip invalid filters
-        
-        column = column.strip()
-        value = value.strip()
-        conditions.append(f"{column} {operator} %s")
-        values.append(value)
-    
-    return conditions, values
+    if after is not None:
+        conditions.append(f"{primary_key} > %s")
+        values.append(after)
 
-@app.route('/add_patient', methods=['POST'])
-def add_patient():
+    base_query = f'SELECT * FROM {table}'
+    if conditions:
+        base_query += ' WHERE ' + ' AND '.join(conditions)
+    if limit is not None or after is not None:
+        base_query += f' ORDER BY {primary_key}'
+    if limit is not None:
+        base_query += f' LIMIT {limit}'
+
+    if table == 'Bed' and not stream:
+        # Served from the in-memory bed store when it can answer the filters exactly
+        try:
+            bed_store.sync()
+            result = bed_store.select(parse_conditions(table, filters), limit, after)
+        except Exception as e:
+            logging.warning(f"Bed store unavailable, querying the database: {e}")
+            result = None
+        if result is not None:
+            response = jsonify(result)
+            if limit is not None and len(result) == limit:
+                response.headers['X-Next-After'] = str(result[-1][0])
+            return response
+
+    # Per-statement timings are in /metrics; this line is for debugging only
+    logging.debug(f"Executing query: {base_query}")
+
+    if stream:
+        if limit is None:
+            try:
+                with retrieve_connection(read_only=True) as connection:
+                    check_scan(connection, table, filters)
+            except FilterError as e:
+                return jsonify({"error": str(e)}), 400
+            except Exception as e:
+                logging.error(f"Query failed: {e}")
+                return jsonify({"message": "Query execution failed.", "error": str(e)}), 500
+
+        def generate():
+            yield '['
+            first = True
+            try:
+                with retrieve_connection(read_only=True) as connection:
+                    for rows in stream_query(connection, base_query, values if values else None):
+                        chunk = ','.join(app.json.dumps(row) for row in rows)
+                        yield chunk if first else ',' + chunk
+                        first = False
+            except Exception as e:
+                # Headers are already sent; abort the response rather than close the
+                # array, so a truncated result can't be mistaken for a complete one
+                logging.error(f"Streaming query failed: {e}")
+                raise
+            yield ']'
+        return Response(generate(), mimetype='application/json')
+
+    try:
+        with retrieve_connection(read_only=True) as connection:
+            if connection is None:
+                return jsonify({"error": "Unable to establish connection to the database."}), 500
+            if limit is None:
+                check_scan(connection, table, filters)
+            result = execute_query(connection, base_query, values if values else None)
+    except FilterError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Query failed: {e}")
+        return jsonify({"message": "Query execution failed.", "error": str(e)}), 500
+
+    response = jsonify(result)
+    if limit is not None and len(result) == limit:
+        response.headers['X-Next-After'] = str(result[-1][0])
+    return response
+
+def row_id(data, field):
     """
-    Add a new patient to the database.
+    data[field] as an int, or ValueError with the message for the client.
+    Checked before a write runs, so nothing after its commit can fail on it.
     """
-    data = request.json
+    value = data[field]
+    if isinstance(value, bool) or not (isinstance(value, int) or (isinstance(value, str) and value.isdigit() and value.isascii())):
+        raise ValueError(f"'{field}' must be an integer.")
+    return int(value)
+
+BATCH_MAX_ITEMS = int(getenv('BATCH_MAX_ITEMS', 1000))
+
+def run_batch(build, on_commit=None):
+    """
+    Shared implementation of the batch write endpoints.
+
+    The body is either a JSON array of items, or {"items": [...], "mode": ...}.
+    Each item has the same shape as the single-item endpoint. Consecutive
+    items that produce the same SQL are grouped into one executemany, items
+    apply in array order, and everything runs in a single transaction.
+
+    - mode "atomic" (default): all items are applied or none are.
+    - mode "best_effort": failing items are rolled back to a savepoint and
+      reported, and the rest are committed.
+
+    Answers with one {"index", "status", "error"} result per item, and calls
+    on_commit(connection, applied_items) after a successful commit; a failure
+    there is logged and doesn't change the answer.
+    """
+    body = request.json
+    items = body.get('items') if isinstance(body, dict) else body
+    mode = (body.get('mode') if isinstance(body, dict) else None) or request.args.get('mode', 'atomic')
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Expected a non-empty JSON array of items, or an object with an 'items' array."}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {BATCH_MAX_ITEMS} items per batch."}), 400
+    if mode not in ('atomic', 'best_effort'):
+        return jsonify({"error": "'mode' must be 'atomic' or 'best_effort'."}), 400
+
+    results = [{"index": i, "status": "ok"} for i in range(len(items))]
+    writes = []  # (index, SQL, values) in array order
+    for i, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("Each item must be a JSON object.")
+            query, values = build(item)
+            writes.append((i, query, values))
+        except ValueError as e:
+            results[i] = {"index": i, "status": "error", "error": str(e)}
+    groups = group_writes(writes)
+    invalid = [result for result in results if result["status"] == "error"]
+    if invalid and mode == 'atomic':
+        for result in results:
+            if result["status"] == "ok":
+                result["status"] = "skipped"
+        return jsonify({"message": "Batch rejected, nothing was applied.", "results": results}), 400
+
+    try:
+        with retrieve_connection() as connection:
+            if connection is None:
+                return jsonify({"error": "Unable to establish connection to the database."}), 500
+            try:
+                errors = {}
+                execute_groups(connection, groups, mode == 'best_effort', errors)
+                for i, e in errors.items():
+                    results[i] = {"index": i, "status": "error", "error": str(e)}
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            applied = [items[result["index"]] for result in results if result["status"] == "ok"]
+            if on_commit and applied:
+                try:
+                    on_commit(connection, applied)
+                except Exception as e:
+                    # The batch is committed; only the follow-up failed
+                    logging.error(f"Batch on_commit failed: {e}")
+    except Exception as e:
+        logging.error(f"Batch failed: {e}")
+        return jsonify({"error": str(e), "message": "Batch rolled back, nothing was applied."}), 500
+
+    failed = sum(result["status"] == "error" for result in results)
+    return jsonify({"message": f"{len(items) - failed} of {len(items)} items applied.", "results": results}), 207 if failed else 200
 
+def write_through_batcher(batcher, data):
+    """
+    Answer a single-row write through its WriteBatcher (WRITE_BATCHING=1),
+    once the group-commit transaction holding it has committed.
+    """
+    try:
+        future = batcher.submit(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        future.result(WRITE_BATCH_TIMEOUT)
+        return jsonify({"message": "Update successful"}), 200
+    except Exception as e:
+        logging.error(f"Update failed: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def patient_insert(data):
+    """
+    Build the INSERT for one new patient; raises ValueError with the message for the client.
+    """
     # Check if all required fields are present
     required_fields = ['Name', 'Phone', 'Age', 'Sex']
-    missing_fields = [field for field in required_fields if field not in data]
+    missing_fields = [field for field in required_fields if not data or field not in data]
 
     if missing_fields:
-        return jsonify({"error": f"Missing fields: {', '.join(missing_fields)}"}), 400
+        raise ValueError(f"Missing fields: {', '.join(missing_fields)}")
 
     # Prepare data for insertion
     values = (data['Name'], data['Phone'], data['Age'], data['Sex'])
 
     query = "INSERT INTO Patient (Name, Phone, Age, Sex) VALUES (%s, %s, %s, %s);"
+    return query, values
+
+@app.route('/add_patient', methods=['POST'])
+def add_patient():
+    """
+    Add a new patient to the database.
+    """
+    try:
+        query, values = patient_insert(request.json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
         with retrieve_connection() as connection:
@@ -76,16 +307,21 @@ def add_patient():
         logging.error(f"Failed to add patient: {e}")
         return jsonify({"error": str(e)}), 500
 
-
-@app.route('/set_patient', methods=['POST'])
-def set_patient():
+@app.route('/add_patient/batch', methods=['POST'])
+def add_patients():
     """
-    Update the details of a patient given their PatientID.
+    Add many patients in one transaction. See run_batch for the request format.
     """
-    data = request.json
+    return run_batch(patient_insert)
+
 
+def patient_update(data):
+    """
+    Build the UPDATE for one set_patient item; raises ValueError with the message for the client.
+    """
     if not data or not data.get('PatientID') or ('Name' not in data and 'Phone' not in data and 'Age' not in data and 'Sex' not in data):
-        return jsonify({"error": "Missing 'PatientID' or no valid fields to update in the request."}), 400
+        raise ValueError("Missing 'PatientID' or no valid fields to update in the request.")
+    data['PatientID'] = row_id(data, 'PatientID')
 
     update_fields = []
     values = []
@@ -107,27 +343,83 @@ def set_patient():
         values.append(data['Sex'])
 
     if not update_fields:
-        return jsonify({"error": "No valid fields to update."}), 400
+        raise ValueError("No valid fields to update.")
 
     values.append(data['PatientID'])
 
     query = f"UPDATE Patient SET {', '.join(update_fields)} WHERE PatientID = %s;"
+    return query, values
+
+patient_writes = WriteBatcher('set_patient', patient_update,
+                             on_commit=lambda connection, items: timeline_cache.changed([item['PatientID'] for item in items]))
+
+@app.route('/set_patient', methods=['POST'])
+def set_patient():
+    """
+    Update the details of a patient given their PatientID.
+    """
+    if WRITE_BATCHING:
+        return write_through_batcher(patient_writes, request.json)
+    try:
+        query, values = patient_update(request.json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
         with retrieve_connection() as connection:
             if connection is None:
                 return jsonify({"error": "Unable to establish connection to the database."}), 500
             result = execute_query(connection, query, values)
+        timeline_cache.changed([request.json['PatientID']])
         return jsonify(result) if result else jsonify({"message": "Update successful"}), 200
     except Exception as e:
         logging.error(f"Update failed: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/set_patient/batch', methods=['POST'])
+def set_patients():
+    """
+    Update many patients in one transaction. See run_batch for the request format.
+    """
+    return run_batch(patient_update, on_commit=lambda connection, items: timeline_cache.changed([item['PatientID'] for item in items]))
+
 
 @app.route('/details', methods=['GET'])
 def get_details():
     return jsonify({"hospital_name":getenv('HOSPITAL_NAME','Vasant Kunj Hospital')})
 
+@app.route('/admin/statement-cache', methods=['GET'])
+def get_statement_cache_stats():
+    """
+    Prepared-statement cache counters for this worker process.
+    """
+    stats = dict(statement_cache_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else None
+    return jsonify(stats)
+
+@app.route('/admin/slow-queries', methods=['GET', 'DELETE'])
+def get_slow_queries():
+    """
+    Slow statements seen by this worker process, grouped by fingerprint with their
+    EXPLAIN plans, plus the most recent entries. DELETE empties the log.
+    """
+    if request.method == 'DELETE':
+        slowlog.clear()
+        return jsonify({"message": "Slow-query log cleared."})
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({"error": "'limit' must be an integer."}), 400
+    return jsonify(slowlog.report(limit))
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Request, query and connection-pool metrics in Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/', methods=['GET'])
 def home():
     """
@@ -138,11 +430,41 @@ def home():
 
 @app.route('/insert-random-data', methods=['GET'])
 def insert_data():
+    """
+    Insert a small random sample, or bulk-seed when row counts are given
+    (e.g. /insert-random-data?patients=100000&history=1000000).
+    """
+    bulk_params = ['patients', 'beds', 'history', 'medicines', 'meditags']
+    if any(param in request.args for param in bulk_params):
+        try:
+            counts = {param: int(request.args.get(param, 0)) for param in bulk_params}
+            chunk_size = int(request.args.get('chunk_size', 5000))
+            if any(count < 0 for count in counts.values()) or chunk_size < 1:
+                raise ValueError
+        except ValueError:
+            return jsonify({"error": "Row counts must be non-negative integers and chunk_size a positive integer."}), 400
+        try:
+            with retrieve_connection() as connection:
+                summary = seed_bulk(connection, chunk_size=chunk_size, **counts)
+            if counts['beds']:
+                bed_store.reset()
+            if counts['medicines'] or counts['meditags']:
+                medicine_cache.changed()
+            if counts['history']:
+                timeline_cache.changed()
+            return jsonify({"status": "Bulk data inserted successfully!", "response": summary})
+        except Exception as e:
+            logging.error(f"Failed to bulk insert random data: {e}")
+            return jsonify({"error": str(e)}), 500
+
     try:
         with retrieve_connection() as connection:
             if connection is None:
                 return jsonify({"error": "Unable to establish connection to the database."}), 500
             response = insert_random_data(connection, insert_patients=True, insert_beds=True, insert_history=True, insert_medicines=True, insert_meditags=True)
+        bed_store.reset()
+        medicine_cache.changed()
+        timeline_cache.changed()
         return jsonify({"status": "Random data inserted successfully!", "response": response})
     except Exception as e:
         logging.error(f"Failed to insert random data: {e}")
@@ -154,58 +476,315 @@ def get_patients():
     """
     Retrieve patient information based on query parameters.
     """
-    filters = request.args.get('filters', default='').split(',')
-    base_query = 'SELECT * FROM Patient'
-    conditions, values = parse_filters(filters)
-    
-    if conditions:
-        base_query += ' WHERE ' + ' AND '.join(conditions)
-    
-    logging.info(f"Executing query: {base_query}")
-    
+    return list_table('Patient', 'PatientID')
+
+@app.route('/patients/search', methods=['GET'])
+def search_patients():
+    """
+    Find patients by partial name and/or phone digits, e.g. `q=smi 4567`.
+    Every term must appear somewhere in Name or Phone; results are ranked
+    and at most `limit` (default 20) are returned.
+    """
     try:
-        with retrieve_connection() as connection:
+        terms = search_terms(request.args.get('q', ''))
+        limit = int(request.args.get('limit', 20))
+        if not 1 <= limit <= SEARCH_MAX_RESULTS:
+            raise SearchError(f"'limit' must be between 1 and {SEARCH_MAX_RESULTS}.")
+    except ValueError as e:
+        message = str(e) if isinstance(e, SearchError) else "'limit' must be an integer."
+        return jsonify({"error": message}), 400
+
+    query, values = patient_search_query(terms, limit * SEARCH_CANDIDATES_PER_RESULT)
+    try:
+        with retrieve_connection(read_only=True) as connection:
             if connection is None:
                 return jsonify({"error": "Unable to establish connection to the database."}), 500
-            result = execute_query(connection, base_query, values if values else None)
-            return jsonify(result)
+            rows = execute_query(connection, query, values)
     except Exception as e:
         logging.error(f"Query failed: {e}")
         return jsonify({"message": "Query execution failed.", "error": str(e)}), 500
+    return jsonify(rank_patients(rows, terms, limit))
 
+@app.route('/patients/<int:patient_id>/timeline', methods=['GET'])
+def patient_timeline(patient_id):
+    """
+    A patient's chart in one call: the patient, the beds they occupy and their
+    History newest first, `limit` entries per page (default 50). Pass the
+    returned `next_before` as `before` for the next page. Read with a single
+    joined query and cached until the patient, their beds or History change.
+    """
+    try:
+        limit = int(request.args.get('limit', 50))
+        if not 1 <= limit <= TIMELINE_MAX_HISTORY:
+            raise ValueError
+        before = request.args.get('before')
+        if before is not None:
+            before_date, prescription = before.split('|', 1)
+            before = (date.fromisoformat(before_date), prescription)
+    except ValueError:
+        return jsonify({"error": f"'limit' must be between 1 and {TIMELINE_MAX_HISTORY} and 'before' a next_before value."}), 400
+
+    def load():
+        query, values = timeline_query(patient_id, limit, before)
+        with retrieve_connection() as connection:
+            timeline = build_timeline(execute_query(connection, query, values), limit)
+        return app.json.dumps(timeline) if timeline is not None else None
+
+    try:
+        body = timeline_cache.get(patient_id, (before, limit), load)
+    except Exception as e:
+        logging.error(f"Query failed: {e}")
+        return jsonify({"message": "Query execution failed.", "error": str(e)}), 500
+    if body is None:
+        return jsonify({"error": f"No patient with PatientID {patient_id}."}), 404
+    return Response(body, mimetype='application/json')
 
 @app.route('/beds', methods=['GET'])
 def get_beds():
     """
     Retrieve bed information based on query parameters.
     """
-    filters = request.args.get('filters', default='').split(',')
-    base_query = 'SELECT * FROM Bed'
-    conditions, values = parse_filters(filters)
+    return list_table('Bed', 'BedID')
 
-    if conditions:
-        base_query += ' WHERE ' + ' AND '.join(conditions)
-    
-    logging.info(f"Executing query: {base_query}")
-    
+@app.route('/beds/summary', methods=['GET'])
+def get_bed_summary():
+    """
+    Bed counts grouped by Type, Location prefix (the part before '/') and
+    Status, optionally narrowed with `type`, `location` and `status`.
+    Served from counters the bed store keeps in step with every change it
+    replays, so the cost doesn't grow with the number of beds.
+    """
     try:
-        with retrieve_connection() as connection:
-            if connection is None:
-                return jsonify({"error": "Unable to establish connection to the database."}), 500
-            result = execute_query(connection, base_query, values if values else None)
-            return jsonify(result)
+        bed_store.sync()
     except Exception as e:
         logging.error(f"Query failed: {e}")
         return jsonify({"message": "Query execution failed.", "error": str(e)}), 500
-@app.route('/set_bed', methods=['POST'])
-def set_bed():
+    counts = bed_summary.snapshot()
+
+    wanted = (request.args.get('type'), request.args.get('location'), request.args.get('status'))
+    groups = []
+    by_status = {}
+    for key, count in sorted(counts.items(), key=lambda item: tuple(str(part) for part in item[0])):
+        if any(value is not None and value != part for value, part in zip(wanted, key)):
+            continue
+        bed_type, prefix, status = key
+        groups.append({"type": bed_type, "location": prefix, "status": status, "count": count})
+        status = status if status is not None else 'Unknown'
+        by_status[status] = by_status.get(status, 0) + count
+    return jsonify({"total": sum(by_status.values()), "by_status": by_status, "groups": groups})
+
+def bed_changes(since, first=None, last=None):
     """
-    Update the status and/or Pid of a bed given its BedID.
+    Return (version, full, rows) for beds changed since `since`, answered from
+    the bed store; rows is [] when nothing in range changed.
     """
-    data = request.json
+    bed_store.sync()
+    version, rows = bed_feed.changes_since(since, first, last)
+    full = rows is None
+    if full:
+        rows = bed_store.between(first, last)
+    return version, full, rows
+
+# Under a thread-based worker (gthread, or the werkzeug dev server) every
+# /beds/wait and /beds/stream subscriber holds a thread for as long as it is
+# connected, so they are capped per worker to leave threads for ordinary
+# requests. Under gevent (the default worker) each is a cheap greenlet and the
+# cap doesn't apply.
+BED_SUBSCRIBERS_PER_WORKER = int(getenv('BED_SUBSCRIBERS_PER_WORKER', max(1, int(getenv('WORKER_THREADS', 8)) // 2)))
+bed_subscriber_slots = threading.BoundedSemaphore(BED_SUBSCRIBERS_PER_WORKER)
+
+def bed_subscriber_slot():
+    """
+    A callable releasing this request's subscriber slot, or None when the
+    worker already holds BED_SUBSCRIBERS_PER_WORKER subscribers.
+    """
+    if monkey_patched():
+        return lambda: None
+    if not bed_subscriber_slots.acquire(blocking=False):
+        return None
+    return bed_subscriber_slots.release
+
+def monkey_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+def too_many_subscribers():
+    return jsonify({"error": f"This worker already serves {BED_SUBSCRIBERS_PER_WORKER} bed subscribers; "
+                             "retry later or poll /beds/changes."}), 503, {'Retry-After': '5'}
 
+def parse_bed_range_args():
+    since = int(request.args.get('since', request.headers.get('Last-Event-ID', 0)))
+    first = int(request.args['from']) if 'from' in request.args else None
+    last = int(request.args['to']) if 'to' in request.args else None
+    return since, first, last
+
+@app.route('/beds/changes', methods=['GET'])
+def get_bed_changes():
+    """
+    Return the beds changed since the given bed-state version, plus the new version.
+    Answers 204 with an empty body (and the version in X-Bed-Version) when nothing
+    changed, without touching the database.
+    """
+    try:
+        since, first, last = parse_bed_range_args()
+    except ValueError:
+        return jsonify({"error": "'since', 'from' and 'to' must be integers."}), 400
+
+    try:
+        version, full, rows = bed_changes(since, first, last)
+    except Exception as e:
+        logging.error(f"Query failed: {e}")
+        return jsonify({"message": "Query execution failed.", "error": str(e)}), 500
+
+    if not rows and not full:
+        return '', 204, {'X-Bed-Version': str(version)}
+    return jsonify({"version": version, "full": full, "beds": rows}), 200, {'X-Bed-Version': str(version)}
+
+@app.route('/beds/wait', methods=['GET'])
+def wait_bed_changes():
+    """
+    Long-poll variant of /beds/changes: hold the request until a bed in range
+    changes or `timeout` seconds pass, then answer exactly like /beds/changes.
+    Writes made in other workers arrive within BED_STORE_WATCH_INTERVAL.
+    """
+    try:
+        since, first, last = parse_bed_range_args()
+        timeout = min(float(request.args.get('timeout', 25)), 60)
+    except ValueError:
+        return jsonify({"error": "'since', 'from', 'to' and 'timeout' must be numbers."}), 400
+
+    release = bed_subscriber_slot()
+    if release is None:
+        return too_many_subscribers()
+    bed_store.watch()
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            version, full, rows = bed_changes(since, first, last)
+            remaining = deadline - time.monotonic()
+            if rows or full or remaining <= 0:
+                break
+            # Changes outside the requested range only move the version forward
+            since = version
+            # Other workers' writes arrive through the bed store's watcher
+            bed_feed.wait(since, remaining)
+    except Exception as e:
+        logging.error(f"Query failed: {e}")
+        return jsonify({"message": "Query execution failed.", "error": str(e)}), 500
+    finally:
+        release()
+
+    if not rows and not full:
+        return '', 204, {'X-Bed-Version': str(version)}
+    return jsonify({"version": version, "full": full, "beds": rows}), 200, {'X-Bed-Version': str(version)}
+
+@app.route('/beds/stream', methods=['GET'])
+def stream_bed_changes():
+    """
+    Server-Sent Events stream of bed changes. The first event carries every bed
+    changed since `since` (or Last-Event-ID), later events carry each set_bed
+    update as it is published, within BED_STORE_WATCH_INTERVAL when another
+    worker made it. A comment line is sent as a heartbeat when idle.
+    """
+    try:
+        since, first, last = parse_bed_range_args()
+    except ValueError:
+        return jsonify({"error": "'since', 'from' and 'to' must be integers."}), 400
+    heartbeat = float(getenv('BED_STREAM_HEARTBEAT', 15))
+
+    def events(since):
+        try:
+            idle_since = time.monotonic()
+            while True:
+                version, full, rows = bed_changes(since, first, last)
+                if rows or full:
+                    payload = json.dumps({"version": version, "full": full, "beds": rows}, default=str)
+                    yield f"id: {version}\nevent: beds\ndata: {payload}\n\n"
+                    idle_since = time.monotonic()
+                elif time.monotonic() - idle_since >= heartbeat:
+                    yield ": heartbeat\n\n"
+                    idle_since = time.monotonic()
+                since = version
+                # Other workers' writes arrive through the bed store's watcher
+                bed_feed.wait(since, idle_since + heartbeat - time.monotonic())
+        except Exception as e:
+            # The client reconnects with Last-Event-ID and resumes from there
+            logging.error(f"Bed stream failed: {e}")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    release = bed_subscriber_slot()
+    if release is None:
+        return too_many_subscribers()
+    bed_store.watch()
+    response = Response(events(since), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the server closes the response, whether or not the stream ever started
+    response.call_on_close(release)
+    return response
+
+@app.route('/beds/packed', methods=['GET'])
+def get_beds_packed():
+    """
+    Compact bed status for microcontrollers: a 13-byte header (format, version,
+    first BedID, count) followed by 2 bits per bed indexed by BedID
+    (0 = unknown, 1 = Available, 2 = Reserved, 3 = Occupied).
+    Answers 204 when `since` is the current version; served from the bed store.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        first = int(request.args.get('from', 1))
+        last = int(request.args['to']) if 'to' in request.args else None
+    except ValueError:
+        return jsonify({"error": "'since', 'from' and 'to' must be integers."}), 400
+    if first < 1 or (last is not None and not first <= last < first + 65535):
+        return jsonify({"error": "'from' must be at least 1 and 'to' within 65535 beds of it."}), 400
+
+    try:
+        bed_store.sync()
+    except Exception as e:
+        logging.error(f"Query failed: {e}")
+        return jsonify({"message": "Query execution failed.", "error": str(e)}), 500
+    version = bed_feed.version
+    if since == version:
+        return '', 204, {'X-Bed-Version': str(version)}
+
+    rows = [(row[0], row[3]) for row in bed_store.between(first, last)]
+
+    if last is None:
+        last = min(max([row[0] for row in rows], default=first), first + 65534)
+    return Response(pack_bed_status(rows, first, last, version), mimetype='application/octet-stream',
+                    headers={'X-Bed-Version': str(version)})
+
+@app.route('/gateway/beds', methods=['GET'])
+def get_gateway_beds():
+    """
+    Gateway mode (GATEWAY_UPSTREAMS set): the bed status of every federated
+    hospital in one response, keyed by hospital name, from a view cached for
+    GATEWAY_CACHE_TTL seconds. Answers 204 when `since` is the current version.
+    """
+    if gateway is None:
+        return jsonify({"error": "Gateway mode is off; set GATEWAY_UPSTREAMS to enable it."}), 404
+    try:
+        since, first, last = parse_bed_range_args()
+    except ValueError:
+        return jsonify({"error": "'since', 'from' and 'to' must be integers."}), 400
+
+    version, body = gateway.view(first, last)
+    if since == version:
+        return '', 204, {'X-Gateway-Version': str(version)}
+    return Response(body, mimetype='application/json', headers={'X-Gateway-Version': str(version)})
+
+def bed_update(data):
+    """
+    Build the UPDATE for one set_bed item; raises ValueError with the message for the client.
+    """
     if not data or not data.get('bedID') or ('status' not in data and 'Pid' not in data):
-        return jsonify({"error": "Missing 'bedID' or both 'status' and 'Pid' are missing in the request."}), 400
+        raise ValueError("Missing 'bedID' or both 'status' and 'Pid' are missing in the request.")
+    # Normalised here so on_commit and the batcher's per-bed merging see the same ID
+    data['bedID'] = row_id(data, 'bedID')
 
     update_fields = []
     values = []
@@ -219,55 +798,118 @@ def set_bed():
         values.append(data['Pid'])
 
     if not update_fields:
-        return jsonify({"error": "No valid fields to update."}), 400
+        raise ValueError("No valid fields to update.")
 
     values.append(data['bedID'])
 
     query = f"UPDATE Bed SET {', '.join(update_fields)} WHERE BedID = %s;"
+    return query, values
+
+bed_writes = WriteBatcher('set_bed', bed_update, key=(lambda item: item['bedID']) if WRITE_BATCH_COLLAPSE else None,
+                         on_commit=lambda connection, items: bed_store.written(connection, [item['bedID'] for item in items]))
+
+@app.route('/set_bed', methods=['POST'])
+def set_bed():
+    """
+    Update the status and/or Pid of a bed given its BedID.
+    """
+    if WRITE_BATCHING:
+        return write_through_batcher(bed_writes, request.json)
+    data = request.json
+    try:
+        query, values = bed_update(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
         with retrieve_connection() as connection:
             if connection is None:
                 return jsonify({"error": "Unable to establish connection to the database."}), 500
             result = execute_query(connection, query, values)
+            # Updates the bed store, feed and summary here and in every other worker
+            bed_store.written(connection, [data['bedID']])
         return jsonify(result) if result else jsonify({"message": "Update successful"}), 200
     except Exception as e:
         logging.error(f"Update failed: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/set_bed/batch', methods=['POST'])
+def set_beds():
+    """
+    Update many beds in one transaction. See run_batch for the request format.
+    """
+    return run_batch(bed_update, on_commit=lambda connection, items: bed_store.written(connection, [item['bedID'] for item in items]))
+
 @app.route('/medicines', methods=['GET'])
 def get_medicines():
     """
     Retrieve medicine information based on query parameters.
     """
-    filters = request.args.get('filters', default='').split(',')
-    base_query = 'SELECT * FROM Medicine'
-    conditions, values = parse_filters(filters)
+    return list_table('Medicine', 'MediID')
 
-    if conditions:
-        base_query += ' WHERE ' + ' AND '.join(conditions)
-    
-    logging.info(f"Executing query: {base_query}")
-    
+def medicine_report(key, query, values):
+    """
+    Answer a medicine stock query from medicine_cache, loading it on a miss.
+    The encoded JSON is cached, so a hit costs no serialisation either.
+    """
     try:
-        with retrieve_connection() as connection:
-            if connection is None:
-                return jsonify({"error": "Unable to establish connection to the database."}), 500
-            result = execute_query(connection, base_query, values if values else None)
-            return jsonify(result)
+        def load():
+            with retrieve_connection() as connection:
+                return app.json.dumps(fetch_medicines(connection, query, values))
+        return Response(medicine_cache.get(key, load), mimetype='application/json')
     except Exception as e:
         logging.error(f"Query failed: {e}")
         return jsonify({"message": "Query execution failed.", "error": str(e)}), 500
 
-@app.route('/set_medicine', methods=['POST'])
-def set_medicine():
+def parse_medicine_report_args():
+    tags = tuple(sorted({tag.strip() for tag in request.args.get('tag', '').split(',') if tag.strip()}))
+    limit = int(request.args['limit']) if 'limit' in request.args else None
+    if limit is not None and limit < 1:
+        raise ValueError
+    return tags, limit
+
+@app.route('/medicines/expiring', methods=['GET'])
+def get_expiring_medicines():
     """
-    Update the quantity and/or expiry date of a medicine given its MediID.
+    Medicines expiring within `days` days (default 30), soonest first, with
+    their Meditag categories; `tag` keeps only medicines with one of the given
+    tags and `expired=1` includes stock that has already expired.
+    Cached until a medicine is written.
     """
-    data = request.json
+    try:
+        days = int(request.args.get('days', 30))
+        tags, limit = parse_medicine_report_args()
+        if days < 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "'days' must be a non-negative integer and 'limit' a positive integer."}), 400
+    include_expired = request.args.get('expired', '').lower() in ('1', 'true', 'yes')
+    today = date.today()
+    query, values = expiring_query(days, include_expired, tags, limit, today)
+    return medicine_report(('expiring', today, days, include_expired, tags, limit), query, values)
 
+@app.route('/medicines/low_stock', methods=['GET'])
+def get_low_stock_medicines():
+    """
+    Medicines with at most `threshold` units left (default 10), lowest first,
+    with their Meditag categories; `tag` keeps only medicines with one of the
+    given tags. Cached until a medicine is written.
+    """
+    try:
+        threshold = int(request.args.get('threshold', 10))
+        tags, limit = parse_medicine_report_args()
+    except ValueError:
+        return jsonify({"error": "'threshold' must be an integer and 'limit' a positive integer."}), 400
+    query, values = low_stock_query(threshold, tags, limit)
+    return medicine_report(('low_stock', threshold, tags, limit), query, values)
+
+def medicine_update(data):
+    """
+    Build the UPDATE for one set_medicine item; raises ValueError with the message for the client.
+    """
     if not data or not data.get('MediID') or ('Qty' not in data and 'Expiry' not in data):
-        return jsonify({"error": "Missing 'MediID' or both 'Qty' and 'Expiry' are missing in the request."}), 400
+        raise ValueError("Missing 'MediID' or both 'Qty' and 'Expiry' are missing in the request.")
+    data['MediID'] = row_id(data, 'MediID')
 
     update_fields = []
     values = []
@@ -281,22 +923,126 @@ def set_medicine():
         values.append(data['Expiry'])
 
     if not update_fields:
-        return jsonify({"error": "No valid fields to update."}), 400
+        raise ValueError("No valid fields to update.")
 
     values.append(data['MediID'])
 
     query = f"UPDATE Medicine SET {', '.join(update_fields)} WHERE MediID = %s;"
+    return query, values
+
+medicine_writes = WriteBatcher('set_medicine', medicine_update, on_commit=lambda connection, items: medicine_cache.changed())
+
+@app.route('/set_medicine', methods=['POST'])
+def set_medicine():
+    """
+    Update the quantity and/or expiry date of a medicine given its MediID.
+    """
+    if WRITE_BATCHING:
+        return write_through_batcher(medicine_writes, request.json)
+    try:
+        query, values = medicine_update(request.json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
         with retrieve_connection() as connection:
             if connection is None:
                 return jsonify({"error": "Unable to establish connection to the database."}), 500
             result = execute_query(connection, query, values)
+        medicine_cache.changed()
         return jsonify(result) if result else jsonify({"message": "Update successful"}), 200
     except Exception as e:
         logging.error(f"Update failed: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/set_medicine/batch', methods=['POST'])
+def set_medicines():
+    """
+    Update many medicines in one transaction. See run_batch for the request format.
+    """
+    return run_batch(medicine_update, on_commit=lambda connection, items: medicine_cache.changed())
+
+
+@app.route('/export/<table>', methods=['GET'])
+def export_table(table):
+    """
+    Stream a whole table, or the rows matching `filters`, as CSV or NDJSON.
+    Rows are read through an unbuffered cursor in batches, so memory stays
+    constant; gzip=1 compresses the stream on the fly.
+    """
+    try:
+        table, fmt = resolve_table_format(table, request.args.get('format', 'ndjson'))
+        where, values = compile_filters(table, request.args.get('filters', default=''))
+        batch_size = int(request.args.get('batch_size', 1000))
+        if batch_size < 1:
+            raise ValueError("'batch_size' must be a positive integer.")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    compressed = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    columns = TABLE_COLUMNS[table]
+    query = f"SELECT {', '.join(columns)} FROM {table}"
+    if where:
+        query += ' WHERE ' + where
+    logging.info(f"Exporting: {query}")
+
+    def generate():
+        try:
+            with retrieve_connection(read_only=True) as connection:
+                yield from encode_rows(stream_query(connection, query, values if values else None, batch_size), columns, fmt)
+        except Exception as e:
+            # Headers are already sent; abort the response so the client sees a
+            # failed transfer, not a shorter file that looks complete
+            logging.error(f"Export of {table} failed: {e}")
+            raise
+
+    chunks = gzip_chunks(generate()) if compressed else generate()
+    filename = f"{table.lower()}.{fmt}" + ('.gz' if compressed else '')
+    mimetype = 'application/gzip' if compressed else ('text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    return Response(chunks, mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/import/<table>', methods=['POST'])
+def import_table(table):
+    """
+    Import a CSV or NDJSON request body into Patient or History in chunked
+    transactions and report throughput. The body may be gzip-compressed
+    (Content-Encoding: gzip or gzip=1). Chunks before a failing one stay committed.
+    """
+    try:
+        table, fmt = resolve_table_format(table, request.args.get('format', 'ndjson'))
+        chunk_size = int(request.args.get('chunk_size', 5000))
+        if chunk_size < 1:
+            raise ValueError("'chunk_size' must be a positive integer.")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    compressed = request.headers.get('Content-Encoding', '').lower() == 'gzip' or request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    skip_duplicates = request.args.get('on_duplicate') == 'skip'
+
+    try:
+        columns, rows = read_rows(open_text(request.stream, compressed), table, fmt)
+        with retrieve_connection() as connection:
+            if connection is None:
+                return jsonify({"error": "Unable to establish connection to the database."}), 500
+            try:
+                summary = import_rows(connection, table, columns, rows, chunk_size, skip_duplicates)
+            finally:
+                # Chunks before a failure stay committed
+                timeline_cache.changed()
+        return jsonify({"status": "Import finished", "response": summary})
+    except TransferError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Import into {table} failed: {e}")
+        return jsonify({"error": str(e)}), 500
+
 
 if __name__ == '__main__':
-    app.run('0.0.0.0', debug=True,port=getenv('PORT',5000))
+    # Development servers. Production runs under gunicorn, see gunicorn.conf.py.
+    # The werkzeug server closes the connection after every response; use
+    # SERVER_MODE=gevent to try the dome firmware's keep-alive client locally.
+    if getenv('SERVER_MODE') == 'gevent':
+        # One greenlet per connection, so hundreds of idle /beds/stream subscribers stay cheap
+        from gevent.pywsgi import WSGIServer
+        WSGIServer(('0.0.0.0', int(getenv('PORT', 5000))), app).serve_forever()
+    else:
+        app.run('0.0.0.0', debug=True,port=getenv('PORT',5000))
@@ -0,0 +1,150 @@
+import struct
+import threading
+import time
+
+# 2-bit status codes used by the packed /beds/packed format; 0 means no such bed / unknown status
+BED_STATUS_CODES = {'Available': 1, 'Reserved': 2, 'Occupied': 3}
+# format (1), version, first BedID, bed count
+PACKED_HEADER = struct.Struct('>BQHH')
+PACKED_FORMAT = 1
+
+class BedFeed:
+    """
+    Monotonically increasing bed-state version plus the latest row of every bed
+    written through the API, so pollers can ask "what changed since version v"
+    without touching MySQL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Condition()
+        # Start from wall-clock milliseconds so versions keep growing across restarts
+        self.version = int(time.time() * 1000)
+        # Clients that last synced before this version need a full resync
+        self._reset_version = self.version
+        self._changed = {}  # BedID -> (version, row)
+
+    def publish(self, rows, version=None):
+        """
+        Record freshly written Bed rows (as returned by SELECT * FROM Bed) under
+        a new version: `version` if given (see bedstore.BedStore), else the next one.
+        """
+        with self._lock:
+            self.version = version if version is not None else self.version + 1
+            for row in rows:
+                self._changed[row[0]] = (self.version, row)
+            self._lock.notify_all()
+            return self.version
+
+    def reset(self, version=None):
+        """
+        Invalidate everything, e.g. after bulk seeding inserted beds we have no rows for.
+        """
+        with self._lock:
+            self.version = version if version is not None else self.version + 1
+            self._reset_version = self.version
+            self._changed.clear()
+            self._lock.notify_all()
+            return self.version
+
+    def wait(self, since, timeout):
+        """
+        Block until the version moves past `since` or `timeout` seconds pass, and
+        return the current version. Every waiter shares one condition, so a
+        publish wakes all subscribers at once.
+        """
+        with self._lock:
+            self._lock.wait_for(lambda: self.version != since, timeout)
+            return self.version
+
+    def changes_since(self, since, first=None, last=None):
+        """
+        Return (version, rows) for beds changed after `since`, optionally limited
+        to BedIDs in [first, last]. rows is None when the caller must resync fully.
+        """
+        with self._lock:
+            if since == self.version:
+                return self.version, []
+            if since > self.version or since < self._reset_version:
+                return self.version, None
+            rows = [row for version, row in self._changed.values()
+                    if version > since and (first is None or row[0] >= first) and (last is None or row[0] <= last)]
+            return self.version, sorted(rows, key=lambda row: row[0])
+
+
+def location_prefix(location):
+    """
+    The wing/floor part of a Location such as 'B/210'.
+    """
+    return location.split('/', 1)[0] if location else location
+
+
+class BedSummary:
+    """
+    Bed counts per (Type, Location prefix, Status), counted once from the
+    bed store's rows when it loads and then kept current by moving every
+    replayed bed from its old key to its new one, so reading it costs the
+    same however many beds there are. Only the bed store writes to it, under
+    its sync lock, so a count never misses or repeats a change-log entry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = None  # (Type, prefix, Status) -> count; None until loaded
+
+    def snapshot(self):
+        """
+        Return a copy of the counts, or None before the bed store has loaded.
+        """
+        with self._lock:
+            return dict(self._counts) if self._counts is not None else None
+
+    def load(self, rows):
+        """
+        Count every Bed row (SELECT * FROM Bed) afresh.
+        """
+        counts = {}
+        for row in rows:
+            key = _summary_key(row)
+            counts[key] = counts.get(key, 0) + 1
+        with self._lock:
+            self._counts = counts
+
+    def apply(self, old_rows, new_rows):
+        """
+        Move the changed beds from the keys of their previous rows, as held by
+        the bed store before the write, to the keys of their current rows.
+        """
+        with self._lock:
+            if self._counts is None:
+                return
+            for row in old_rows:
+                key = _summary_key(row)
+                self._counts[key] = self._counts.get(key, 0) - 1
+                if self._counts[key] <= 0:
+                    del self._counts[key]
+            for row in new_rows:
+                key = _summary_key(row)
+                self._counts[key] = self._counts.get(key, 0) + 1
+
+
+def _summary_key(row):
+    bed_id, bed_type, location, status, pid = row
+    return bed_type, location_prefix(location), status
+
+
+def pack_bed_status(rows, first, last, version):
+    """
+    Encode (BedID, Status) rows for BedIDs first..last as the packed header
+    followed by 2 bits per bed, four beds per byte, first bed in the high bits.
+    """
+    count = last - first + 1
+    body = bytearray((count + 3) // 4)
+    for bed_id, status in rows:
+        if first <= bed_id <= last:
+            i = bed_id - first
+            body[i // 4] |= BED_STATUS_CODES.get(status, 0) << (6 - 2 * (i % 4))
+    return PACKED_HEADER.pack(PACKED_FORMAT, version, first, count) + bytes(body)
+
+
+bed_feed = BedFeed()
+bed_summary = BedSummary()
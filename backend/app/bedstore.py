@@ -0,0 +1,428 @@
+import bisect
+import fcntl
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from os import getenv, getpid
+
+from bedfeed import bed_feed, bed_summary
+from initiate import execute_query, retrieve_connection
+
+# Seconds between full comparisons with the Bed table, to pick up writes made outside the API
+BED_STORE_RECONCILE_INTERVAL = float(getenv('BED_STORE_RECONCILE_INTERVAL', 30))
+# Seconds between the watcher's checks of the change log for other workers' writes,
+# i.e. how late those reach this worker's long-polls and streams
+BED_STORE_WATCH_INTERVAL = float(getenv('BED_STORE_WATCH_INTERVAL', 0.05))
+# Changed BedIDs remembered in the change log; a worker further behind reloads everything
+BED_LOG_SIZE = int(getenv('BED_LOG_SIZE', 4096))
+
+# base (wall-clock ms when the log was created), head (sequence of the latest entry)
+_LOG_HEADER = struct.Struct('<QQ')
+# sequence, BedID (0 = everything changed, reload)
+_LOG_SLOT = struct.Struct('<QQ')
+
+_INT_COLUMNS = {'BedID': 0, 'Pid': 4}
+_TEXT_COLUMNS = {'Type': 1, 'Location': 2, 'Status': 3}
+# Values MySQL would compare with an INT column exactly as int() does
+_INTEGER = re.compile(r'[+-]?[0-9]+')
+
+
+def bed_rows_query(bed_ids):
+    """
+    (query, values) re-reading these beds by primary key, as the store replays writes.
+    """
+    return f"SELECT * FROM Bed WHERE BedID IN ({', '.join(['%s'] * len(bed_ids))})", list(bed_ids)
+
+
+class ChangeLog:
+    """
+    Ring buffer of changed BedIDs with a global sequence number, in a shared
+    memory map so every worker process sees every other worker's writes.
+
+    Without `path` the log is anonymous memory private to this process, which
+    is all a single-process server needs. gunicorn.conf.py creates a file for
+    its workers and passes its path in BED_LOG_FILE.
+    """
+
+    def __init__(self, path=None, size=BED_LOG_SIZE):
+        self.size = size
+        length = _LOG_HEADER.size + _LOG_SLOT.size * size
+        self._lock = threading.Lock()
+        self._fd = None
+        if path is None:
+            self._map = mmap.mmap(-1, length)
+            _LOG_HEADER.pack_into(self._map, 0, int(time.time() * 1000), 0)
+        else:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            with self._exclusive():
+                if os.fstat(self._fd).st_size < length:
+                    os.ftruncate(self._fd, length)
+                    os.pwrite(self._fd, _LOG_HEADER.pack(int(time.time() * 1000), 0), 0)
+            self._map = mmap.mmap(self._fd, length)
+
+    def _exclusive(self):
+        log = self
+
+        class _Locked:
+            def __enter__(self):
+                log._lock.acquire()
+                if log._fd is not None:
+                    fcntl.flock(log._fd, fcntl.LOCK_EX)
+
+            def __exit__(self, *exc):
+                if log._fd is not None:
+                    fcntl.flock(log._fd, fcntl.LOCK_UN)
+                log._lock.release()
+        return _Locked()
+
+    @property
+    def base(self):
+        return _LOG_HEADER.unpack_from(self._map, 0)[0]
+
+    def head(self):
+        return _LOG_HEADER.unpack_from(self._map, 0)[1]
+
+    def append(self, bed_ids):
+        """
+        Record that these beds changed (0 = all of them); returns the new head.
+        """
+        with self._exclusive():
+            base, head = _LOG_HEADER.unpack_from(self._map, 0)
+            for bed_id in bed_ids:
+                head += 1
+                _LOG_SLOT.pack_into(self._map, _LOG_HEADER.size + _LOG_SLOT.size * (head % self.size), head, bed_id)
+            # Publish the new head only after its slots are written
+            _LOG_HEADER.pack_into(self._map, 0, base, head)
+            return head
+
+    def read(self, after, head):
+        """
+        BedIDs changed in (after, head], or None when the caller must reload
+        everything: a reset entry, or entries already overwritten.
+        """
+        if head - after > self.size:
+            return None
+        bed_ids = set()
+        for sequence in range(after + 1, head + 1):
+            slot_sequence, bed_id = _LOG_SLOT.unpack_from(self._map, _LOG_HEADER.size + _LOG_SLOT.size * (sequence % self.size))
+            if slot_sequence != sequence or bed_id == 0:
+                return None
+            bed_ids.add(bed_id)
+        return bed_ids
+
+
+def _text_key(value):
+    # The tables' default collation (latin1_swedish_ci) ignores case and
+    # trailing spaces; for ASCII text that is all it does
+    return value.rstrip(' ').lower()
+
+
+def _is_ascii(row):
+    return all(row[index] is None or row[index].isascii() for index in _TEXT_COLUMNS.values())
+
+
+class BedStore:
+    """
+    Every Bed row held in memory, keyed by BedID with secondary indexes on
+    Status and Type, so /beds and the bed feed endpoints don't touch MySQL.
+
+    - Loaded from the Bed table on first use.
+    - Writes through the API append the changed BedIDs to the shared
+      ChangeLog; before answering, every worker replays entries it hasn't
+      seen by re-reading just those beds. A worker that falls more than
+      BED_LOG_SIZE entries behind reloads the whole table.
+    - Every BED_STORE_RECONCILE_INTERVAL seconds the table is compared with
+      the store and any difference, e.g. from a manual UPDATE, is broadcast
+      through the log like an API write.
+
+    The bed feed and the bed summary are updated from the same replay, under
+    the sync lock, so a bed-state version means the same thing in every
+    worker: the change log base plus its sequence number.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()  # guards the rows and indexes
+        self._sync_lock = threading.Lock()  # one replay at a time per process
+        self._log = None
+        self._pid = None
+        self._rows = None  # BedID -> row (as from SELECT * FROM Bed); None until loaded
+        self._ids = []  # every BedID, sorted
+        self._by_status = {}  # Status key -> set of BedIDs
+        self._by_type = {}  # Type key -> set of BedIDs
+        self._non_ascii = 0  # rows whose text compares in ways _text_key doesn't model
+        self._seen = 0
+        self._reconciled_at = 0.0
+        self._listeners = []
+        self._watcher_pid = None
+
+    def listen(self, callback):
+        """
+        Call callback(old_rows, new_rows) whenever this process applies bed
+        changes, with the previous and current rows of the changed beds, or
+        callback(None, None) when every bed may have changed.
+        """
+        self._listeners.append(callback)
+
+    @property
+    def log(self):
+        if self._pid != getpid():
+            # After fork the map is shared with the parent; reopen our own and start afresh
+            self._log = ChangeLog(getenv('BED_LOG_FILE') or None)
+            self._pid = getpid()
+            self._rows = None
+        return self._log
+
+    def version(self, sequence):
+        return self.log.base + sequence
+
+    def written(self, connection, bed_ids):
+        """
+        Called after a write to these beds has committed.
+        """
+        self.log.append(sorted({int(bed_id) for bed_id in bed_ids}))
+        self.sync(connection)
+
+    def reset(self, connection=None):
+        """
+        Every bed may have changed (e.g. after seeding); all workers reload.
+        """
+        self.log.append([0])
+        self.sync(connection)
+
+    def sync(self, connection=None):
+        """
+        Bring the store, the bed feed and the bed summary up to date with the
+        change log. Costs one shared-memory read when nothing changed.
+        """
+        log = self.log
+        if self._rows is not None and log.head() == self._seen:
+            if time.monotonic() - self._reconciled_at < BED_STORE_RECONCILE_INTERVAL:
+                return
+        with self._sync_lock:
+            head = log.head()
+            if self._rows is None:
+                self._load(connection, head)
+            elif head != self._seen:
+                bed_ids = log.read(self._seen, head)
+                if bed_ids is None:
+                    self._load(connection, head)
+                else:
+                    self._replay(connection, bed_ids, head)
+            elif time.monotonic() - self._reconciled_at >= BED_STORE_RECONCILE_INTERVAL:
+                self._reconcile(connection)
+
+    def watch(self):
+        """
+        Start this process's watcher: a thread that syncs every
+        BED_STORE_WATCH_INTERVAL seconds, so another worker's write is
+        replayed, and bed feed waiters woken, without anyone polling. One
+        check costs a shared-memory read; /beds/wait and /beds/stream call this.
+        """
+        if self._watcher_pid == getpid():
+            return
+        with self._lock:
+            if self._watcher_pid != getpid():
+                # Threads don't survive fork; each worker runs its own watcher
+                self._watcher_pid = getpid()
+                threading.Thread(target=self._watch, name='bed-store-watcher', daemon=True).start()
+
+    def _watch(self):
+        while True:
+            time.sleep(BED_STORE_WATCH_INTERVAL)
+            try:
+                self.sync()
+            except Exception as e:
+                logging.warning(f"Bed store watcher failed to sync: {e}")
+                time.sleep(1)
+
+    def _query(self, connection, query, values=None):
+        if connection is not None:
+            return execute_query(connection, query, values)
+        with retrieve_connection() as connection:
+            return execute_query(connection, query, values)
+
+    def _load(self, connection, head):
+        rows = self._query(connection, "SELECT * FROM Bed")
+        with self._lock:
+            self._rows = {}
+            self._ids = []
+            self._by_status = {}
+            self._by_type = {}
+            self._non_ascii = 0
+            for row in rows:
+                self._put(row)
+            self._seen = head
+        self._reconciled_at = time.monotonic()
+        bed_feed.reset(self.version(head))
+        bed_summary.load(rows)
+        for callback in self._listeners:
+            callback(None, None)
+        logging.info(f"Bed store loaded {len(rows)} beds at sequence {head}")
+
+    def _replay(self, connection, bed_ids, head):
+        ordered = sorted(bed_ids)
+        rows = self._query(connection, *bed_rows_query(ordered))
+        with self._lock:
+            old_rows = [self._rows[bed_id] for bed_id in ordered if bed_id in self._rows]
+            for bed_id in bed_ids:
+                self._drop(bed_id)
+            for row in rows:
+                self._put(row)
+            self._seen = head
+        bed_feed.publish(rows, self.version(head))
+        bed_summary.apply(old_rows, rows)
+        for callback in self._listeners:
+            callback(old_rows, rows)
+
+    def _reconcile(self, connection):
+        rows = self._query(connection, "SELECT * FROM Bed")
+        self._reconciled_at = time.monotonic()
+        current = {row[0]: tuple(row) for row in rows}
+        with self._lock:
+            changed = [bed_id for bed_id, row in current.items() if tuple(self._rows.get(bed_id, ())) != row]
+            changed += [bed_id for bed_id in self._rows if bed_id not in current]
+        if changed:
+            logging.info(f"Bed store reconcile found {len(changed)} beds changed outside the API")
+            self.log.append(sorted(changed))
+            head = self.log.head()
+            bed_ids = self.log.read(self._seen, head)
+            if bed_ids is None:
+                self._load(connection, head)
+            else:
+                self._replay(connection, bed_ids, head)
+
+    def _put(self, row):
+        # Called with the lock held
+        if row[0] not in self._rows:
+            bisect.insort(self._ids, row[0])
+        self._rows[row[0]] = row
+        self._non_ascii += not _is_ascii(row)
+        if row[3] is not None:
+            self._by_status.setdefault(_text_key(row[3]), set()).add(row[0])
+        if row[1] is not None:
+            self._by_type.setdefault(_text_key(row[1]), set()).add(row[0])
+
+    def _drop(self, bed_id):
+        # Called with the lock held
+        row = self._rows.pop(bed_id, None)
+        if row is None:
+            return
+        del self._ids[bisect.bisect_left(self._ids, bed_id)]
+        self._non_ascii -= not _is_ascii(row)
+        if row[3] is not None:
+            self._by_status.get(_text_key(row[3]), set()).discard(bed_id)
+        if row[1] is not None:
+            self._by_type.get(_text_key(row[1]), set()).discard(bed_id)
+
+    def select(self, conditions, limit=None, after=None):
+        """
+        Rows matching canonical filter conditions (filters.parse_conditions),
+        in BedID order, or None when a condition can't be answered exactly the
+        way MySQL would (e.g. a range on a text column) and the caller should
+        query the database instead.
+        """
+        predicates = []
+        lookups = []  # (index name, keys) giving the candidates; exact, so no predicate needed
+        low, high = None, None  # BedID range, walked in the sorted ID list
+        for column, operator, values in conditions:
+            if column in _INT_COLUMNS:
+                if operator == 'PREFIX' or not all(_INTEGER.fullmatch(value) for value in values):
+                    return None
+                values = [int(value) for value in values]
+                if column == 'BedID' and operator in ('>', '>=', '<', '<=', 'BETWEEN'):
+                    first = {'>': values[0] + 1, '>=': values[0], 'BETWEEN': values[0]}.get(operator)
+                    last = {'<': values[0] - 1, '<=': values[0], 'BETWEEN': values[-1]}.get(operator)
+                    low = first if low is None or (first is not None and first > low) else low
+                    high = last if high is None or (last is not None and last < high) else high
+                    continue
+                if column == 'BedID' and operator in ('=', 'IN'):
+                    lookups.append(('BedID', values))
+                else:
+                    predicates.append(_int_predicate(_INT_COLUMNS[column], operator, values))
+            elif column in _TEXT_COLUMNS:
+                if operator not in ('=', '!=', 'IN', 'PREFIX') or not all(value.isascii() for value in values):
+                    return None
+                keys = [_text_key(value) for value in values]
+                if column in ('Status', 'Type') and operator in ('=', 'IN'):
+                    lookups.append((column, keys))
+                else:
+                    predicates.append(_text_predicate(_TEXT_COLUMNS[column], operator, values if operator == 'PREFIX' else keys))
+            else:
+                return None
+        if after is not None:
+            if not _INTEGER.fullmatch(str(after)):
+                return None
+            low = int(after) + 1 if low is None else max(low, int(after) + 1)
+
+        with self._lock:
+            if self._rows is None or (self._non_ascii and any(column in _TEXT_COLUMNS for column, operator, values in conditions)):
+                return None
+            candidates = None
+            for name, keys in lookups:
+                if name == 'BedID':
+                    ids = set(keys)
+                else:
+                    index = self._by_status if name == 'Status' else self._by_type
+                    ids = set().union(*(index.get(key, ()) for key in keys))
+                candidates = ids if candidates is None else candidates & ids
+            if candidates is None:
+                start = 0 if low is None else bisect.bisect_left(self._ids, low)
+                end = len(self._ids) if high is None else bisect.bisect_right(self._ids, high)
+                ids = (self._ids[i] for i in range(start, end))
+            else:
+                ids = sorted(bed_id for bed_id in candidates if bed_id in self._rows
+                             and (low is None or bed_id >= low) and (high is None or bed_id <= high))
+            rows = []
+            for bed_id in ids:
+                row = self._rows[bed_id]
+                if all(match(row) for match in predicates):
+                    rows.append(row)
+                    if len(rows) == limit:
+                        break
+        return rows
+
+    def between(self, first=None, last=None):
+        """
+        Rows with first <= BedID <= last, in BedID order.
+        """
+        conditions = []
+        if first is not None:
+            conditions.append(('BedID', '>=', (str(first),)))
+        if last is not None:
+            conditions.append(('BedID', '<=', (str(last),)))
+        return self.select(conditions)
+
+
+def _int_predicate(index, operator, values):
+    value = values[0]
+    tests = {
+        '=': lambda x: x == value,
+        '!=': lambda x: x != value,
+        '>': lambda x: x > value,
+        '>=': lambda x: x >= value,
+        '<': lambda x: x < value,
+        '<=': lambda x: x <= value,
+        'IN': lambda x: x in values,
+        'BETWEEN': lambda x: values[0] <= x <= values[-1],
+    }
+    test = tests[operator]
+    # Comparisons with NULL are never true in SQL
+    return lambda row: row[index] is not None and test(row[index])
+
+
+def _text_predicate(index, operator, keys):
+    if operator == 'PREFIX':
+        # LIKE doesn't ignore trailing spaces, so the prefix is only lowercased
+        prefix = keys[0].lower()
+        return lambda row: row[index] is not None and row[index].lower().startswith(prefix)
+    if operator == '!=':
+        return lambda row: row[index] is not None and _text_key(row[index]) != keys[0]
+    wanted = set(keys)
+    return lambda row: row[index] is not None and _text_key(row[index]) in wanted
+
+
+bed_store = BedStore()
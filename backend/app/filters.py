@@ -0,0 +1,167 @@
+import re
+import threading
+import time
+from functools import lru_cache
+from os import getenv
+
+from initiate import execute_query
+
+# Columns the API may filter on, per table
+TABLE_COLUMNS = {
+    'Patient': ['PatientID', 'Name', 'Phone', 'Age', 'Sex'],
+    'Bed': ['BedID', 'Type', 'Location', 'Status', 'Pid'],
+    'Medicine': ['MediID', 'MediName', 'Price', 'Qty', 'Expiry'],
+    'History': ['PID', 'Doctor', 'Date', 'PrescriptionID'],
+    'Meditag': ['MediID', 'MediTag'],
+}
+
+# Columns that lead an index, so a condition on them avoids a full table scan
+# (primary keys plus the secondary indexes added in migrations.py)
+INDEXED_COLUMNS = {
+    'Patient': {'PatientID', 'Phone'},
+    'Bed': {'BedID', 'Status', 'Pid'},
+    'Medicine': {'MediID', 'Expiry', 'Qty'},
+    'History': {'PID', 'Date'},
+    'Meditag': {'MediID'},
+}
+
+# Filters on unindexed columns only are rejected above this many rows (0 disables the check)
+FILTER_SCAN_LIMIT = int(getenv('FILTER_SCAN_LIMIT', 100000))
+FILTER_CACHE_SIZE = int(getenv('FILTER_CACHE_SIZE', 1024))
+
+_COLUMN_LOOKUP = {table: {column.lower(): column for column in columns} for table, columns in TABLE_COLUMNS.items()}
+_WORD_FILTER = re.compile(r'^\s*(\w+)\s+(in|between)\s+(.*)$', re.IGNORECASE)
+_SYMBOL_FILTER = re.compile(r'^\s*(\w+)\s*(>=|<=|!=|<>|\^=|=|>|<)(.*)$')
+# != cannot use an index range, every other operator can
+_SARGABLE = {'=', '>', '<', '>=', '<=', 'IN', 'BETWEEN', 'PREFIX'}
+
+
+class FilterError(ValueError):
+    """
+    Raised for filters that name unknown columns, are malformed, or would scan too much.
+    """
+
+
+def _parse_one(table, filter_str):
+    match = _WORD_FILTER.match(filter_str)
+    if match:
+        column, operator, value = match.group(1), match.group(2).upper(), match.group(3)
+        values = tuple(part.strip() for part in value.split('|'))
+        if operator == 'BETWEEN' and len(values) != 2:
+            raise FilterError(f"BETWEEN needs exactly two values separated by '|': {filter_str!r}")
+    else:
+        match = _SYMBOL_FILTER.match(filter_str)
+        if not match:
+            raise FilterError(f"Cannot parse filter {filter_str!r}")
+        column, operator, value = match.groups()
+        operator = {'<>': '!=', '^=': 'PREFIX'}.get(operator, operator)
+        values = (value.strip(),)
+
+    canonical = _COLUMN_LOOKUP[table].get(column.lower())
+    if canonical is None:
+        raise FilterError(f"Unknown column {column!r} for {table}; expected one of {', '.join(TABLE_COLUMNS[table])}")
+    if operator == 'IN':
+        values = tuple(sorted(set(values)))
+    return canonical, operator, values
+
+
+@lru_cache(maxsize=FILTER_CACHE_SIZE)
+def _parse(table, filters):
+    """
+    Parse a raw `filters` string into a canonical, de-duplicated, sorted tuple of
+    (column, operator, values). Cached on the raw string, so repeated polls skip parsing.
+    """
+    if table not in TABLE_COLUMNS:
+        raise FilterError(f"Unknown table {table!r}")
+    conditions = {_parse_one(table, part) for part in filters.split(',') if part.strip()}
+    return tuple(sorted(conditions))
+
+
+@lru_cache(maxsize=FILTER_CACHE_SIZE)
+def _render(shape):
+    """
+    Build the WHERE clause for a canonical shape of (column, operator, value count).
+    Equivalent filter sets share one shape and therefore one cached SQL string.
+    """
+    clauses = []
+    for column, operator, count in shape:
+        if operator == 'IN':
+            clauses.append(f"{column} IN ({', '.join(['%s'] * count)})")
+        elif operator == 'BETWEEN':
+            clauses.append(f"{column} BETWEEN %s AND %s")
+        elif operator == 'PREFIX':
+            clauses.append(f"{column} LIKE %s")
+        else:
+            clauses.append(f"{column} {operator} %s")
+    return ' AND '.join(clauses)
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def compile_filters(table, filters):
+    """
+    Compile a comma-separated filter string for `table` into (where_sql, values).
+
+    Supported forms: `col=v`, `col!=v`, `col>v`, `col>=v`, `col<v`, `col<=v`,
+    `col^=prefix`, `col in a|b|c` and `col between a|b`. Column names are
+    matched case-insensitively against TABLE_COLUMNS; anything else raises FilterError.
+    """
+    conditions = _parse(table, filters)
+    where = _render(tuple((column, operator, len(values)) for column, operator, values in conditions))
+    values = []
+    for column, operator, condition_values in conditions:
+        if operator == 'PREFIX':
+            values.append(_escape_like(condition_values[0]))
+        else:
+            values.extend(condition_values)
+    return where, values
+
+
+def parse_conditions(table, filters):
+    """
+    The canonical (column, operator, values) conditions of a filter string,
+    for callers that evaluate filters themselves instead of in SQL.
+    """
+    return _parse(table, filters)
+
+
+def uses_index(table, filters):
+    """
+    True when at least one condition can be answered through an index.
+    """
+    return any(operator in _SARGABLE and column in INDEXED_COLUMNS[table]
+               for column, operator, values in _parse(table, filters))
+
+
+_row_estimates = {}
+_row_estimates_lock = threading.Lock()
+
+def estimate_rows(connection, table, max_age=60):
+    """
+    Approximate row count from information_schema, cached for `max_age` seconds.
+    """
+    now = time.monotonic()
+    cached = _row_estimates.get(table)
+    if cached and now - cached[1] < max_age:
+        return cached[0]
+    result = execute_query(connection,
+        "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table,))
+    rows = int(result[0][0] or 0) if result else 0
+    with _row_estimates_lock:
+        _row_estimates[table] = (rows, now)
+    return rows
+
+
+def check_scan(connection, table, filters):
+    """
+    Raise FilterError when `filters` only touch unindexed columns of a table
+    larger than FILTER_SCAN_LIMIT rows.
+    """
+    if not FILTER_SCAN_LIMIT or not _parse(table, filters) or uses_index(table, filters):
+        return
+    rows = estimate_rows(connection, table)
+    if rows > FILTER_SCAN_LIMIT:
+        indexed = ', '.join(sorted(INDEXED_COLUMNS[table]))
+        raise FilterError(f"Filters on unindexed columns would scan ~{rows} {table} rows; add a filter on one of: {indexed}")
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import zlib
+from os import getenv, getpid
+
+import metrics
+
+# Comma-separated base URLs of the backend instances to federate, e.g.
+# "http://hospital-a:6000,http://hospital-b:6000"; empty turns gateway mode off
+GATEWAY_UPSTREAMS = [url.strip() for url in getenv('GATEWAY_UPSTREAMS', '').split(',') if url.strip()]
+# Seconds one upstream may take before the others are answered without it
+GATEWAY_TIMEOUT = float(getenv('GATEWAY_TIMEOUT', 2))
+# Seconds between polls of each upstream, i.e. how stale the merged view may be
+GATEWAY_CACHE_TTL = float(getenv('GATEWAY_CACHE_TTL', 1))
+GATEWAY_CACHED_RANGES = 64
+
+upstream_latency = metrics.Histogram('gateway_upstream_seconds', 'Time to refresh one upstream backend, timeouts included.', ('upstream',))
+upstream_errors = metrics.Counter('gateway_upstream_errors_total', 'Upstream refreshes that failed or timed out.', ('upstream',))
+
+
+def parse_upstream(url):
+    # "http://host:port" -> ("host", port)
+    host = url.split("://", 1)[-1].split("/", 1)[0]
+    if ":" in host:
+        host, port = host.split(":", 1)
+        return host, int(port)
+    return host, 80
+
+
+async def http_get(host, port, path):
+    """
+    GET `path` on a fresh connection and return (status, headers, body).
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, value = line.decode('latin-1').split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+        if 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()  # Body runs to the end of the connection
+        return status, headers, body
+    finally:
+        writer.close()
+
+
+class Upstream:
+    """
+    One backend instance and the bed state last fetched from it, kept current
+    with /beds/changes so an unchanged hospital costs a 204.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.host, self.port = parse_upstream(url)
+        self.hospital = None  # HOSPITAL_NAME from /details
+        self.version = 0
+        self.beds = {}  # BedID -> row
+        self.ok = None  # whether the latest refresh succeeded; None before the first
+
+    async def refresh(self):
+        """
+        Fetch what changed since the last refresh; returns whether any bed did.
+        """
+        if self.hospital is None:
+            status, headers, body = await http_get(self.host, self.port, "/details")
+            if status != 200:
+                raise OSError(f"/details answered HTTP {status}")
+            self.hospital = json.loads(body)["hospital_name"]
+        status, headers, body = await http_get(self.host, self.port, f"/beds/changes?since={self.version}")
+        if status == 204:
+            self.version = int(headers.get('x-bed-version', self.version))
+            return False
+        if status != 200:
+            raise OSError(f"/beds/changes answered HTTP {status}")
+        changes = json.loads(body)
+        if changes["full"]:
+            self.beds = {}
+        for row in changes["beds"]:
+            self.beds[row[0]] = row
+        self.version = changes["version"]
+        return True
+
+
+class Gateway:
+    """
+    Merged bed status of several backend instances, keyed by hospital and
+    BedID. A background event loop per process polls every upstream on its
+    own task, once per `ttl` and each attempt bounded by `timeout`, the way
+    the dome firmware does; requests only read the merged view, whose encoded
+    body is cached until an upstream reports a change. An upstream that fails
+    keeps its last known beds and is marked stale, so one slow hospital never
+    holds up the rest. Upstreams reporting the same hospital name are listed
+    separately as "<name> (<url>)", with a warning.
+
+    Versions are a checksum of the response body, so every worker (and every
+    gateway instance) hands out the same version for the same view.
+    """
+
+    def __init__(self, urls, timeout=GATEWAY_TIMEOUT, ttl=GATEWAY_CACHE_TTL):
+        self.upstreams = [Upstream(url) for url in urls]
+        self.timeout = timeout
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._pid = None
+        self._hospitals = {}  # hospital -> {"stale": bool, "beds": [rows in BedID order]}
+        self._bodies = {}  # (first, last) -> (version, encoded body)
+        self._duplicates = set()  # hospital names already warned about
+
+    def view(self, first=None, last=None):
+        """
+        (version, encoded JSON body) of the merged view, limited to BedIDs in [first, last].
+        """
+        self.start()
+        # Only requests arriving before the first round of polls wait, for at most `timeout`
+        self._ready.wait(self.timeout + 1)
+        with self._lock:
+            cached = self._bodies.get((first, last))
+            if cached is None:
+                hospitals = {
+                    name: {"stale": merged["stale"],
+                           "beds": [row for row in merged["beds"]
+                                    if (first is None or row[0] >= first) and (last is None or row[0] <= last)]}
+                    for name, merged in self._hospitals.items()
+                }
+                encoded = json.dumps(hospitals, sort_keys=True)
+                version = zlib.crc32(encoded.encode())
+                cached = (version, f'{{"version": {version}, "hospitals": {encoded}}}')
+                if len(self._bodies) >= GATEWAY_CACHED_RANGES:
+                    self._bodies.clear()
+                self._bodies[(first, last)] = cached
+            return cached
+
+    def start(self):
+        """
+        Start polling in this process; view() does it on first use, and
+        gunicorn.conf.py at worker boot so no request waits for the first round.
+        """
+        if self._pid == getpid():
+            return
+        with self._lock:
+            if self._pid != getpid():
+                # First use in this process (threads don't survive fork)
+                self._pid = getpid()
+                self._ready = threading.Event()
+                threading.Thread(target=asyncio.run, args=(self._run(),), name='gateway', daemon=True).start()
+
+    async def _run(self):
+        await asyncio.gather(*(self._refresh(upstream) for upstream in self.upstreams))
+        self._ready.set()
+        await asyncio.gather(*(self._poll(upstream) for upstream in self.upstreams))
+
+    async def _poll(self, upstream):
+        while True:
+            await asyncio.sleep(self.ttl)
+            await self._refresh(upstream)
+
+    async def _refresh(self, upstream):
+        started = time.perf_counter()
+        was_ok = upstream.ok
+        try:
+            changed = await asyncio.wait_for(upstream.refresh(), self.timeout)
+            upstream.ok = True
+            if was_ok is False:
+                logging.info(f"Gateway upstream {upstream.url} is back")
+        except Exception as e:
+            changed = False
+            upstream.ok = False
+            upstream_errors.inc((upstream.url,))
+            if was_ok is not False:
+                # Logged once per outage; gateway_upstream_errors_total counts every attempt
+                logging.warning(f"Gateway upstream {upstream.url} failed: {e!r}")
+        upstream_latency.observe((upstream.url,), time.perf_counter() - started)
+        if changed or upstream.ok != was_ok or not self._hospitals:
+            self._merge()
+
+    def _merge(self):
+        # An upstream never reached yet shows up under its URL
+        names = {}
+        for upstream in self.upstreams:
+            names.setdefault(upstream.hospital or upstream.url, []).append(upstream)
+        hospitals = {}
+        for name, upstreams in names.items():
+            if len(upstreams) > 1 and name not in self._duplicates:
+                self._duplicates.add(name)
+                logging.warning(f"Gateway upstreams {', '.join(upstream.url for upstream in upstreams)} all report "
+                                f"hospital {name!r}; listing each as '{name} (<url>)'. Give them distinct HOSPITAL_NAMEs.")
+            for upstream in upstreams:
+                # BedIDs are only unique within one backend, so same-named upstreams are never merged
+                key = name if len(upstreams) == 1 else f"{name} ({upstream.url})"
+                hospitals[key] = {"stale": not upstream.ok, "beds": [upstream.beds[bed_id] for bed_id in sorted(upstream.beds)]}
+        with self._lock:
+            self._hospitals = hospitals
+            self._bodies = {}
+
+gateway = Gateway(GATEWAY_UPSTREAMS) if GATEWAY_UPSTREAMS else None
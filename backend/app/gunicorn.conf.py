@@ -0,0 +1,85 @@
+# Production server settings: gunicorn -c gunicorn.conf.py backend:app
+#
+# Send SIGHUP to the master for a graceful reload: new workers start with fresh
+# code while old ones finish their in-flight requests.
+import multiprocessing
+from os import getenv
+
+bind = f"0.0.0.0:{getenv('PORT', 5000)}"
+
+# Pre-forked workers sized to the CPU count
+workers = int(getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# The handlers mostly wait on MySQL, so each worker serves requests concurrently:
+# 'gevent' (the default) uses greenlets, so each /beds/stream or /beds/wait
+# subscriber costs a greenlet rather than an OS thread. 'gthread' uses a pool of
+# `threads` per worker, and every subscriber holds one of them; backend.py then
+# admits at most BED_SUBSCRIBERS_PER_WORKER (default threads // 2) subscribers per
+# worker and answers 503 beyond that. 'sync' is one request at a time.
+worker_class = getenv('WORKER_CLASS', 'gevent')
+threads = int(getenv('WORKER_THREADS', 8))
+worker_connections = int(getenv('WORKER_CONNECTIONS', 1000))
+
+# Recycle workers after a number of requests (jittered so they don't all restart together)
+max_requests = int(getenv('MAX_REQUESTS', 10000))
+max_requests_jitter = int(getenv('MAX_REQUESTS_JITTER', 1000))
+timeout = int(getenv('WORKER_TIMEOUT', 60))
+graceful_timeout = int(getenv('GRACEFUL_TIMEOUT', 30))
+# Seconds an idle keep-alive connection stays open. Domes reuse one connection
+# and poll every second, so this must stay above the firmware's POLL_INTERVAL_MS.
+# The 'sync' worker class ignores it and closes every connection.
+keepalive = int(getenv('KEEPALIVE', 5))
+
+# Load the app in each worker after fork, so every worker builds its own
+# connection pool. With PRELOAD_APP=1 the app is imported once in the master
+# and post_fork throws away anything inherited instead.
+preload_app = getenv('PRELOAD_APP', '0') == '1'
+
+accesslog = getenv('ACCESS_LOG', None)
+
+CHANGE_LOGS = [('BED_LOG_FILE', 'beds'), ('MEDICINE_LOG_FILE', 'medicines'), ('PATIENT_LOG_FILE', 'patients')]
+
+
+def on_starting(server):
+    import metrics
+    metrics.clear_dir()
+    # Shared change logs that keep the workers' bed stores and caches in step
+    # (see bedstore.py, medicines.py and timeline.py)
+    import os
+    import tempfile
+    shm = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    for variable, name in CHANGE_LOGS:
+        path = os.environ.setdefault(variable, os.path.join(shm, f'hospital-{name}-{os.getpid()}.log'))
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def on_exit(server):
+    import os
+    for variable, name in CHANGE_LOGS:
+        path = os.environ.get(variable)
+        if path and os.path.exists(path):
+            os.unlink(path)
+
+
+def post_fork(server, worker):
+    import initiate
+    initiate.reset_pools()
+    server.log.info(f"Worker {worker.pid} started with a fresh connection pool")
+
+
+def post_worker_init(worker):
+    from gateway import gateway
+    if gateway is not None:
+        gateway.start()
+
+
+def worker_exit(server, worker):
+    import metrics
+    metrics.flush()
+
+
+def child_exit(server, worker):
+    # Keep the exited worker's counters in /metrics totals
+    import metrics
+    metrics.archive_process(worker.pid)
@@ -1,12 +1,37 @@
 import mysql.connector
 from faker import Faker
-from random import choice, randint,random
+from random import choice, randint,random, sample
 from os import getenv
+from datetime import date, timedelta
+from uuid import uuid4
+from itertools import islice
+import argparse
 import logging
+import threading
+import time
+from pool import ConnectionPool
+import metrics
+import slowlog
+import replicas
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 
+def use_pure_protocol():
+    """
+    Whether to use mysql-connector's pure-Python protocol. The C extension
+    waits on its socket inside C, where gevent can't switch greenlets, so
+    under gevent (gunicorn's gevent worker or SERVER_MODE=gevent) one query
+    would stall every request in the worker. MYSQL_USE_PURE=0/1 overrides.
+    """
+    if getenv('MYSQL_USE_PURE') is not None:
+        return getenv('MYSQL_USE_PURE') == '1'
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
 # Establish connection to the MySQL server
 def create_connection(host_name, user_name, user_password, db_name=None):
     connection = None
@@ -15,7 +40,8 @@ def create_connection(host_name, user_name, user_password, db_name=None):
             host=host_name,
             user=user_name,
             password=user_password,
-            database=db_name
+            database=db_name,
+            use_pure=use_pure_protocol()
         )
         if connection.is_connected():
             logging.info("Connection to MySQL DB successful")
@@ -27,24 +53,40 @@ def create_connection(host_name, user_name, user_password, db_name=None):
         raise
 
 # Execute a query
-def execute_query(connection, query, data=None):
+def execute_query(connection, query, data=None, commit=True):
     if connection is None:  # Check if connection is valid
         logging.error("No valid connection. Cannot execute query.")
         return None
-    cursor = connection.cursor()
+    # Parameterised single statements reuse a server-side prepared statement
+    # when the connection carries a statement cache (pooled connections do)
+    statements = None
+    if data is not None and not isinstance(data[0], tuple):
+        statements = getattr(connection, 'statement_cache', None)
+    if statements is not None:
+        query, cursor = statements.get(query)
+    else:
+        cursor = connection.cursor()
+    started = time.perf_counter()
     try:
         if data is None:
             cursor.execute(query)
         elif isinstance(data[0], tuple):
             cursor.executemany(query, data)
         else:
-            cursor.execute(query, data)
+            cursor.execute(query, tuple(data))
 
         if cursor.with_rows:  # Check if the query has a result set
             result = cursor.fetchall()
+            elapsed = time.perf_counter() - started
+            metrics.observe_query(query, elapsed, len(result))
+            slowlog.record(connection, query, data, elapsed, len(result))
             return result
         
-        connection.commit()
+        if commit:
+            connection.commit()
+        elapsed = time.perf_counter() - started
+        metrics.observe_query(query, elapsed, 0)
+        slowlog.record(connection, query, data, elapsed, cursor.rowcount)
         status_message = {
             "message": "Query OK",
             "rows_matched": cursor.rowcount,  # Rows matched would be the same as affected in most cases
@@ -56,10 +98,52 @@ def execute_query(connection, query, data=None):
     except Exception as e:
         logging.error("While executing"+query.strip().replace('\n', ' ').strip()[:100])
         logging.error(f"The Exception '{e}' occurred")
+        metrics.observe_query_error(query)
+        if statements is not None:
+            statements.discard(query)  # Don't reuse a cursor left in an unknown state
         raise
     finally:
-        cursor.close()  # Ensure the cursor is closed after use
+        if statements is None:
+            cursor.close()  # Ensure the cursor is closed after use
         
+def stream_query(connection, query, data=None, batch_size=1000):
+    """
+    Run a SELECT on an unbuffered cursor and yield its rows in lists of at most
+    `batch_size`, so the full result set is never held in memory. If iteration
+    stops before the last row, the pooled `connection` is discarded.
+    """
+    cursor = connection.cursor()
+    # Only time spent in the driver counts, not time the consumer holds each batch
+    started = time.perf_counter()
+    busy, count = 0.0, 0
+    finished = False
+    try:
+        cursor.execute(query, data)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            busy += time.perf_counter() - started
+            if not rows:
+                break
+            count += len(rows)
+            yield rows
+            started = time.perf_counter()
+        finished = True
+        metrics.observe_query(query, busy, count)
+        slowlog.record(connection, query, data, busy, count)
+    except Exception as e:
+        logging.error("While streaming"+query.strip().replace('\n', ' ').strip()[:100])
+        logging.error(f"The Exception '{e}' occurred")
+        metrics.observe_query_error(query)
+        raise
+    finally:
+        if finished:
+            cursor.close()
+        else:
+            # Stopped early (the consumer went away or a fetch failed): unread rows
+            # may be pending, and closing the cursor or rolling back would first
+            # read them all, so the connection is closed instead of reused
+            connection.discard()
+
 def insert_random_data(connection, insert_patients=False, insert_beds=False, insert_history=False, insert_medicines=False, insert_meditags=False):
     fake = Faker()
     logging.info("Inserting random data into the database...")
@@ -145,25 +229,206 @@ def insert_random_data(connection, insert_patients=False, insert_beds=False, ins
 
     return combined_results
 
+MEDITAGS = ['Painkiller', 'Antibiotic', 'Supplement', 'Antiseptic']
+
+def insert_rows(connection, table, query, rows, chunk_size):
+    """
+    Insert rows from any iterable with multi-row executemany, committing once per
+    chunk of `chunk_size` rows. A failing chunk is rolled back before the error
+    is raised; earlier chunks stay committed. Returns rows, seconds and rows/sec.
+    """
+    inserted = 0
+    rows = iter(rows)
+    start = time.perf_counter()
+    while True:
+        chunk = [tuple(row) for row in islice(rows, chunk_size)]
+        if not chunk:
+            break
+        try:
+            execute_query(connection, query, chunk, commit=False)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        inserted += len(chunk)
+        logging.debug(f"{table}: {inserted} rows inserted")
+    elapsed = time.perf_counter() - start
+    rate = inserted / elapsed if elapsed else 0.0
+    logging.info(f"Inserted {inserted} {table} rows in {elapsed:.2f}s ({rate:.0f} rows/sec)")
+    return {"table": table, "rows": inserted, "seconds": round(elapsed, 3), "rows_per_sec": round(rate, 1)}
+
+def import_rows(connection, table, columns, rows, chunk_size=5000, skip_duplicates=False):
+    """
+    Insert `rows` (sequences ordered like `columns`) into `table` in chunked
+    transactions. Column names must already be checked against the schema.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    query = f"INSERT {'IGNORE ' if skip_duplicates else ''}INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+    return insert_rows(connection, table, query, rows, chunk_size)
+
+def _fetch_ids(connection, query):
+    return [row[0] for row in execute_query(connection, query) or []]
+
+def seed_bulk(connection, patients=0, beds=0, history=0, medicines=0, meditags=0, chunk_size=5000):
+    """
+    Bulk seeding for load tests. Rows are generated and written in chunks of
+    `chunk_size`, one transaction per chunk. Bed.Pid and History.PID only point
+    at PatientIDs that exist and Meditag only tags Medicine rows that exist.
+    Returns per-table row counts, durations and rows/sec.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    fake = Faker()
+    # Faker is slow per call; draw from small pre-generated pools instead
+    names = [fake.name() for _ in range(min(max(patients, history), 1000))]
+    phones = [fake.phone_number()[:14] for _ in range(min(patients, 1000))]
+    today = date.today()
+    summary = []
+
+    if patients:
+        summary.append(insert_rows(connection, 'Patient',
+            "INSERT INTO Patient (Name, Phone, Age, Sex) VALUES (%s, %s, %s, %s)",
+            ((choice(names), choice(phones), randint(1, 100), choice(['M', 'F'])) for _ in range(patients)),
+            chunk_size))
+
+    if medicines:
+        summary.append(insert_rows(connection, 'Medicine',
+            "INSERT INTO Medicine (MediName, Qty, Expiry, Price) VALUES (%s, %s, %s, %s)",
+            ((generate_medication_name(), randint(1, 100), today + timedelta(days=randint(-365, 730)), max(10, random()*1000)) for _ in range(medicines)),
+            chunk_size))
+
+    patient_ids = _fetch_ids(connection, "SELECT PatientID FROM Patient") if beds or history else []
+
+    if beds:
+        def bed_row():
+            status = choice(['Available', 'Occupied', 'Reserved'])
+            pid = choice(patient_ids) if status != 'Available' and patient_ids else None
+            return (choice(['General', 'ICU', 'Private']), f"{choice(['A', 'B', 'C'])}/{randint(0, 3)}{randint(10, 99)}", status, pid)
+        summary.append(insert_rows(connection, 'Bed',
+            "INSERT INTO Bed (Type, Location, Status, Pid) VALUES (%s, %s, %s, %s)",
+            (bed_row() for _ in range(beds)), chunk_size))
+
+    if history:
+        if not patient_ids:
+            raise ValueError("Cannot seed History without any Patient rows")
+        summary.append(insert_rows(connection, 'History',
+            "INSERT INTO History (PID, Doctor, Date, PrescriptionID) VALUES (%s, %s, %s, %s)",
+            ((choice(patient_ids), choice(names), today - timedelta(days=randint(0, 365)), uuid4().hex[:12]) for _ in range(history)),
+            chunk_size))
+
+    if meditags:
+        medicine_ids = _fetch_ids(connection, "SELECT MediID FROM Medicine")
+        if not medicine_ids:
+            raise ValueError("Cannot seed Meditag without any Medicine rows")
+        # Draw distinct (MediID, MediTag) pairs so a chunk never repeats a primary key
+        pairs = sample(range(len(medicine_ids) * len(MEDITAGS)), min(meditags, len(medicine_ids) * len(MEDITAGS)))
+        # IGNORE skips pairs that an earlier seeding run already tagged
+        summary.append(insert_rows(connection, 'Meditag',
+            "INSERT IGNORE INTO Meditag (MediID, MediTag) VALUES (%s, %s)",
+            ((medicine_ids[i // len(MEDITAGS)], MEDITAGS[i % len(MEDITAGS)]) for i in pairs), chunk_size))
+
+    return summary
+
 def generate_medication_name():
     base_names = ["Aero", "Cura", "Helio", "Nova", "Vita", "Zeno", "Riva", "Lumen", "Medi", "Nex"]
     modifiers = ["Clear", "Max", "Prime", "Sure", "Ultra", "Gen", "Flex", "Opti", "Plus", "Pure"]
     suffixes = ["-in", "-ol", "-ex", "-am", "-an", "-ium", "-or", "-ide", "-ine", "-ar"]
     return f"{choice(base_names)}{choice(modifiers)}{choice(suffixes)}"
 
+# Connection pools, one per (host, user, database) so every handler reuses warm connections
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(host_name, user_name, user_password, db_name=None):
+    key = (host_name, user_name, user_password, db_name)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(
+                    lambda: create_connection(host_name, user_name, user_password, db_name),
+                    size=int(getenv('MYSQL_POOL_SIZE', 10)),
+                    timeout=float(getenv('MYSQL_POOL_TIMEOUT', 5)),
+                    idle_timeout=float(getenv('MYSQL_POOL_IDLE_TIMEOUT', 300)),
+                    max_lifetime=float(getenv('MYSQL_POOL_MAX_LIFETIME', 1800)),
+                    ping_interval=float(getenv('MYSQL_POOL_PING_INTERVAL', 30)),
+                    name=f"{host_name}/{db_name or ''}"
+                )
+                _pools[key] = pool
+    return pool
+
+@metrics.collector
+def collect_pool_metrics():
+    for pool in list(_pools.values()):
+        stats = pool.stats()
+        metrics.pool_connections.set((pool.name, 'in_use'), stats["in_use"])
+        metrics.pool_connections.set((pool.name, 'idle'), stats["idle"])
+        metrics.pool_connections.set((pool.name, 'max'), stats["size"])
+
+def reset_pools():
+    """
+    Forget every pool without closing its sockets, which after fork() still
+    belong to the parent process. Called from the gunicorn post_fork hook.
+    """
+    with _pools_lock:
+        _pools.clear()
+
 def retrieve_connection(
     host_name=getenv('MYSQL_HOST','127.0.0.1'),  # Use 'mysql' as hostname within Docker network
     user_name=getenv('MYSQL_USER','root'),
     user_password=getenv('MYSQL_PASSWORD','password'),
-    db_name=getenv('MYSQL_DATABASE','hospital_db')
+    db_name=getenv('MYSQL_DATABASE','hospital_db'),
+    read_only=False
 ):
-    connection = create_connection(host_name, user_name, user_password, db_name)
-    if connection.is_connected():
-        return connection
-    else:
-        raise mysql.connector.Error("Connection to MySQL DB failed")
+    """
+    Check out a connection from the pool for these credentials.
+    Closing it (or leaving its `with` block) returns it to the pool.
+    The pool pings connections that sat idle, so no extra round trip is made here.
+
+    With read_only and MYSQL_REPLICAS set, the connection comes from a replica
+    within REPLICA_MAX_LAG instead, unless this client wrote recently (see
+    replicas.pin_primary). Only pass read_only for reads that tolerate a
+    second or two of staleness and run no writes on the connection.
+    """
+    if read_only and replica_set.hosts:
+        if replicas.pinned():
+            replicas.read_routing.inc(('primary_pinned',))
+        else:
+            replica = replica_set.choose()
+            if replica is not None:
+                try:
+                    connection = get_pool(replica, user_name, user_password, db_name).acquire()
+                    replicas.read_routing.inc(('replica',))
+                    return connection
+                except Exception as e:
+                    logging.warning(f"Replica {replica} unavailable, reading from the primary: {e}")
+                    if not isinstance(e, mysql.connector.errors.PoolError):
+                        replica_set.mark_down(replica)
+            replicas.read_routing.inc(('primary_fallback',))
+    return get_pool(host_name, user_name, user_password, db_name).acquire()
+
+replica_set = replicas.ReplicaSet(replicas.MYSQL_REPLICAS, lambda host: retrieve_connection(host_name=host))
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrate the hospital_db schema and optionally bulk-seed it.")
+    seeding = parser.add_argument_group('bulk seeding')
+    seeding.add_argument('--patients', type=int, default=0, help="Patient rows to generate")
+    seeding.add_argument('--beds', type=int, default=0, help="Bed rows to generate")
+    seeding.add_argument('--history', type=int, default=0, help="History rows to generate")
+    seeding.add_argument('--medicines', type=int, default=0, help="Medicine rows to generate")
+    seeding.add_argument('--meditags', type=int, default=0, help="Meditag rows to generate")
+    seeding.add_argument('--chunk-size', type=int, default=5000, help="Rows per transaction")
+    parser.add_argument('--check-plans', action='store_true', help="EXPLAIN the endpoint queries and fail on full table scans")
+    importing = parser.add_argument_group('bulk import')
+    importing.add_argument('--import-file', help="CSV or NDJSON file to import (optionally .gz)")
+    importing.add_argument('--import-table', choices=['Patient', 'History'], help="Table to import into")
+    importing.add_argument('--import-format', choices=['csv', 'ndjson'], help="Defaults to the file extension")
+    importing.add_argument('--skip-duplicates', action='store_true', help="Skip rows whose primary key already exists")
+    args = parser.parse_args()
+    if args.import_file and not args.import_table:
+        parser.error("--import-file needs --import-table")
 
     connection = retrieve_connection()
     
@@ -171,54 +436,28 @@ if __name__ == '__main__':
     create_database_query = "CREATE DATABASE IF NOT EXISTS hospital_db"
     execute_query(connection, create_database_query)
     
-    # Create Tables
-    create_bed_table = """
-    CREATE TABLE IF NOT EXISTS Bed (
-        BedID INT AUTO_INCREMENT PRIMARY KEY,
-        Type VARCHAR(50),
-        Location VARCHAR(100),
-        Status VARCHAR(50),
-        Pid INT
-    );
-    """
-    create_medicine_table = """
-    CREATE TABLE IF NOT EXISTS Medicine (
-        MediID INT AUTO_INCREMENT PRIMARY KEY,
-        MediName VARCHAR(100),
-        Price INT,
-        Qty INT,
-        Expiry DATE
-    );
-    """
-    create_meditag_table = '''
-    CREATE TABLE IF NOT EXISTS Meditag (
-        MediID INT,
-        MediTag VARCHAR(50),
-        FOREIGN KEY (MediID) REFERENCES Medicine(MediID),
-        PRIMARY KEY (MediID, MediTag)
-    );
-    '''
-    create_patient_table = """
-    CREATE TABLE IF NOT EXISTS Patient (
-        PatientID INT AUTO_INCREMENT PRIMARY KEY,
-        Name VARCHAR(100),
-        Phone VARCHAR(15),
-        Age INT,
-        Sex CHAR(1)
-    );
-    """
-    create_history_table = """
-    CREATE TABLE IF NOT EXISTS History (
-        PID INT,
-        Doctor VARCHAR(100),
-        Date DATE,
-        PrescriptionID VARCHAR(50),
-        FOREIGN KEY (PID) REFERENCES Patient(PatientID),
-        PRIMARY KEY (PID, Date, PrescriptionID)
-    );
-    """
-    
-    for query in [create_bed_table, create_medicine_table, create_patient_table, create_history_table, create_meditag_table]:
-        execute_query(connection, query)
+    # Create or upgrade tables; a database already at the latest version is left untouched
+    from migrations import migrate, check_query_plans
+    migrate(connection)
+
+    if args.check_plans:
+        failures = check_query_plans(connection)
+        if failures:
+            connection.close()
+            raise SystemExit(f"Full table scans in: {', '.join(failures)}")
+        logging.info("All endpoint queries use an index")
+
+    if args.patients or args.beds or args.history or args.medicines or args.meditags:
+        seed_bulk(connection, args.patients, args.beds, args.history, args.medicines, args.meditags, args.chunk_size)
+
+    if args.import_file:
+        from transfer import open_text, read_rows, resolve_table_format
+        name = args.import_file.lower()
+        compressed = name.endswith('.gz')
+        fmt = args.import_format or ('csv' if name.removesuffix('.gz').endswith('.csv') else 'ndjson')
+        table, fmt = resolve_table_format(args.import_table or '', fmt)
+        with open(args.import_file, 'rb') as f:
+            columns, rows = read_rows(open_text(f, compressed), table, fmt)
+            import_rows(connection, table, columns, rows, args.chunk_size, args.skip_duplicates)
     
     connection.close()
@@ -0,0 +1,121 @@
+import threading
+import time
+from datetime import date, timedelta
+from os import getenv, getpid
+
+from bedstore import ChangeLog
+from initiate import execute_query
+
+# Seconds a cached result may be served, to pick up writes made outside the API
+MEDICINE_CACHE_TTL = float(getenv('MEDICINE_CACHE_TTL', 60))
+MEDICINE_CACHE_SIZE = int(getenv('MEDICINE_CACHE_SIZE', 256))
+
+MEDICINE_COLUMNS = ('MediID', 'MediName', 'Price', 'Qty', 'Expiry')
+
+
+def expiring_query(days, include_expired=False, tags=(), limit=None, today=None):
+    """
+    (query, values) for medicines expiring within `days` days, soonest first.
+    A range on idx_medicine_expiry; already expired stock only when asked for.
+    """
+    today = today or date.today()
+    conditions, values = ["Expiry <= %s"], [today + timedelta(days=days)]
+    if not include_expired:
+        conditions.insert(0, "Expiry >= %s")
+        values.insert(0, today)
+    return _medicine_query(conditions, values, "Expiry, MediID", tags, limit)
+
+
+def low_stock_query(threshold, tags=(), limit=None):
+    """
+    (query, values) for medicines with at most `threshold` units left, lowest first.
+    A range on idx_medicine_qty.
+    """
+    return _medicine_query(["Qty <= %s"], [threshold], "Qty, MediID", tags, limit)
+
+
+def _medicine_query(conditions, values, order, tags, limit):
+    if tags:
+        # Probes the Meditag primary key per candidate row instead of scanning Meditag
+        conditions.append(f"EXISTS (SELECT 1 FROM Meditag WHERE Meditag.MediID = Medicine.MediID AND MediTag IN ({', '.join(['%s'] * len(tags))}))")
+        values.extend(tags)
+    query = f"SELECT {', '.join(MEDICINE_COLUMNS)} FROM Medicine WHERE {' AND '.join(conditions)} ORDER BY {order}"
+    if limit is not None:
+        query += f" LIMIT {int(limit)}"
+    return query, values
+
+
+def medicine_tags_query(medi_ids):
+    """
+    (query, values) for the Meditag rows of these medicines, by primary key.
+    """
+    return f"SELECT MediID, MediTag FROM Meditag WHERE MediID IN ({', '.join(['%s'] * len(medi_ids))}) ORDER BY MediID, MediTag", list(medi_ids)
+
+
+def fetch_medicines(connection, query, values):
+    """
+    Run a medicine query and return one dict per medicine with its Meditag
+    categories under "tags", fetched in one more query by primary key.
+    """
+    medicines = []
+    for row in execute_query(connection, query, values):
+        medicine = dict(zip(MEDICINE_COLUMNS, row))
+        if isinstance(medicine['Expiry'], date):
+            medicine['Expiry'] = medicine['Expiry'].isoformat()
+        medicine['tags'] = []
+        medicines.append(medicine)
+    if medicines:
+        by_id = {medicine['MediID']: medicine for medicine in medicines}
+        ids = sorted(by_id)
+        for medi_id, tag in execute_query(connection, *medicine_tags_query(ids)):
+            by_id[medi_id]['tags'].append(tag)
+    return medicines
+
+
+class MedicineCache:
+    """
+    Results of the medicine stock queries, kept until a write through the API
+    changes stock. Writes bump a generation number held in a shared ChangeLog
+    (MEDICINE_LOG_FILE, created by gunicorn.conf.py), so a set_medicine in one
+    worker invalidates the cache in all of them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (generation, stored at, value), oldest first
+        self._log = None
+        self._pid = None
+
+    @property
+    def log(self):
+        if self._pid != getpid():
+            self._log = ChangeLog(getenv('MEDICINE_LOG_FILE') or None, size=1)
+            self._pid = getpid()
+            self._entries = {}
+        return self._log
+
+    def get(self, key, load):
+        """
+        The cached value for `key`, or load() stored under the current generation.
+        """
+        generation = self.log.head()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == generation and time.monotonic() - entry[1] < MEDICINE_CACHE_TTL:
+                return entry[2]
+        value = load()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (generation, time.monotonic(), value)
+            while len(self._entries) > MEDICINE_CACHE_SIZE:
+                del self._entries[next(iter(self._entries))]
+        return value
+
+    def changed(self):
+        """
+        Called after a committed write to Medicine or Meditag.
+        """
+        self.log.append([0])
+
+
+medicine_cache = MedicineCache()
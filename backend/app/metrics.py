@@ -0,0 +1,348 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from functools import lru_cache
+from os import getenv, getpid
+
+# Under gunicorn every worker keeps its own metrics. When METRICS_DIR is set each
+# worker snapshots them to <pid>.json there and /metrics merges every snapshot,
+# so a scrape shows the whole server whichever worker answers it.
+METRICS_DIR = getenv('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = float(getenv('METRICS_FLUSH_INTERVAL', 5))
+# Distinct label sets kept per metric; anything beyond is counted under "other"
+METRICS_MAX_SERIES = int(getenv('METRICS_MAX_SERIES', 500))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = {}
+_collectors = []
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}  # label values -> value
+        _registry[name] = self
+
+    def _key(self, labels):
+        # Called with the lock held
+        if labels in self._values or len(self._values) < METRICS_MAX_SERIES:
+            return labels
+        return ('other',) * len(self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            key = self._key(labels)
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            key = self._key(labels)
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set(self, labels, value):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """
+    Fixed-bucket histogram. Each series is stored as per-bucket (not cumulative)
+    counts plus one overflow bucket, then the sum; observe() is a bisect and two adds.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            key = self._key(labels)
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), list(series)] for labels, series in self._values.items()]
+
+
+def collector(func):
+    """
+    Register `func` to run right before metrics are rendered or snapshotted,
+    for gauges that are cheaper to read on demand than to keep up to date.
+    """
+    _collectors.append(func)
+    return func
+
+
+def _collect():
+    for func in _collectors:
+        try:
+            func()
+        except Exception as e:
+            logging.warning(f"Metrics collector {func.__name__} failed: {e}")
+    return {name: metric.snapshot() for name, metric in _registry.items()}
+
+
+def _merge(into, snapshot, include_gauges=True):
+    for name, series in snapshot.items():
+        metric = _registry.get(name)
+        if metric is None or (metric.type == 'gauge' and not include_gauges):
+            continue
+        merged = into.setdefault(name, {})
+        for labels, value in series:
+            key = tuple(labels)
+            if key not in merged:
+                merged[key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                merged[key] = [a + b for a, b in zip(merged[key], value)]
+            else:
+                merged[key] += value
+    return into
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+@lru_cache(maxsize=4096)
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render():
+    """
+    Prometheus text exposition (version 0.0.4) of every metric, merged across
+    worker processes when METRICS_DIR is set.
+    """
+    merged = _merge({}, _collect())
+    if METRICS_DIR:
+        merged = {}
+        for snapshot, live in _read_snapshots():
+            _merge(merged, snapshot, include_gauges=live)
+        # Our own snapshot on disk may be stale; use the live values instead
+        _merge(merged, _collect())
+
+    lines = []
+    for name, metric in _registry.items():
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        for labels, value in sorted(merged.get(name, {}).items()):
+            if metric.type != 'histogram':
+                lines.append(f"{name}{_format_labels(metric.labelnames, labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ('+Inf',), value):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(metric.labelnames, labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(metric.labelnames, labels)} {value[-1]}")
+            lines.append(f"{name}_count{_format_labels(metric.labelnames, labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+# --- multi-process support -------------------------------------------------
+
+_ARCHIVE = 'archive.json'
+_flusher_pid = None
+
+
+def _write(path, snapshot):
+    tmp = f"{path}.{getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, path)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _read_snapshots():
+    """
+    Yield (snapshot, live) for every worker snapshot other than our own plus the
+    archive of exited workers, whose gauges no longer mean anything.
+    """
+    own = f"{getpid()}.json"
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        return
+    for name in names:
+        if name == _ARCHIVE:
+            yield _read(os.path.join(METRICS_DIR, name)), False
+        elif name.endswith('.json') and name != own:
+            yield _read(os.path.join(METRICS_DIR, name)), True
+
+
+def flush():
+    """
+    Write this process's metrics to METRICS_DIR/<pid>.json.
+    """
+    if METRICS_DIR:
+        _write(os.path.join(METRICS_DIR, f"{getpid()}.json"), _collect())
+
+
+def start_flusher():
+    """
+    Flush every METRICS_FLUSH_INTERVAL seconds from a daemon thread. Safe to call
+    repeatedly; a forked child starts its own thread on the first call.
+    """
+    global _flusher_pid
+    if not METRICS_DIR or _flusher_pid == getpid():
+        return
+    _flusher_pid = getpid()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+
+    def run():
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                flush()
+            except OSError as e:
+                logging.warning(f"Could not write metrics snapshot: {e}")
+    threading.Thread(target=run, name='metrics-flush', daemon=True).start()
+
+
+def clear_dir():
+    """
+    Remove snapshots left by a previous server run. Called when gunicorn starts.
+    """
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith('.json') or name.endswith('.tmp'):
+            os.remove(os.path.join(METRICS_DIR, name))
+
+
+def archive_process(pid):
+    """
+    Fold an exited worker's counters and histograms into the archive so totals
+    never go backwards, and drop its snapshot. Called from the gunicorn master.
+    """
+    if not METRICS_DIR:
+        return
+    path = os.path.join(METRICS_DIR, f"{pid}.json")
+    snapshot = _read(path)
+    if snapshot:
+        archive_path = os.path.join(METRICS_DIR, _ARCHIVE)
+        merged = _merge({}, _read(archive_path), include_gauges=False)
+        _merge(merged, snapshot, include_gauges=False)
+        _write(archive_path, {name: [[list(labels), value] for labels, value in series.items()]
+                              for name, series in merged.items()})
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# --- instrumentation --------------------------------------------------------
+
+http_in_flight = Gauge('http_requests_in_flight', 'Requests currently being handled.')
+http_duration = Histogram('http_request_duration_seconds',
+                          'Time to produce a response; for streamed responses, time until the body starts.',
+                          ('route', 'method'))
+http_responses = Counter('http_responses_total', 'Responses by route, method and status code.', ('route', 'method', 'status'))
+
+query_duration = Histogram('db_query_duration_seconds', 'execute_query time (execute plus fetch) by statement fingerprint.', ('statement',))
+query_rows = Counter('db_query_rows_total', 'Rows returned to the application by statement fingerprint.', ('statement',))
+query_errors = Counter('db_query_errors_total', 'Statements that raised, by statement fingerprint.', ('statement',))
+
+pool_acquire = Histogram('db_pool_acquire_seconds', 'Time spent waiting to check a connection out of the pool.', ('pool',))
+pool_exhausted = Counter('db_pool_exhausted_total', 'acquire() calls that timed out because every connection was in use.', ('pool',))
+pool_connections = Gauge('db_pool_connections', 'Pooled connections by state (in_use, idle) and the configured size (max).', ('pool', 'state'))
+
+
+_LITERALS = re.compile(r"'(?:[^'\\]|\\.)*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_VALUES_LISTS = re.compile(r"\bVALUES\s*(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+", re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(query):
+    """
+    Normalise SQL so every execution of one statement shape shares a label:
+    placeholders and literals become ?, IN lists and multi-row VALUES collapse.
+    """
+    text = _WHITESPACE.sub(' ', query.replace('%s', '?')).strip()
+    text = _LITERALS.sub('?', text)
+    text = _IN_LISTS.sub('IN (...)', text)
+    text = _VALUES_LISTS.sub(r'VALUES \1, ...', text)
+    return text[:200]
+
+
+def observe_query(query, seconds, rows):
+    statement = (fingerprint(query),)
+    query_duration.observe(statement, seconds)
+    if rows:
+        query_rows.inc(statement, rows)
+
+
+def observe_query_error(query):
+    query_errors.inc((fingerprint(query),))
+
+
+def instrument_app(app):
+    """
+    Time every Flask request and count responses by route template
+    (e.g. /export/<table>), so path parameters don't create new series.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        start_flusher()
+        g.metrics_start = time.perf_counter()
+        http_in_flight.inc()
+
+    @app.after_request
+    def _count_response(response):
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_responses.inc((route, request.method, str(response.status_code)))
+        return response
+
+    @app.teardown_request
+    def _stop_timer(exc):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        http_in_flight.dec()
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_duration.observe((route, request.method), time.perf_counter() - start)
@@ -0,0 +1,211 @@
+import logging
+from datetime import date
+
+from bedstore import bed_rows_query
+from initiate import execute_query
+from medicines import expiring_query, low_stock_query, medicine_tags_query
+from search import SEARCH_CANDIDATES_PER_RESULT, patient_search_query, search_terms
+from timeline import timeline_query
+
+create_bed_table = """
+CREATE TABLE IF NOT EXISTS Bed (
+    BedID INT AUTO_INCREMENT PRIMARY KEY,
+    Type VARCHAR(50),
+    Location VARCHAR(100),
+    Status VARCHAR(50),
+    Pid INT
+);
+"""
+create_medicine_table = """
+CREATE TABLE IF NOT EXISTS Medicine (
+    MediID INT AUTO_INCREMENT PRIMARY KEY,
+    MediName VARCHAR(100),
+    Price INT,
+    Qty INT,
+    Expiry DATE
+);
+"""
+create_meditag_table = '''
+CREATE TABLE IF NOT EXISTS Meditag (
+    MediID INT,
+    MediTag VARCHAR(50),
+    FOREIGN KEY (MediID) REFERENCES Medicine(MediID),
+    PRIMARY KEY (MediID, MediTag)
+);
+'''
+create_patient_table = """
+CREATE TABLE IF NOT EXISTS Patient (
+    PatientID INT AUTO_INCREMENT PRIMARY KEY,
+    Name VARCHAR(100),
+    Phone VARCHAR(15),
+    Age INT,
+    Sex CHAR(1)
+);
+"""
+create_history_table = """
+CREATE TABLE IF NOT EXISTS History (
+    PID INT,
+    Doctor VARCHAR(100),
+    Date DATE,
+    PrescriptionID VARCHAR(50),
+    FOREIGN KEY (PID) REFERENCES Patient(PatientID),
+    PRIMARY KEY (PID, Date, PrescriptionID)
+);
+"""
+
+
+def add_index(table, name, columns, kind='INDEX', options=''):
+    """
+    Migration step that adds an index unless one with that name already exists,
+    so a migration interrupted half-way can simply be re-run. `kind` may be
+    e.g. 'FULLTEXT INDEX', and `options` is appended to the ALTER TABLE.
+    """
+    def step(connection):
+        exists = execute_query(connection,
+            "SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s LIMIT 1",
+            (table, name))
+        if exists:
+            logging.info(f"Index {name} on {table} already exists")
+            return
+        execute_query(connection, f"ALTER TABLE {table} ADD {kind} {name} ({columns}){options}")
+    step.__doc__ = f"ADD {kind} {name} ON {table} ({columns}){options}"
+    return step
+
+
+def without_stopwords(step):
+    """
+    Migration step that runs `step` with the full-text stopword list off for
+    this session, restoring the session's setting afterwards even if it fails,
+    so the pooled connection doesn't carry it into later queries.
+    """
+    def wrapped(connection):
+        previous = execute_query(connection, "SELECT @@SESSION.innodb_ft_enable_stopword")[0][0]
+        execute_query(connection, "SET SESSION innodb_ft_enable_stopword = OFF")
+        try:
+            step(connection)
+        finally:
+            execute_query(connection, f"SET SESSION innodb_ft_enable_stopword = {int(previous)}")
+    wrapped.__doc__ = f"{step.__doc__} (stopwords off)"
+    return wrapped
+
+
+# Ordered (version, description, steps). Steps are SQL strings or callables taking a connection.
+# Never edit an applied migration; append a new one instead.
+MIGRATIONS = [
+    (1, "Create base tables", [create_bed_table, create_medicine_table, create_patient_table, create_history_table, create_meditag_table]),
+    (2, "Secondary indexes for API and firmware filters", [
+        add_index('Bed', 'idx_bed_status', 'Status'),
+        add_index('Bed', 'idx_bed_pid', 'Pid'),
+        add_index('Medicine', 'idx_medicine_expiry', 'Expiry'),
+        add_index('Patient', 'idx_patient_phone', 'Phone'),
+        add_index('History', 'idx_history_date', 'Date'),
+    ]),
+    (3, "Index Medicine.Qty for /medicines/low_stock", [
+        add_index('Medicine', 'idx_medicine_qty', 'Qty'),
+    ]),
+    (4, "ngram full-text index on Patient name and phone for /patients/search", [
+        # With the default stopword list the ngram parser drops every bigram
+        # containing a stopword such as 'a' or 'i'; the setting is captured at index creation
+        without_stopwords(add_index('Patient', 'ft_patient_name_phone', 'Name, Phone', kind='FULLTEXT INDEX', options=' WITH PARSER ngram')),
+    ]),
+]
+
+
+def schema_version(connection):
+    execute_query(connection, """
+    CREATE TABLE IF NOT EXISTS SchemaVersion (
+        Version INT PRIMARY KEY,
+        Description VARCHAR(200),
+        AppliedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    result = execute_query(connection, "SELECT MAX(Version) FROM SchemaVersion")
+    return result[0][0] or 0
+
+
+def migrate(connection):
+    """
+    Apply every migration newer than the recorded schema version and record
+    each one in SchemaVersion. An up-to-date database costs two cheap queries.
+    A named lock keeps containers that boot together from migrating at once.
+    """
+    locked = execute_query(connection, "SELECT GET_LOCK('hospital_db_migrations', 60)")[0][0]
+    if locked != 1:
+        # 0 is a timeout, NULL an error; either way another container may be mid-migration
+        raise RuntimeError("Could not take the migration lock within 60s; is another container still migrating?")
+    try:
+        current = schema_version(connection)
+        pending = [migration for migration in MIGRATIONS if migration[0] > current]
+        if not pending:
+            logging.info(f"Schema is up to date at version {current}")
+            return current
+        for version, description, steps in pending:
+            logging.info(f"Applying migration {version}: {description}")
+            for step in steps:
+                if callable(step):
+                    step(connection)
+                else:
+                    execute_query(connection, step)
+            execute_query(connection, "INSERT INTO SchemaVersion (Version, Description) VALUES (%s, %s)", (version, description))
+            current = version
+        return current
+    finally:
+        execute_query(connection, "SELECT RELEASE_LOCK('hospital_db_migrations')")
+
+
+def _built(name, built):
+    # An ENDPOINT_QUERIES entry from a query builder's (query, values)
+    query, values = built
+    return (name, query, tuple(values))
+
+
+# Representative statements behind each endpoint and the dome poll, as (name, query, params).
+# Endpoints whose SQL comes from a builder are checked through that same builder.
+_FAR_FUTURE = date(2999, 1, 1)
+ENDPOINT_QUERIES = [
+    ("dome poll /beds?filters=bedID>0,bedID<4", "SELECT * FROM Bed WHERE BedID > %s AND BedID < %s", (0, 4)),
+    ("/beds?filters=Status=Available", "SELECT * FROM Bed WHERE Status = %s", ('Available',)),
+    ("/beds?filters=Pid=1", "SELECT * FROM Bed WHERE Pid = %s", (1,)),
+    ("set_bed", "UPDATE Bed SET Status = %s WHERE BedID = %s", ('Available', 1)),
+    _built("bed store replay", bed_rows_query([1, 2])),
+    ("/medicines?filters=Expiry<...", "SELECT * FROM Medicine WHERE Expiry < %s", ('2000-01-01',)),
+    _built("/medicines/expiring", expiring_query(30, today=_FAR_FUTURE)),
+    _built("/medicines/expiring?tag=...", expiring_query(30, tags=('antibiotic',), limit=50, today=_FAR_FUTURE)),
+    _built("/medicines/low_stock", low_stock_query(-1)),
+    _built("medicine tags", medicine_tags_query([1, 2])),
+    ("set_medicine", "UPDATE Medicine SET Qty = %s WHERE MediID = %s", (1, 1)),
+    ("/patients?filters=Phone=...", "SELECT * FROM Patient WHERE Phone = %s", ('555-0100',)),
+    _built("/patients/search", patient_search_query(search_terms('smith'), 20 * SEARCH_CANDIDATES_PER_RESULT)),
+    ("set_patient", "UPDATE Patient SET Name = %s WHERE PatientID = %s", ('Jane Doe', 1)),
+    _built("/patients/<id>/timeline", timeline_query(1, 50)),
+    _built("/patients/<id>/timeline?before=...", timeline_query(1, 50, (_FAR_FUTURE, 'RX-1'))),
+    ("History by date", "SELECT * FROM History WHERE Date >= %s", ('2999-01-01',)),
+]
+
+
+def check_query_plans(connection, queries=ENDPOINT_QUERIES):
+    """
+    EXPLAIN every endpoint query and return the names of those that would do a
+    full table scan with no usable index. A full scan the optimiser picks while
+    an index exists (common on tiny tables) is logged but not counted, and so
+    are scans of derived tables, which hold only their subquery's rows.
+    """
+    failures = []
+    cursor = connection.cursor(dictionary=True)
+    try:
+        for name, query, params in queries:
+            cursor.execute("EXPLAIN " + query, params)
+            for row in cursor.fetchall():
+                if row.get('type') != 'ALL':
+                    continue
+                if str(row.get('table', '')).startswith('<derived'):
+                    # A materialised subquery result (e.g. a LIMITed page), not a base table
+                    continue
+                if row.get('possible_keys'):
+                    logging.warning(f"{name}: optimiser chose a full scan of {row.get('table')} despite {row.get('possible_keys')}")
+                else:
+                    logging.error(f"{name}: full scan of {row.get('table')} with no usable index")
+                    failures.append(name)
+    finally:
+        cursor.close()
+    return failures
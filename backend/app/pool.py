@@ -0,0 +1,285 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from os import getenv, getpid
+
+import mysql.connector
+
+from metrics import pool_acquire, pool_exhausted
+
+
+# Prepared statements kept per pooled connection (0 disables the cache)
+STATEMENT_CACHE_SIZE = int(getenv('MYSQL_STMT_CACHE_SIZE', 64))
+
+# Hit/miss/eviction counters across every StatementCache in this process
+statement_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        statement_cache_stats[name] += 1
+
+
+class StatementCache:
+    """
+    LRU of server-side prepared statements for one physical connection, keyed
+    by SQL text. Each entry is a prepared cursor that keeps its statement
+    prepared on the server; evicting it closes the cursor, which deallocates
+    the statement.
+    """
+
+    def __init__(self, connection, size):
+        self._connection = connection
+        self.size = size
+        self._cursors = OrderedDict()  # SQL text -> (SQL text, prepared cursor)
+
+    def get(self, query):
+        """
+        Return (query, cursor) for `query`. Pass the returned query object to
+        cursor.execute(): the connector only reuses the prepared statement when
+        it is handed the very same string object again.
+        """
+        cached = self._cursors.get(query)
+        if cached is not None:
+            self._cursors.move_to_end(query)
+            _count("hits")
+            return cached
+        _count("misses")
+        cached = (query, self._connection.cursor(prepared=True))
+        self._cursors[query] = cached
+        if len(self._cursors) > self.size:
+            self._close(self._cursors.popitem(last=False)[1][1])
+            _count("evictions")
+        return cached
+
+    def discard(self, query):
+        cached = self._cursors.pop(query, None)
+        if cached is not None:
+            self._close(cached[1])
+
+    def __len__(self):
+        return len(self._cursors)
+
+    @staticmethod
+    def _close(cursor):
+        try:
+            cursor.close()
+        except Exception as e:
+            logging.debug(f"Ignoring error while closing prepared cursor: {e}")
+
+
+class _PoolEntry:
+    """
+    A physical connection owned by a ConnectionPool, plus the bookkeeping the
+    pool needs to decide whether it is still fit for reuse. The statement
+    cache lives here so it survives the connection being checked in and out.
+    """
+    __slots__ = ('connection', 'created_at', 'last_used', 'statements')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.statements = None
+
+
+class PooledConnection:
+    """
+    Checked-out handle to a pooled MySQL connection.
+
+    Every attribute is forwarded to the real connection, so it can be passed
+    to execute_query() like a plain one. close() and leaving a `with` block
+    hand the connection back to the pool instead of disconnecting it.
+    """
+
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+
+    def __getattr__(self, name):
+        entry = self.__dict__.get('_entry')
+        if entry is None:
+            raise mysql.connector.errors.OperationalError("Connection has already been returned to the pool")
+        return getattr(entry.connection, name)
+
+    @property
+    def statement_cache(self):
+        entry = self._entry
+        if entry is None:
+            raise mysql.connector.errors.OperationalError("Connection has already been returned to the pool")
+        if entry.statements is None and STATEMENT_CACHE_SIZE > 0:
+            entry.statements = StatementCache(entry.connection, STATEMENT_CACHE_SIZE)
+        return entry.statements
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool.release(entry)
+
+    def discard(self):
+        """
+        Close the connection instead of handing it back, e.g. when unread rows
+        are still pending on it; leaving the `with` block afterwards is a no-op.
+        """
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool.discard(entry)
+
+
+class ConnectionPool:
+    """
+    Bounded pool of MySQL connections.
+
+    - At most `size` connections exist at once; acquire() waits up to `timeout`
+      seconds for one to be returned before raising PoolError.
+    - Connections idle for longer than `idle_timeout` seconds are closed.
+    - Connections older than `max_lifetime` seconds are recycled.
+    - Connections idle for longer than `ping_interval` seconds are pinged
+      before being handed out, and replaced if the ping fails.
+    - Wait time and exhaustion are reported to metrics under `name`.
+    """
+
+    def __init__(self, factory, size=10, timeout=5.0, idle_timeout=300.0, max_lifetime=1800.0, ping_interval=30.0, name='default'):
+        self._factory = factory
+        self.name = name
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+        self._lock = threading.Condition()
+        self._idle = deque()
+        self._in_use = 0
+        self._created = 0
+        self._pid = getpid()
+
+    def stats(self):
+        with self._lock:
+            return {"size": self.size, "open": self._created, "in_use": self._in_use, "idle": len(self._idle)}
+
+    def acquire(self):
+        self._check_fork()
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            entry = None
+            with self._lock:
+                self._evict_idle()
+                while not self._idle and self._created >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        pool_exhausted.inc((self.name,))
+                        raise mysql.connector.errors.PoolError(
+                            f"Connection pool exhausted: {self.size} connections in use after waiting {self.timeout}s")
+                    self._lock.wait(remaining)
+                    self._evict_idle()
+                if self._idle:
+                    entry = self._idle.pop()
+                else:
+                    self._created += 1
+                self._in_use += 1
+
+            if entry is None:
+                try:
+                    entry = _PoolEntry(self._factory())
+                except Exception:
+                    self._forget(counted_in_use=True)
+                    raise
+                pool_acquire.observe((self.name,), time.perf_counter() - started)
+                return PooledConnection(self, entry)
+
+            if self._healthy(entry):
+                pool_acquire.observe((self.name,), time.perf_counter() - started)
+                return PooledConnection(self, entry)
+            self._discard(entry, counted_in_use=True)
+
+    def release(self, entry):
+        if getpid() != self._pid:
+            return
+        connection = entry.connection
+        try:
+            # Never hand the next caller an open transaction or a stale snapshot.
+            if connection.in_transaction:
+                connection.rollback()
+            reusable = time.monotonic() - entry.created_at < self.max_lifetime
+        except Exception as e:
+            logging.warning(f"Dropping pooled connection that failed on release: {e}")
+            reusable = False
+
+        if not reusable:
+            self._discard(entry, counted_in_use=True)
+            return
+        entry.last_used = time.monotonic()
+        with self._lock:
+            self._in_use -= 1
+            self._idle.append(entry)
+            self._lock.notify()
+
+    def discard(self, entry):
+        if getpid() != self._pid:
+            return
+        self._discard(entry, counted_in_use=True)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+            self._created -= len(idle)
+        for entry in idle:
+            self._close(entry)
+
+    def _healthy(self, entry):
+        now = time.monotonic()
+        if now - entry.created_at >= self.max_lifetime:
+            return False
+        if now - entry.last_used < self.ping_interval:
+            return True
+        try:
+            entry.connection.ping(reconnect=False)
+            return True
+        except Exception as e:
+            logging.warning(f"Pooled connection failed health check: {e}")
+            return False
+
+    def _evict_idle(self):
+        # Called with the lock held; the oldest idle connections sit on the left.
+        now = time.monotonic()
+        while self._idle and now - self._idle[0].last_used >= self.idle_timeout:
+            entry = self._idle.popleft()
+            self._created -= 1
+            self._close(entry)
+
+    def _discard(self, entry, counted_in_use):
+        self._close(entry)
+        self._forget(counted_in_use)
+
+    def _forget(self, counted_in_use):
+        with self._lock:
+            self._created -= 1
+            if counted_in_use:
+                self._in_use -= 1
+            self._lock.notify()
+
+    def _check_fork(self):
+        # Sockets inherited across fork() belong to the parent; start afresh
+        # without closing them so the parent's sessions are left untouched.
+        if getpid() != self._pid:
+            with self._lock:
+                self._pid = getpid()
+                self._idle = deque()
+                self._in_use = 0
+                self._created = 0
+
+    @staticmethod
+    def _close(entry):
+        try:
+            entry.connection.close()
+        except Exception as e:
+            logging.debug(f"Ignoring error while closing pooled connection: {e}")
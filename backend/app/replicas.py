@@ -0,0 +1,112 @@
+import itertools
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from os import getenv, getpid
+
+import metrics
+
+# Comma-separated replica hosts; empty means every query goes to MYSQL_HOST
+MYSQL_REPLICAS = [host.strip() for host in getenv('MYSQL_REPLICAS', '').split(',') if host.strip()]
+# Replicas further behind than this many seconds get no reads
+REPLICA_MAX_LAG = float(getenv('REPLICA_MAX_LAG', 2))
+REPLICA_CHECK_INTERVAL = float(getenv('REPLICA_CHECK_INTERVAL', 1))
+# Seconds a client's reads stay on the primary after it wrote something
+READ_YOUR_WRITES_WINDOW = float(getenv('READ_YOUR_WRITES_WINDOW', 5))
+
+replica_lag = metrics.Gauge('db_replica_lag_seconds', 'Replication lag per replica; -1 when it is unreachable or not replicating.', ('replica',))
+read_routing = metrics.Counter('db_read_routing_total',
+                               'Read-only connection checkouts by where they went: replica, primary_pinned (after the '
+                               "client's own write) or primary_fallback (no replica within REPLICA_MAX_LAG).", ('target',))
+
+# Wall-clock time until which this request's reads must see the primary
+_primary_until = ContextVar('primary_until', default=0.0)
+
+
+def pin_primary(until):
+    """
+    Keep this request's (or task's) reads on the primary until `until` (time.time()).
+    """
+    _primary_until.set(until)
+
+
+def pinned():
+    return time.time() < _primary_until.get()
+
+
+def measure_lag(connection):
+    """
+    Seconds_Behind_Master of a replica connection, or None when replication
+    isn't running (a stopped or broken replica must not serve reads).
+    """
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("SHOW SLAVE STATUS")
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    if not row or row.get('Seconds_Behind_Master') is None:
+        return None
+    return float(row['Seconds_Behind_Master'])
+
+
+class ReplicaSet:
+    """
+    Read replicas and their replication lag, measured by a monitor thread
+    every REPLICA_CHECK_INTERVAL seconds. choose() hands out replicas within
+    REPLICA_MAX_LAG round robin, or None so the caller falls back to the
+    primary. Replicas count as lagging until their first check.
+    """
+
+    def __init__(self, hosts, connect):
+        self.hosts = list(hosts)
+        self._connect = connect  # host -> pooled connection
+        self._lag = {}  # host -> seconds, None when down
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def choose(self):
+        self._start()
+        lag = self._lag
+        healthy = [host for host in self.hosts if lag.get(host) is not None and lag[host] <= REPLICA_MAX_LAG]
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+    def mark_down(self, host):
+        """
+        Stop reading from `host` until the monitor sees it healthy again.
+        """
+        self._lag[host] = None
+        replica_lag.set((host,), -1)
+
+    def lag(self):
+        return dict(self._lag)
+
+    def _start(self):
+        if self._pid == getpid():
+            return
+        with self._lock:
+            if self._pid != getpid():
+                # Threads don't survive fork; each worker runs its own monitor
+                self._pid = getpid()
+                self._lag = {}
+                threading.Thread(target=self._monitor, name='replica-monitor', daemon=True).start()
+
+    def _monitor(self):
+        while True:
+            for host in self.hosts:
+                try:
+                    with self._connect(host) as connection:
+                        lag = measure_lag(connection)
+                except Exception as e:
+                    logging.warning(f"Replica {host} unreachable: {e}")
+                    lag = None
+                was_healthy = self._lag.get(host) is not None and self._lag[host] <= REPLICA_MAX_LAG
+                if was_healthy and (lag is None or lag > REPLICA_MAX_LAG):
+                    logging.warning(f"Replica {host} taken out of rotation (lag {lag})")
+                self._lag[host] = lag
+                replica_lag.set((host,), -1 if lag is None else lag)
+            time.sleep(REPLICA_CHECK_INTERVAL)
@@ -0,0 +1,66 @@
+from os import getenv
+
+# Must match the MySQL server's ngram_token_size; shorter terms can't be looked up in the index
+NGRAM_TOKEN_SIZE = int(getenv('NGRAM_TOKEN_SIZE', 2))
+SEARCH_MAX_RESULTS = int(getenv('SEARCH_MAX_RESULTS', 100))
+# Index hits fetched per result asked for, then re-ranked here
+SEARCH_CANDIDATES_PER_RESULT = int(getenv('SEARCH_CANDIDATES_PER_RESULT', 5))
+
+PATIENT_COLUMNS = ('PatientID', 'Name', 'Phone', 'Age', 'Sex')
+
+# Characters with a meaning in MySQL boolean-mode full-text queries
+_BOOLEAN_OPERATORS = str.maketrans('', '', '"+-<>()~*@')
+
+
+class SearchError(ValueError):
+    """
+    Raised for search strings the full-text index cannot answer.
+    """
+
+
+def search_terms(q):
+    """
+    Split a search string into the terms every result must contain.
+    """
+    terms = [term.translate(_BOOLEAN_OPERATORS) for term in q.split()]
+    terms = [term for term in terms if term]
+    if not terms:
+        raise SearchError("'q' must contain at least one letter or digit.")
+    short = [term for term in terms if len(term) < NGRAM_TOKEN_SIZE]
+    if short:
+        raise SearchError(f"Search terms need at least {NGRAM_TOKEN_SIZE} characters: {', '.join(short)}")
+    return terms
+
+
+def patient_search_query(terms, limit):
+    """
+    (query, values) finding patients whose Name or Phone contains every term,
+    through the ngram FULLTEXT index ft_patient_name_phone (migration 4).
+
+    Each term is a quoted phrase, which the ngram parser matches as a
+    substring, so 'nit' finds 'Smith' and '4567' finds '555-014567'. Ordering
+    by relevance alone lets InnoDB stop after the best `limit` hits.
+    """
+    against = ' '.join(f'+"{term}"' for term in terms)
+    query = (f"SELECT {', '.join(PATIENT_COLUMNS)}, MATCH(Name, Phone) AGAINST (%s IN BOOLEAN MODE) AS score "
+             f"FROM Patient WHERE MATCH(Name, Phone) AGAINST (%s IN BOOLEAN MODE) "
+             f"ORDER BY score DESC LIMIT {int(limit)}")
+    return query, [against, against]
+
+
+def rank_patients(rows, terms, limit):
+    """
+    Order full-text hits the way front-desk staff expect: names starting with
+    the first term and phone numbers ending in one of the terms first, then
+    by relevance, then by PatientID.
+    """
+    first = terms[0].lower()
+    patients = []
+    for row in rows:
+        patient = dict(zip(PATIENT_COLUMNS + ('score',), row))
+        name = (patient['Name'] or '').lower()
+        phone = patient['Phone'] or ''
+        boost = name.startswith(first) + any(phone.endswith(term) for term in terms)
+        patients.append((-boost, -float(patient['score']), patient['PatientID'], patient))
+    patients.sort(key=lambda entry: entry[:3])
+    return [patient for *_, patient in patients[:limit]]
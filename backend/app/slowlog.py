@@ -0,0 +1,144 @@
+import json
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from os import getenv
+from random import random
+
+import metrics
+
+# Statements slower than this are recorded (0 disables the slow-query log)
+SLOW_QUERY_MS = float(getenv('SLOW_QUERY_MS', 200))
+# Fraction of slow statements recorded, to bound the cost when everything is slow
+SLOW_QUERY_SAMPLE_RATE = float(getenv('SLOW_QUERY_SAMPLE_RATE', 1.0))
+# Entries kept in memory for /admin/slow-queries
+SLOW_QUERY_BUFFER = int(getenv('SLOW_QUERY_BUFFER', 500))
+# Optional JSON-lines file every entry is appended to
+SLOW_QUERY_LOG = getenv('SLOW_QUERY_LOG') or None
+# Distinct fingerprints whose EXPLAIN output is remembered
+SLOW_QUERY_MAX_PLANS = 1000
+
+_EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE')
+
+_entries = deque(maxlen=SLOW_QUERY_BUFFER)
+_plans = OrderedDict()  # fingerprint -> EXPLAIN rows (or {"error": ...})
+_lock = threading.Lock()
+_file_lock = threading.Lock()
+
+slow_queries = metrics.Counter('db_slow_queries_total', 'Statements slower than SLOW_QUERY_MS, by statement fingerprint.', ('statement',))
+
+
+def params_shape(data):
+    """
+    Describe parameters by type only; values are never recorded because they
+    include patient details.
+    """
+    if data is None:
+        return None
+    if data and isinstance(data[0], tuple):
+        return {"rows": len(data), "types": [type(value).__name__ for value in data[0]]}
+    return [type(value).__name__ for value in data]
+
+
+def record(connection, query, data, seconds, rows):
+    """
+    Called by execute_query after every statement. Cheap unless the statement
+    was slow: then it is sampled, logged, and EXPLAINed once per fingerprint.
+    """
+    if not SLOW_QUERY_MS or seconds * 1000 < SLOW_QUERY_MS:
+        return
+    statement = metrics.fingerprint(query)
+    slow_queries.inc((statement,))
+    if SLOW_QUERY_SAMPLE_RATE < 1 and random() >= SLOW_QUERY_SAMPLE_RATE:
+        return
+
+    with _lock:
+        new_plan = statement not in _plans
+        if new_plan:
+            # Reserve the slot so concurrent slow runs don't all EXPLAIN
+            _plans[statement] = None
+            if len(_plans) > SLOW_QUERY_MAX_PLANS:
+                _plans.popitem(last=False)
+    if new_plan:
+        plan = explain(connection, query, data)
+        with _lock:
+            _plans[statement] = plan
+
+    entry = {
+        "at": datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        "statement": statement,
+        "params": params_shape(data),
+        "duration_ms": round(seconds * 1000, 2),
+        "rows": rows,
+    }
+    with _lock:
+        _entries.append(entry)
+    logging.warning(f"Slow query ({entry['duration_ms']} ms, {rows} rows): {statement}")
+    if SLOW_QUERY_LOG:
+        _append_to_file(dict(entry, plan=_plans.get(statement)))
+
+
+def explain(connection, query, data):
+    """
+    EXPLAIN a statement with the parameters it actually ran with. Batched
+    inserts and other statements MySQL can't usefully EXPLAIN are skipped.
+    """
+    if not query.lstrip().upper().startswith(_EXPLAINABLE) or (data and isinstance(data[0], tuple)):
+        return None
+    try:
+        cursor = connection.cursor(dictionary=True)
+        try:
+            cursor.execute("EXPLAIN " + query, tuple(data) if data else None)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+    except Exception as e:
+        logging.warning(f"EXPLAIN of slow query failed: {e}")
+        return {"error": str(e)}
+
+
+def _append_to_file(entry):
+    try:
+        with _file_lock, open(SLOW_QUERY_LOG, 'a') as f:
+            f.write(json.dumps(entry, default=str) + '\n')
+    except OSError as e:
+        logging.error(f"Could not write slow-query log {SLOW_QUERY_LOG}: {e}")
+
+
+def full_scan(plan):
+    return isinstance(plan, list) and any(isinstance(row, dict) and row.get('type') == 'ALL' for row in plan)
+
+
+def report(limit=100):
+    """
+    The newest `limit` entries plus a per-fingerprint summary, slowest total
+    first, with each fingerprint's plan and whether it scans a whole table.
+    """
+    with _lock:
+        entries = list(_entries)
+        plans = dict(_plans)
+
+    summary = {}
+    for entry in entries:
+        item = summary.setdefault(entry["statement"], {"statement": entry["statement"], "count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        item["count"] += 1
+        item["total_ms"] = round(item["total_ms"] + entry["duration_ms"], 2)
+        item["max_ms"] = max(item["max_ms"], entry["duration_ms"])
+    for item in summary.values():
+        plan = plans.get(item["statement"])
+        item["plan"] = plan
+        item["full_scan"] = full_scan(plan)
+
+    return {
+        "threshold_ms": SLOW_QUERY_MS,
+        "sample_rate": SLOW_QUERY_SAMPLE_RATE,
+        "statements": sorted(summary.values(), key=lambda item: item["total_ms"], reverse=True),
+        "recent": entries[::-1][:limit],
+    }
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _plans.clear()
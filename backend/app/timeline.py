@@ -0,0 +1,157 @@
+import threading
+import time
+from datetime import date
+from os import getenv, getpid
+
+from bedstore import ChangeLog, bed_store
+
+# Seconds a cached timeline may be served, to pick up writes made outside the API
+TIMELINE_CACHE_TTL = float(getenv('TIMELINE_CACHE_TTL', 60))
+# Patients whose timelines are cached, least recently used dropped first
+TIMELINE_CACHE_SIZE = int(getenv('TIMELINE_CACHE_SIZE', 1024))
+TIMELINE_MAX_HISTORY = int(getenv('TIMELINE_MAX_HISTORY', 500))
+
+PATIENT_COLUMNS = ('PatientID', 'Name', 'Phone', 'Age', 'Sex')
+BED_COLUMNS = ('BedID', 'Type', 'Location', 'Status')
+HISTORY_COLUMNS = ('Date', 'Doctor', 'PrescriptionID')
+
+
+def timeline_query(patient_id, limit, before=None):
+    """
+    (query, values) returning a patient, their beds and one page of History,
+    newest first, in one round trip. History is paged inside a derived table
+    (a backwards range on its (PID, Date, PrescriptionID) primary key) so the
+    join never multiplies more than `limit` + 1 History rows. `before` is the
+    (Date, PrescriptionID) of the last entry of the previous page.
+    """
+    history = "SELECT Date, Doctor, PrescriptionID FROM History WHERE PID = %s"
+    values = [patient_id]
+    if before is not None:
+        history += " AND (Date < %s OR (Date = %s AND PrescriptionID < %s))"
+        values += [before[0], before[0], before[1]]
+    history += f" ORDER BY Date DESC, PrescriptionID DESC LIMIT {int(limit) + 1}"
+    query = (f"SELECT {', '.join('p.' + column for column in PATIENT_COLUMNS)}, "
+             f"{', '.join('b.' + column for column in BED_COLUMNS)}, "
+             f"{', '.join('h.' + column for column in HISTORY_COLUMNS)} "
+             f"FROM Patient p "
+             f"LEFT JOIN Bed b ON b.Pid = p.PatientID "
+             f"LEFT JOIN ({history}) h ON 1 = 1 "
+             f"WHERE p.PatientID = %s")
+    return query, values + [patient_id]
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def build_timeline(rows, limit):
+    """
+    Fold the joined rows into {"patient", "beds", "history", "next_before"},
+    or None when the patient doesn't exist. next_before is the `before`
+    value for the following page, or None on the last page.
+    """
+    if not rows:
+        return None
+    patient = dict(zip(PATIENT_COLUMNS, rows[0][:5]))
+    beds, history = {}, {}
+    for row in rows:
+        if row[5] is not None:
+            beds[row[5]] = dict(zip(BED_COLUMNS, row[5:9]))
+        if row[9] is not None:
+            history[(row[9], row[11])] = {column: _json_value(value) for column, value in zip(HISTORY_COLUMNS, row[9:12])}
+    entries = [history[key] for key in sorted(history, reverse=True)]
+    next_before = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_before = f"{entries[-1]['Date']}|{entries[-1]['PrescriptionID']}"
+    return {"patient": patient, "beds": [beds[bed_id] for bed_id in sorted(beds)],
+            "history": entries, "next_before": next_before}
+
+
+class TimelineCache:
+    """
+    Encoded timelines per patient and page.
+
+    Patient and History writes through the API append the PatientID (0 = all
+    patients) to a shared ChangeLog (PATIENT_LOG_FILE, created by
+    gunicorn.conf.py), and every worker drops those patients before its next
+    lookup. Bed changes arrive through the bed store, which every worker
+    already replays; both the previous and the new occupant are dropped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # PatientID -> {(before, limit): (stored at, body)}, least recently used first
+        self._generation = 0  # bumped by every invalidation, to spot loads that raced one
+        self._log = None
+        self._pid = None
+        self._seen = 0
+        bed_store.listen(self._beds_changed)
+
+    @property
+    def log(self):
+        if self._pid != getpid():
+            self._log = ChangeLog(getenv('PATIENT_LOG_FILE') or None)
+            self._pid = getpid()
+            self._entries = {}
+            self._seen = self._log.head()
+        return self._log
+
+    def _drop(self, patient_ids):
+        # Called with the lock held; None drops everything
+        self._generation += 1
+        if patient_ids is None:
+            self._entries.clear()
+        else:
+            for patient_id in patient_ids:
+                self._entries.pop(patient_id, None)
+
+    def _catch_up(self):
+        # Called with the lock held
+        head = self.log.head()
+        if head != self._seen:
+            self._drop(self.log.read(self._seen, head))
+            self._seen = head
+
+    def get(self, patient_id, page, load):
+        """
+        The cached body for this patient and page, or load() stored for next
+        time. load() returns None for unknown patients, which isn't cached.
+        """
+        bed_store.sync()
+        with self._lock:
+            self._catch_up()
+            pages = self._entries.pop(patient_id, None)
+            if pages is not None:
+                self._entries[patient_id] = pages
+                entry = pages.get(page)
+                if entry and time.monotonic() - entry[0] < TIMELINE_CACHE_TTL:
+                    return entry[1]
+            generation = self._generation
+        body = load()
+        with self._lock:
+            self._catch_up()
+            if body is not None and generation == self._generation:
+                self._entries.setdefault(patient_id, {})[page] = (time.monotonic(), body)
+                while len(self._entries) > TIMELINE_CACHE_SIZE:
+                    del self._entries[next(iter(self._entries))]
+        return body
+
+    def changed(self, patient_ids=(0,)):
+        """
+        Called after a committed write to these patients or their History;
+        the default means any patient may have changed.
+        """
+        self.log.append(sorted({int(patient_id) for patient_id in patient_ids}))
+        with self._lock:
+            self._catch_up()
+
+    def _beds_changed(self, old_rows, new_rows):
+        with self._lock:
+            if old_rows is None:
+                self._drop(None)
+            else:
+                self._drop({row[4] for row in old_rows + list(new_rows) if row[4] is not None})
+
+
+timeline_cache = TimelineCache()
@@ -0,0 +1,146 @@
+import csv
+import gzip
+import io
+import json
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+
+from filters import TABLE_COLUMNS
+
+# Tables that can be bulk exported and imported
+TRANSFER_TABLES = ('Patient', 'History')
+FORMATS = ('csv', 'ndjson')
+
+
+class TransferError(ValueError):
+    """
+    Raised for unknown tables or formats and for malformed import files.
+    """
+
+
+def resolve_table_format(table, fmt):
+    """
+    Validate a table name (case-insensitive) and format; returns the canonical pair.
+    """
+    canonical = {name.lower(): name for name in TRANSFER_TABLES}.get(table.lower())
+    if canonical is None:
+        raise TransferError(f"Unknown table {table!r}; expected one of {', '.join(TRANSFER_TABLES)}")
+    fmt = fmt.lower()
+    if fmt not in FORMATS:
+        raise TransferError(f"Unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    return canonical, fmt
+
+
+def _plain(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def encode_rows(batches, columns, fmt):
+    """
+    Turn batches of rows (as yielded by initiate.stream_query) into CSV or
+    NDJSON text chunks, one chunk per batch. CSV starts with a header row.
+    """
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for rows in batches:
+            writer.writerows([_plain(value) for value in row] for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        for rows in batches:
+            yield ''.join(json.dumps(dict(zip(columns, map(_plain, row)))) + '\n' for row in rows)
+
+
+def gzip_chunks(chunks):
+    """
+    Compress text chunks into a gzip stream without buffering the whole output.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def open_text(stream, compressed):
+    """
+    Wrap a binary stream (file or request body) as text, gunzipping on the fly.
+    """
+    if compressed:
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    return io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+
+def read_rows(text, table, fmt):
+    """
+    Parse an import file. Returns (columns, rows) where columns come from the
+    CSV header or the first NDJSON object and rows is a lazy iterator of tuples,
+    so arbitrarily large files are never held in memory. A malformed row
+    raises TransferError naming its line when the iterator reaches it.
+    """
+    if fmt == 'csv':
+        reader = csv.reader(text)
+        header = next(reader, None)
+        if not header:
+            raise TransferError("CSV import needs a header row")
+        columns = _check_columns(table, header)
+
+        def csv_rows():
+            for row in reader:
+                if not row:
+                    continue
+                if len(row) != len(columns):
+                    raise TransferError(f"CSV line {reader.line_num} has {len(row)} fields; the header has {len(columns)}")
+                yield tuple(value if value != '' else None for value in row)
+        return columns, csv_rows()
+
+    lines = ((number, line) for number, line in enumerate(text, start=1) if line.strip())
+
+    def record(number, line):
+        try:
+            parsed = json.loads(line)
+        except ValueError as e:
+            raise TransferError(f"Invalid NDJSON on line {number}: {e}")
+        if not isinstance(parsed, dict):
+            raise TransferError(f"NDJSON line {number} is not a JSON object")
+        return parsed
+
+    def values(parsed):
+        # Keys match columns the way _check_columns does, whatever their case
+        by_key = {key.strip().lower(): value for key, value in parsed.items()}
+        return tuple(by_key.get(key) for key in keys)
+
+    first = next(lines, None)
+    if first is None:
+        raise TransferError("NDJSON import is empty")
+    first = record(*first)
+    columns = _check_columns(table, list(first))
+    keys = [column.lower() for column in columns]
+
+    def rows():
+        yield values(first)
+        for number, line in lines:
+            yield values(record(number, line))
+    return columns, rows()
+
+
+def _check_columns(table, names):
+    lookup = {column.lower(): column for column in TABLE_COLUMNS[table]}
+    columns = []
+    for name in names:
+        column = lookup.get(name.strip().lower())
+        if column is None:
+            raise TransferError(f"Unknown column {name!r} for {table}; expected any of {', '.join(TABLE_COLUMNS[table])}")
+        columns.append(column)
+    return columns
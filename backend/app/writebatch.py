@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from os import getenv, getpid
+
+import metrics
+from initiate import execute_query, retrieve_connection
+
+# Off by default: every write is then its own transaction, as before
+WRITE_BATCHING = getenv('WRITE_BATCHING', '0') == '1'
+# Longest a write waits for others to join its transaction, and the most items per transaction
+WRITE_BATCH_MAX_DELAY_MS = float(getenv('WRITE_BATCH_MAX_DELAY_MS', 5))
+WRITE_BATCH_MAX_ITEMS = int(getenv('WRITE_BATCH_MAX_ITEMS', 100))
+# Collapse several updates of the same bed in one batch into one, the last write winning per field
+WRITE_BATCH_COLLAPSE = getenv('WRITE_BATCH_COLLAPSE', '1') == '1'
+# Seconds a request waits for its batch to commit before giving up
+WRITE_BATCH_TIMEOUT = float(getenv('WRITE_BATCH_TIMEOUT', 30))
+
+batch_items = metrics.Histogram('write_batch_items', 'Writes submitted per group-commit transaction.', ('batch',),
+                                buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+batch_wait = metrics.Histogram('write_batch_wait_seconds', 'Time a write waited from submit to commit.', ('batch',))
+batch_collapsed = metrics.Counter('write_batch_collapsed_total', 'Writes merged into a later write of the same row.', ('batch',))
+
+
+def group_writes(writes):
+    """
+    Group [(index, query, values)] into runs of consecutive items sharing a
+    query, [(query, [(index, values)])], for execute_groups. Only neighbours
+    are grouped, so writes to the same row still apply in submission order
+    even when they set different columns.
+    """
+    groups = []
+    for i, query, values in writes:
+        if groups and groups[-1][0] == query:
+            groups[-1][1].append((i, tuple(values)))
+        else:
+            groups.append((query, [(i, tuple(values))]))
+    return groups
+
+
+def execute_groups(connection, groups, best_effort=False, errors=None):
+    """
+    Run grouped writes, [(query, [(index, values)])] from group_writes, in
+    order inside the caller's transaction with one executemany per group.
+
+    Without best_effort the first failure raises. With it, a failing group is
+    retried item by item behind savepoints, and each failing item is rolled
+    back and its exception stored in errors[index].
+    """
+    for query, members in groups:
+        if not best_effort:
+            execute_query(connection, query, [values for i, values in members], commit=False)
+            continue
+        # Try the whole group first and fall back to item by item only if it fails
+        execute_query(connection, "SAVEPOINT batch_group", commit=False)
+        try:
+            execute_query(connection, query, [values for i, values in members], commit=False)
+        except Exception:
+            execute_query(connection, "ROLLBACK TO SAVEPOINT batch_group", commit=False)
+            for i, values in members:
+                execute_query(connection, "SAVEPOINT batch_item", commit=False)
+                try:
+                    execute_query(connection, query, values, commit=False)
+                except Exception as e:
+                    execute_query(connection, "ROLLBACK TO SAVEPOINT batch_item", commit=False)
+                    errors[i] = e
+
+
+class WriteBatcher:
+    """
+    Group commit for single-row writes. Request threads submit() an item and
+    wait on the returned Future; one writer thread per process collects items
+    for up to `max_delay_ms` after the first one arrives, or until
+    `max_items` are waiting, and applies them in one transaction (one commit
+    and one fsync instead of one per request). Each Future resolves only
+    after that commit, or with the item's own error if it alone failed.
+
+    `build(item)` returns (query, values) like the run_batch builders. With
+    `key`, items for the same row are merged before building, later fields
+    overriding earlier ones, so a burst of updates to one bed costs one UPDATE.
+    `on_commit(connection, items)` runs after each commit with the applied items.
+    """
+
+    def __init__(self, name, build, key=None, on_commit=None,
+                 max_delay_ms=WRITE_BATCH_MAX_DELAY_MS, max_items=WRITE_BATCH_MAX_ITEMS):
+        self.name = name
+        self.build = build
+        self.key = key
+        self.on_commit = on_commit
+        self.max_delay = max_delay_ms / 1000
+        self.max_items = max_items
+        self._cond = threading.Condition()
+        self._pending = []  # (item, future, submitted at)
+        self._pid = None
+
+    def submit(self, item):
+        """
+        Queue one item; the returned Future resolves once its transaction commits.
+        Invalid items raise ValueError here, before anything is queued.
+        """
+        self.build(item)
+        future = Future()
+        with self._cond:
+            if self._pid != getpid():
+                # First use in this process (threads don't survive fork)
+                self._pid = getpid()
+                self._pending = []
+                threading.Thread(target=self._run, name=f"write-batch-{self.name}", daemon=True).start()
+            self._pending.append((item, future, time.monotonic()))
+            self._cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = self._pending[0][2] + self.max_delay
+                while len(self._pending) < self.max_items:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending[:self.max_items], self._pending[self.max_items:]
+            try:
+                self._flush(batch)
+            except Exception as e:
+                logging.error(f"Write batch {self.name} failed: {e}")
+                for item, future, submitted in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _merge(self, batch):
+        # [(item, [futures])], one entry per row when collapsing
+        if self.key is None:
+            return [(item, [future]) for item, future, submitted in batch]
+        merged = {}
+        for item, future, submitted in batch:
+            key = str(self.key(item))
+            if key in merged:
+                batch_collapsed.inc((self.name,))
+                merged[key] = ({**merged[key][0], **item}, merged[key][1] + [future])
+            else:
+                merged[key] = (item, [future])
+        return list(merged.values())
+
+    def _flush(self, batch):
+        batch_items.observe((self.name,), len(batch))
+        writes = self._merge(batch)
+        groups = group_writes([(i, *self.build(item)) for i, (item, futures) in enumerate(writes)])
+
+        errors = {}
+        with retrieve_connection() as connection:
+            if connection is None:
+                raise RuntimeError("Unable to establish connection to the database.")
+            try:
+                execute_groups(connection, groups, best_effort=True, errors=errors)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            applied = [item for i, (item, futures) in enumerate(writes) if i not in errors]
+            if self.on_commit and applied:
+                try:
+                    self.on_commit(connection, applied)
+                except Exception as e:
+                    # The writes are committed; only the follow-up failed
+                    logging.error(f"Write batch {self.name} on_commit failed: {e}")
+
+        now = time.monotonic()
+        for item, future, submitted in batch:
+            batch_wait.observe((self.name,), now - submitted)
+        for i, (item, futures) in enumerate(writes):
+            for future in futures:
+                if i in errors:
+                    future.set_exception(errors[i])
+                else:
+                    future.set_result(None)
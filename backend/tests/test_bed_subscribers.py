@@ -0,0 +1,76 @@
+"""
+Thread-based workers cap /beds/wait and /beds/stream subscribers per worker.
+Runs against the SQLite stand-in database from benchmarks/standin_db.py.
+"""
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path[:0] = [str(ROOT / 'backend' / 'app'), str(ROOT / 'benchmarks')]
+
+import standin_db  # noqa: E402
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    standin_db.install(str(tmp_path / 'hospital.sqlite'))
+    import backend
+    monkeypatch.setattr(backend, 'bed_subscriber_slots', threading.BoundedSemaphore(1))
+    return backend
+
+
+def test_wait_beyond_the_cap_gets_503(backend):
+    client = backend.app.test_client()
+    since = client.get('/beds/changes').headers['X-Bed-Version']
+    holding = threading.Thread(target=client.get, args=(f'/beds/wait?since={since}&timeout=2',))
+    holding.start()
+    try:
+        for _ in range(50):
+            if backend.bed_subscriber_slots._value == 0:
+                break
+            threading.Event().wait(0.02)
+        response = client.get(f'/beds/wait?since={since}&timeout=0')
+        assert response.status_code == 503
+        assert response.headers['Retry-After']
+    finally:
+        holding.join()
+    assert client.get(f'/beds/wait?since={since}&timeout=0').status_code == 204
+
+
+def test_closing_a_stream_frees_its_slot(backend):
+    client = backend.app.test_client()
+    response = client.get('/beds/stream')
+    assert response.status_code == 200
+    assert client.get('/beds/stream').status_code == 503
+    response.close()
+    response = client.get('/beds/stream')
+    assert response.status_code == 200
+    response.close()
+
+
+def test_wait_wakes_for_another_workers_write(backend):
+    with backend.retrieve_connection() as connection:
+        backend.execute_query(connection, "INSERT INTO Bed (BedID, Type, Location, Status, Pid) VALUES (1, 'ICU', 'A/1', 'Available', NULL)")
+    backend.bed_store.reset()
+    client = backend.app.test_client()
+    since = client.get('/beds/changes').headers['X-Bed-Version']
+    answered = {}
+
+    def wait():
+        started = time.monotonic()
+        answered['response'] = client.get(f'/beds/wait?since={since}&timeout=10')
+        answered['after'] = time.monotonic() - started
+    waiting = threading.Thread(target=wait)
+    waiting.start()
+    time.sleep(0.2)
+    # Another worker's set_bed: committed and logged, never replayed by this request
+    with backend.retrieve_connection() as connection:
+        backend.execute_query(connection, "UPDATE Bed SET Status = 'Occupied' WHERE BedID = 1")
+    backend.bed_store.log.append([1])
+    waiting.join()
+    assert answered['response'].get_json()["beds"][0][3] == 'Occupied'
+    assert answered['after'] < 1
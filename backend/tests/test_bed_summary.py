@@ -0,0 +1,61 @@
+"""
+/beds/summary counts follow the bed store, including writes other workers logged.
+Runs against the SQLite stand-in database from benchmarks/standin_db.py.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path[:0] = [str(ROOT / 'backend' / 'app'), str(ROOT / 'benchmarks')]
+
+import standin_db  # noqa: E402
+
+
+@pytest.fixture
+def backend(tmp_path):
+    standin_db.install(str(tmp_path / 'hospital.sqlite'))
+    import backend
+    with backend.retrieve_connection() as connection:
+        backend.execute_query(connection, "INSERT INTO Bed (BedID, Type, Location, Status, Pid) VALUES "
+                                          "(1, 'ICU', 'A/1', 'Available', NULL), (2, 'ICU', 'A/2', 'Available', NULL)")
+    backend.bed_store.reset()
+    return backend
+
+
+def by_status(client):
+    response = client.get('/beds/summary')
+    assert response.status_code == 200
+    return response.get_json()["by_status"]
+
+
+def test_summary_replays_writes_logged_by_other_workers(backend):
+    client = backend.app.test_client()
+    assert by_status(client) == {'Available': 2}
+    # Another worker's set_bed: committed and logged, not yet replayed here
+    with backend.retrieve_connection() as connection:
+        backend.execute_query(connection, "UPDATE Bed SET Status = 'Occupied' WHERE BedID = 1")
+    backend.bed_store.log.append([1])
+    assert by_status(client) == {'Available': 1, 'Occupied': 1}
+
+
+def test_summary_counts_unreplayed_entries_once_after_a_reload(backend):
+    client = backend.app.test_client()
+    with backend.retrieve_connection() as connection:
+        backend.execute_query(connection, "UPDATE Bed SET Status = 'Occupied' WHERE BedID IN (1, 2)")
+    backend.bed_store.log.append([1, 2])
+    backend.bed_store.reset()
+    assert by_status(client) == {'Occupied': 2}
+    assert client.post('/set_bed', json={"bedID": 2, "status": "Available"}).status_code == 200
+    assert by_status(client) == {'Available': 1, 'Occupied': 1}
+
+
+def test_summary_moves_beds_whose_type_changed(backend):
+    client = backend.app.test_client()
+    by_status(client)
+    with backend.retrieve_connection() as connection:
+        backend.execute_query(connection, "UPDATE Bed SET Type = 'General' WHERE BedID = 1")
+    backend.bed_store.log.append([1])
+    groups = client.get('/beds/summary').get_json()["groups"]
+    assert {(group["type"], group["count"]) for group in groups} == {('General', 1), ('ICU', 1)}
@@ -0,0 +1,125 @@
+"""
+The shared bed change log, the bed store's reload when it falls behind, and
+the packed bed-status encoding. Bed store tests run against the SQLite
+stand-in database from benchmarks/standin_db.py.
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path[:0] = [str(ROOT / 'backend' / 'app'), str(ROOT / 'benchmarks')]
+
+import standin_db  # noqa: E402
+from bedfeed import PACKED_HEADER, pack_bed_status  # noqa: E402
+from bedstore import BedStore, ChangeLog  # noqa: E402
+
+
+def test_change_log_reads_what_was_appended():
+    log = ChangeLog(size=8)
+    assert log.head() == 0
+    assert log.append([3, 5]) == 2
+    assert log.append([3]) == 3
+    assert log.read(0, 3) == {3, 5}
+    assert log.read(2, 3) == {3}
+    assert log.read(3, 3) == set()
+
+
+def test_change_log_wraps_around():
+    log = ChangeLog(size=4)
+    log.append([1, 2, 3, 4, 5, 6])
+    # Entries 1 and 2 were overwritten by 5 and 6
+    assert log.read(2, 6) == {3, 4, 5, 6}
+    assert log.read(1, 6) is None
+    assert log.read(0, 6) is None
+
+
+def test_a_reset_entry_means_reload():
+    log = ChangeLog(size=8)
+    log.append([1])
+    log.append([0])
+    log.append([2])
+    assert log.read(0, 3) is None
+    assert log.read(2, 3) == {2}
+
+
+def test_a_file_backed_log_is_shared_and_survives_reopening(tmp_path):
+    path = str(tmp_path / 'beds.log')
+    writer, reader = ChangeLog(path, size=8), ChangeLog(path, size=8)
+    writer.append([7])
+    assert reader.head() == 1 and reader.read(0, 1) == {7}
+    assert reader.base == writer.base
+    assert ChangeLog(path, size=8).read(0, 1) == {7}
+
+
+@pytest.fixture
+def backend(tmp_path):
+    standin_db.install(str(tmp_path / 'hospital.sqlite'))
+    import backend
+    with backend.retrieve_connection() as connection:
+        backend.execute_query(connection, "INSERT INTO Bed (Type, Location, Status, Pid) VALUES "
+                              + ', '.join(["('ICU', 'A/1', 'Available', NULL)"] * 6))
+    backend.bed_store.reset()
+    return backend
+
+
+def private_store(monkeypatch, size):
+    # Not the app's bed_store, which a watcher thread may be syncing
+    store = BedStore()
+    store._log, store._pid = ChangeLog(size=size), os.getpid()
+    store.sync()
+    loads = []
+    monkeypatch.setattr(store, '_load', lambda connection, head, load=store._load: loads.append(head) or load(connection, head))
+    return store, loads
+
+
+def test_a_store_further_behind_than_the_log_reloads(backend, monkeypatch):
+    store, loads = private_store(monkeypatch, size=4)
+    for bed_id in range(1, 7):
+        # Six writes by other workers, more than the log holds
+        with backend.retrieve_connection() as connection:
+            backend.execute_query(connection, "UPDATE Bed SET Status = 'Occupied' WHERE BedID = %s", (bed_id,))
+        store.log.append([bed_id])
+    store.sync()
+    assert loads == [6]
+    assert [row[3] for row in store.between()] == ['Occupied'] * 6
+
+
+def test_a_store_within_the_log_replays_only_the_changed_beds(backend, monkeypatch):
+    store, loads = private_store(monkeypatch, size=4)
+    with backend.retrieve_connection() as connection:
+        backend.execute_query(connection, "UPDATE Bed SET Status = 'Reserved' WHERE BedID = 2")
+    store.log.append([2])
+    store.sync()
+    assert loads == []
+    assert [row[3] for row in store.between(1, 3)] == ['Available', 'Reserved', 'Available']
+
+
+def unpack(body):
+    fmt, version, first, count = PACKED_HEADER.unpack_from(body)
+    bits = body[PACKED_HEADER.size:]
+    return fmt, version, first, count, [(bits[i // 4] >> (6 - 2 * (i % 4))) & 3 for i in range(count)]
+
+
+def test_packed_status_puts_the_first_bed_in_the_high_bits():
+    body = pack_bed_status([(10, 'Available'), (11, 'Reserved'), (12, 'Occupied'), (14, 'Cleaning')], 10, 14, 42)
+    assert len(body) == PACKED_HEADER.size + 2
+    assert body[PACKED_HEADER.size] == 0b01101100
+    # Bed 13 is missing and 'Cleaning' has no code: both read as 0
+    assert unpack(body) == (1, 42, 10, 5, [1, 2, 3, 0, 0])
+
+
+def test_packed_status_ignores_beds_outside_the_range():
+    body = pack_bed_status([(1, 'Occupied'), (5, 'Reserved'), (9, 'Occupied')], 4, 6, 1)
+    assert unpack(body)[2:] == (4, 3, [0, 2, 0])
+
+
+def test_packed_endpoint_serves_the_store(backend):
+    client = backend.app.test_client()
+    assert client.post('/set_bed', json={"bedID": 3, "status": "Occupied"}).status_code == 200
+    response = client.get('/beds/packed?from=1&to=6')
+    version = int(response.headers['X-Bed-Version'])
+    assert unpack(response.data) == (1, version, 1, 6, [1, 1, 3, 1, 1, 1])
+    assert client.get(f'/beds/packed?since={version}').status_code == 204
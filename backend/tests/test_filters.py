@@ -0,0 +1,76 @@
+"""
+The filter compiler: canonical forms, SQL rendering and what it rejects.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / 'backend' / 'app'))
+
+import filters  # noqa: E402
+from filters import FilterError, compile_filters, parse_conditions  # noqa: E402
+
+
+def test_equivalent_filters_compile_to_one_query():
+    expected = compile_filters('Bed', 'BedID>3,Status=Available')
+    assert expected == ('BedID > %s AND Status = %s', ['3', 'Available'])
+    for equivalent in ('status=Available,bedid>3', ' STATUS = Available , BedID>3 ,', 'Status=Available,BedID>3,status=Available'):
+        assert compile_filters('Bed', equivalent) == expected
+
+
+def test_in_values_are_sorted_and_deduplicated():
+    assert parse_conditions('Bed', 'status in Reserved|Available|Reserved') == (('Status', 'IN', ('Available', 'Reserved')),)
+    assert compile_filters('Bed', 'Status IN Reserved | Available') == ('Status IN (%s, %s)', ['Available', 'Reserved'])
+
+
+@pytest.mark.parametrize('raw, where, values', [
+    ('Age between 18|65', 'Age BETWEEN %s AND %s', ['18', '65']),
+    ('Name<>Asha', 'Name != %s', ['Asha']),
+    ('Age>=18', 'Age >= %s', ['18']),
+    ('Phone^=98', 'Phone LIKE %s', ['98%']),
+])
+def test_operators(raw, where, values):
+    assert compile_filters('Patient', raw) == (where, values)
+
+
+def test_prefix_escapes_like_wildcards():
+    assert compile_filters('Bed', 'Location^=A_1%')[1] == ['A\\_1\\%%']
+
+
+def test_values_never_become_sql():
+    where, values = compile_filters('Bed', "Status=x' OR '1'='1")
+    assert where == 'Status = %s'
+    assert values == ["x' OR '1'='1"]
+
+
+@pytest.mark.parametrize('table, raw, message', [
+    ('Bed', 'Colour=red', "Unknown column 'Colour'"),
+    ('Bed', 'Status', "Cannot parse filter"),
+    ('Bed', 'Status) OR (1=1', "Cannot parse filter"),
+    ('Bed', 'BedID between 1|2|3', "BETWEEN needs exactly two values"),
+    ('Ward', 'Status=Available', "Unknown table 'Ward'"),
+])
+def test_rejected_filters(table, raw, message):
+    with pytest.raises(FilterError, match=message):
+        compile_filters(table, raw)
+
+
+def test_scans_of_unindexed_columns_are_rejected_on_big_tables(monkeypatch):
+    monkeypatch.setattr(filters, 'FILTER_SCAN_LIMIT', 1000)
+    monkeypatch.setattr(filters, 'estimate_rows', lambda connection, table: 5000)
+    with pytest.raises(FilterError, match="add a filter on one of: PatientID, Phone"):
+        filters.check_scan(None, 'Patient', 'Name=Asha')
+    # An indexed condition, or no filter at all, is fine however big the table
+    filters.check_scan(None, 'Patient', 'Name=Asha,Phone=98')
+    filters.check_scan(None, 'Patient', '')
+    # != can't use the index, so it doesn't count
+    with pytest.raises(FilterError):
+        filters.check_scan(None, 'Patient', 'Phone!=98')
+
+
+def test_scans_are_allowed_on_small_tables(monkeypatch):
+    monkeypatch.setattr(filters, 'FILTER_SCAN_LIMIT', 1000)
+    monkeypatch.setattr(filters, 'estimate_rows', lambda connection, table: 10)
+    filters.check_scan(None, 'Patient', 'Name=Asha')
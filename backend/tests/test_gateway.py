@@ -0,0 +1,39 @@
+"""
+Merging of upstream bed state in the federation gateway.
+"""
+import json
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / 'backend' / 'app'))
+
+from gateway import Gateway  # noqa: E402
+
+
+def upstream_state(gateway, url, hospital, beds, ok=True):
+    upstream = next(upstream for upstream in gateway.upstreams if upstream.url == url)
+    upstream.hospital = hospital
+    upstream.beds = {row[0]: row for row in beds}
+    upstream.ok = ok
+
+
+def merged(gateway):
+    gateway._pid = os.getpid()  # Mark polling as started so view() doesn't start it
+    gateway._ready.set()
+    gateway._merge()
+    return json.loads(gateway.view()[1])["hospitals"]
+
+
+def test_same_named_upstreams_are_kept_apart(caplog):
+    gateway = Gateway(['http://a:6000', 'http://b:6000', 'http://c:6000'])
+    upstream_state(gateway, 'http://a:6000', 'Vasant Kunj Hospital', [[1, 'ICU', 'A/1', 'Occupied', 1]])
+    upstream_state(gateway, 'http://b:6000', 'Vasant Kunj Hospital', [[1, 'ICU', 'B/1', 'Available', None]])
+    upstream_state(gateway, 'http://c:6000', 'Apollo', [[1, 'ICU', 'C/1', 'Reserved', 2]], ok=False)
+    hospitals = merged(gateway)
+    assert hospitals["Vasant Kunj Hospital (http://a:6000)"]["beds"][0][3] == 'Occupied'
+    assert hospitals["Vasant Kunj Hospital (http://b:6000)"]["beds"][0][3] == 'Available'
+    assert hospitals["Apollo"] == {"stale": True, "beds": [[1, 'ICU', 'C/1', 'Reserved', 2]]}
+    assert "Vasant Kunj Hospital" not in hospitals
+    assert "all report hospital 'Vasant Kunj Hospital'" in caplog.text
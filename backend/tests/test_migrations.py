@@ -0,0 +1,58 @@
+"""
+Migration locking and session settings, with execute_query scripted per statement.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / 'backend' / 'app'))
+
+import migrations  # noqa: E402
+
+
+@pytest.fixture
+def scripted(monkeypatch):
+    """
+    (statements run through migrations.execute_query, answers), where
+    answers maps a statement prefix to its result.
+    """
+    statements = []
+    answers = {}
+
+    def execute_query(connection, query, data=None):
+        statements.append(query.strip())
+        for prefix, answer in answers.items():
+            if query.strip().startswith(prefix):
+                return answer
+        return None
+    monkeypatch.setattr(migrations, 'execute_query', execute_query)
+    return statements, answers
+
+
+def test_migrate_refuses_to_run_without_the_lock(scripted):
+    executed, answers = scripted
+    answers["SELECT GET_LOCK"] = [(0,)]
+    with pytest.raises(RuntimeError, match="migration lock"):
+        migrations.migrate(None)
+    assert executed == ["SELECT GET_LOCK('hospital_db_migrations', 60)"]
+
+
+def test_migrate_releases_the_lock_when_up_to_date(scripted):
+    executed, answers = scripted
+    answers["SELECT GET_LOCK"] = [(1,)]
+    answers["SELECT MAX(Version)"] = [(migrations.MIGRATIONS[-1][0],)]
+    assert migrations.migrate(None) == migrations.MIGRATIONS[-1][0]
+    assert executed[-1] == "SELECT RELEASE_LOCK('hospital_db_migrations')"
+
+
+def test_stopword_setting_is_restored_when_the_step_fails(scripted):
+    executed, answers = scripted
+    answers["SELECT @@SESSION.innodb_ft_enable_stopword"] = [(1,)]
+
+    def failing(connection):
+        raise RuntimeError("ALTER TABLE failed")
+    with pytest.raises(RuntimeError, match="ALTER TABLE failed"):
+        migrations.without_stopwords(failing)(None)
+    assert executed[1:] == ["SET SESSION innodb_ft_enable_stopword = OFF", "SET SESSION innodb_ft_enable_stopword = 1"]
@@ -0,0 +1,123 @@
+"""
+ConnectionPool checkout, release, recycling and the reset after fork, on fake connections.
+"""
+import sys
+from pathlib import Path
+
+import mysql.connector
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / 'backend' / 'app'))
+
+from pool import ConnectionPool  # noqa: E402
+
+
+class FakeConnection:
+    def __init__(self):
+        self.in_transaction = False
+        self.closed = False
+        self.rollbacks = 0
+        self.pings = 0
+        self.ping_fails = False
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+        if self.ping_fails:
+            raise mysql.connector.errors.InterfaceError("gone away")
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def created():
+    return []
+
+
+@pytest.fixture
+def pool(created):
+    def factory():
+        created.append(FakeConnection())
+        return created[-1]
+    return ConnectionPool(factory, size=2, timeout=0.05)
+
+
+def raw(handle):
+    return handle._entry.connection
+
+
+def test_released_connections_are_reused(pool, created):
+    with pool.acquire() as handle:
+        first = raw(handle)
+    with pool.acquire() as handle:
+        assert raw(handle) is first
+    assert len(created) == 1
+    assert pool.stats() == {"size": 2, "open": 1, "in_use": 0, "idle": 1}
+
+
+def test_checkout_beyond_size_waits_then_fails(pool):
+    held = [pool.acquire(), pool.acquire()]
+    with pytest.raises(mysql.connector.errors.PoolError, match="exhausted"):
+        pool.acquire()
+    held[0].close()
+    assert pool.acquire() is not None
+
+
+def test_release_rolls_back_an_open_transaction(pool):
+    handle = pool.acquire()
+    connection = raw(handle)
+    connection.in_transaction = True
+    handle.close()
+    assert connection.rollbacks == 1 and not connection.closed
+    # A second close of the same handle doesn't release it twice
+    handle.close()
+    assert pool.stats()["idle"] == 1
+
+
+def test_a_handle_is_unusable_once_returned(pool):
+    handle = pool.acquire()
+    handle.close()
+    with pytest.raises(mysql.connector.errors.OperationalError):
+        handle.rollback()
+
+
+def test_discard_closes_instead_of_reusing(pool, created):
+    with pool.acquire() as handle:
+        handle.discard()
+    assert created[0].closed
+    assert pool.stats() == {"size": 2, "open": 0, "in_use": 0, "idle": 0}
+
+
+def test_old_connections_are_recycled(pool, created):
+    pool.max_lifetime = 0
+    with pool.acquire():
+        pass
+    assert created[0].closed
+    assert pool.stats()["open"] == 0
+
+
+def test_idle_connections_are_pinged_and_replaced_if_dead(pool, created):
+    pool.ping_interval = 0
+    with pool.acquire():
+        pass
+    created[0].ping_fails = True
+    with pool.acquire() as handle:
+        assert raw(handle) is created[1]
+    assert created[0].pings == 1 and created[0].closed
+    assert pool.stats()["open"] == 1
+
+
+def test_a_forked_child_starts_afresh_without_closing_the_parents_connections(pool, created):
+    pool.acquire()
+    with pool.acquire():
+        pass
+    pool._pid = -1  # As if this process were a child forked after those checkouts
+    with pool.acquire() as handle:
+        assert raw(handle) is created[-1] and len(created) == 3
+    assert not any(connection.closed for connection in created)
+    assert pool.stats() == {"size": 2, "open": 1, "in_use": 0, "idle": 1}
@@ -0,0 +1,53 @@
+"""
+Streamed reads: connections left with unread rows are discarded, and a
+failure mid-stream aborts the response instead of ending it cleanly.
+Runs against the SQLite stand-in database from benchmarks/standin_db.py.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path[:0] = [str(ROOT / 'backend' / 'app'), str(ROOT / 'benchmarks')]
+
+import standin_db  # noqa: E402
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = standin_db.install(str(tmp_path / 'hospital.sqlite'))
+    import initiate
+    with initiate.retrieve_connection() as connection:
+        initiate.execute_query(connection, "INSERT INTO Patient (Name, Phone, Age, Sex) VALUES "
+                                          "('Asha', '1', 40, 'F'), ('Ravi', '2', 31, 'M'), ('Mina', '3', 25, 'F')")
+    return pool
+
+
+def test_reading_every_row_keeps_the_connection(pool):
+    import initiate
+    with initiate.retrieve_connection() as connection:
+        batches = list(initiate.stream_query(connection, "SELECT * FROM Patient", batch_size=2))
+    assert [len(rows) for rows in batches] == [2, 1]
+    assert pool.stats() == {"size": 10, "open": 1, "in_use": 0, "idle": 1}
+
+
+def test_stopping_early_discards_the_connection(pool):
+    import initiate
+    with initiate.retrieve_connection() as connection:
+        batches = initiate.stream_query(connection, "SELECT * FROM Patient", batch_size=1)
+        next(batches)
+        batches.close()
+    assert pool.stats() == {"size": 10, "open": 0, "in_use": 0, "idle": 0}
+
+
+def test_a_failure_mid_stream_aborts_the_array(pool, monkeypatch):
+    import backend
+
+    def failing(connection, query, data=None, batch_size=1000):
+        yield [(1, 'Asha', '1', 40, 'F')]
+        raise RuntimeError("connection lost")
+    monkeypatch.setattr(backend, 'stream_query', failing)
+    response = backend.app.test_client().get('/patients?stream=1&limit=10')
+    with pytest.raises(RuntimeError, match="connection lost"):
+        response.get_data()
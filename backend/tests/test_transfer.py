@@ -0,0 +1,63 @@
+"""
+Parsing of CSV and NDJSON import files, and what /import answers for malformed ones.
+The endpoint tests run against the SQLite stand-in database from benchmarks/standin_db.py.
+"""
+import io
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path[:0] = [str(ROOT / 'backend' / 'app'), str(ROOT / 'benchmarks')]
+
+import standin_db  # noqa: E402
+from transfer import TransferError, read_rows  # noqa: E402
+
+
+def parse(text, fmt):
+    columns, rows = read_rows(io.StringIO(text), 'Patient', fmt)
+    return columns, list(rows)
+
+
+def test_ndjson_columns_come_from_the_first_record():
+    columns, rows = parse('{"name": "Asha", "age": 40}\n\n{"Age": 31, "Name": "Ravi"}\n', 'ndjson')
+    assert columns == ['Name', 'Age']
+    assert rows == [('Asha', 40), ('Ravi', 31)]
+
+
+@pytest.mark.parametrize('line', ['[1, 2]', '5', '"Asha"', 'null'])
+def test_ndjson_records_must_be_objects(line):
+    with pytest.raises(TransferError, match="line 3 is not a JSON object"):
+        parse('{"Name": "Asha"}\n\n' + line + '\n', 'ndjson')
+
+
+def test_ndjson_names_the_line_of_invalid_json():
+    with pytest.raises(TransferError, match="on line 2"):
+        parse('{"Name": "Asha"}\n{"Name": \n', 'ndjson')
+
+
+def test_csv_blank_fields_are_null():
+    columns, rows = parse('Name,Phone,Age\nAsha,,40\n\nRavi,555,31\n', 'csv')
+    assert columns == ['Name', 'Phone', 'Age']
+    assert rows == [('Asha', None, '40'), ('Ravi', '555', '31')]
+
+
+@pytest.mark.parametrize('row', ['Asha,555', 'Asha,555,40,F'])
+def test_csv_rows_must_match_the_header(row):
+    with pytest.raises(TransferError, match="CSV line 3 has"):
+        parse('Name,Phone,Age\nRavi,555,31\n' + row + '\n', 'csv')
+
+
+def test_unknown_columns_are_rejected():
+    with pytest.raises(TransferError, match="Unknown column 'Height'"):
+        parse('Name,Height\n', 'csv')
+
+
+def test_import_answers_400_for_a_malformed_line(tmp_path):
+    standin_db.install(str(tmp_path / 'hospital.sqlite'))
+    import backend
+    body = '{"Name": "Asha", "Phone": "1", "Age": 40, "Sex": "F"}\n[1, 2]\n'
+    response = backend.app.test_client().post('/import/patient?format=ndjson', data=body)
+    assert response.status_code == 400
+    assert "line 2" in response.get_json()["error"]
@@ -0,0 +1,69 @@
+"""
+Row IDs in write requests are checked before anything is written.
+Runs against the SQLite stand-in database from benchmarks/standin_db.py.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path[:0] = [str(ROOT / 'backend' / 'app'), str(ROOT / 'benchmarks')]
+
+import standin_db  # noqa: E402
+
+BAD_IDS = ["B1", "1.0", 1.5, True, "-1", " 1"]
+
+
+@pytest.fixture
+def backend(tmp_path):
+    standin_db.install(str(tmp_path / 'hospital.sqlite'))
+    import backend
+    with backend.retrieve_connection() as connection:
+        backend.execute_query(connection, "INSERT INTO Bed (BedID, Type, Location, Status, Pid) VALUES (1, 'ICU', 'A/1', 'Available', NULL)")
+    backend.bed_store.reset()
+    return backend
+
+
+def fetch(backend, query):
+    with backend.retrieve_connection() as connection:
+        return [tuple(row) for row in backend.execute_query(connection, query)]
+
+
+@pytest.mark.parametrize('bed_id', BAD_IDS)
+def test_set_bed_rejects_a_non_integer_bed_id(backend, bed_id):
+    response = backend.app.test_client().post('/set_bed', json={"bedID": bed_id, "status": "Reserved"})
+    assert response.status_code == 400
+    assert fetch(backend, "SELECT Status FROM Bed") == [('Available',)]
+
+
+def test_set_bed_accepts_a_numeric_string_and_updates_the_store(backend):
+    client = backend.app.test_client()
+    assert client.post('/set_bed', json={"bedID": "1", "status": "Reserved"}).status_code == 200
+    assert client.get('/beds?filters=Status=Reserved').get_json()[0][0] == 1
+
+
+@pytest.mark.parametrize('patient_id', BAD_IDS)
+def test_set_patient_rejects_a_non_integer_patient_id(backend, patient_id):
+    with backend.retrieve_connection() as connection:
+        backend.execute_query(connection, "INSERT INTO Patient (PatientID, Name, Phone, Age, Sex) VALUES (1, 'Asha', '555', 40, 'F')")
+    response = backend.app.test_client().post('/set_patient', json={"PatientID": patient_id, "Name": "Ravi"})
+    assert response.status_code == 400
+    assert fetch(backend, "SELECT Name FROM Patient") == [('Asha',)]
+
+
+@pytest.mark.parametrize('bed_id', BAD_IDS)
+def test_batch_rejects_a_non_integer_id_before_writing(backend, bed_id):
+    response = backend.app.test_client().post('/set_bed/batch', json=[{"bedID": bed_id, "status": "Reserved"}])
+    assert response.status_code == 400
+    assert response.get_json()["results"][0]["error"] == "'bedID' must be an integer."
+    assert fetch(backend, "SELECT Status FROM Bed") == [('Available',)]
+
+
+def test_batch_reports_a_commit_even_if_on_commit_fails(backend, monkeypatch):
+    def written(connection, bed_ids):
+        raise RuntimeError("bed store unavailable")
+    monkeypatch.setattr(backend.bed_store, 'written', written)
+    response = backend.app.test_client().post('/set_bed/batch', json=[{"bedID": 1, "status": "Reserved"}])
+    assert response.status_code == 200
+    assert fetch(backend, "SELECT Status FROM Bed") == [('Reserved',)]
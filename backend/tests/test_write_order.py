@@ -0,0 +1,58 @@
+"""
+Same-row writes with different column sets must apply in submission order.
+Runs against the SQLite stand-in database from benchmarks/standin_db.py.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path[:0] = [str(ROOT / 'backend' / 'app'), str(ROOT / 'benchmarks')]
+
+import standin_db  # noqa: E402
+
+# Qty only, then Qty and Expiry, then Qty only: three SQL shapes for one row
+WRITES = [{"MediID": 1, "Qty": 5}, {"MediID": 1, "Qty": 3, "Expiry": "2031-01-01"}, {"MediID": 1, "Qty": 7}]
+
+
+@pytest.fixture
+def initiate(tmp_path):
+    standin_db.install(str(tmp_path / 'hospital.sqlite'))
+    import initiate
+    with initiate.retrieve_connection() as connection:
+        initiate.execute_query(connection, "INSERT INTO Medicine (MediID, MediName, Price, Qty, Expiry) VALUES (1, 'Paracetamol', 10, 100, '2030-01-01')")
+    return initiate
+
+
+def medicine_row(initiate):
+    with initiate.retrieve_connection() as connection:
+        return tuple(initiate.execute_query(connection, "SELECT Qty, Expiry FROM Medicine WHERE MediID = 1")[0])
+
+
+def test_write_batcher_keeps_submission_order(initiate):
+    from backend import medicine_update
+    from writebatch import WriteBatcher
+    # A long delay puts all three writes in one transaction
+    batcher = WriteBatcher('test_order', medicine_update, max_delay_ms=500)
+    futures = [batcher.submit(item) for item in WRITES]
+    for future in futures:
+        future.result(10)
+    assert medicine_row(initiate) == (7, '2031-01-01')
+
+
+def test_batch_endpoint_applies_items_in_array_order(initiate):
+    from backend import app
+    response = app.test_client().post('/set_medicine/batch', json=WRITES)
+    assert response.status_code == 200
+    assert medicine_row(initiate) == (7, '2031-01-01')
+
+
+@pytest.mark.parametrize('item', [[1, 2], 5, "MediID"])
+def test_batch_endpoint_rejects_non_object_items(initiate, item):
+    from backend import app
+    response = app.test_client().post('/set_medicine/batch', json={"items": [item, WRITES[0]], "mode": "best_effort"})
+    assert response.status_code == 207
+    results = response.get_json()["results"]
+    assert results[0]["status"] == "error" and results[1]["status"] == "ok"
+    assert medicine_row(initiate)[0] == 5
@@ -0,0 +1,60 @@
+"""
+Compare the JSON /beds payload with the packed /beds/packed payload.
+
+Reports payload bytes and host-side parse time for several hospital sizes,
+timing the firmware's own decode_packed(). For Pico parse times, run
+benchmark_decoders() from arduino_backend_health_dome.py on the device.
+
+    python benchmarks/bed_payload.py
+"""
+import ast
+import json
+import struct
+import sys
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'backend' / 'app'))
+
+from bedfeed import pack_bed_status
+
+
+def load_firmware_decoder():
+    # The firmware imports Pico-only modules, so pull out just the decoder
+    source = (ROOT / 'arduino_backend_health_dome.py').read_text()
+    tree = ast.parse(source)
+    wanted = [node for node in tree.body
+              if isinstance(node, ast.FunctionDef) and node.name == 'decode_packed'
+              or isinstance(node, ast.Assign) and any(getattr(t, 'id', None) == 'PACKED_STATUS' for t in node.targets)]
+    namespace = {'struct': struct}
+    exec(compile(ast.Module(body=wanted, type_ignores=[]), 'firmware', 'exec'), namespace)
+    return namespace['decode_packed']
+
+
+def main():
+    decode_packed = load_firmware_decoder()
+    statuses = ['Available', 'Reserved', 'Occupied']
+    print(f"{'beds':>6} {'json B':>9} {'packed B':>9} {'ratio':>7} {'json us':>9} {'packed us':>10}")
+    for count in (3, 30, 300, 3000):
+        rows = [[i, 'General', f'A/{100 + i % 300}', statuses[i % 3], i if i % 3 else None] for i in range(1, count + 1)]
+        json_payload = json.dumps(rows, separators=(',', ':')).encode()
+        packed_payload = pack_bed_status([(row[0], row[3]) for row in rows], 1, count, 1)
+
+        def parse_json():
+            for bed in json.loads(json_payload):
+                bed_id, status = bed[0], bed[3]
+
+        def parse_packed():
+            for bed_id, status in decode_packed(packed_payload)[1]:
+                pass
+
+        rounds = max(10, 30000 // count)
+        json_us = timeit.timeit(parse_json, number=rounds) / rounds * 1e6
+        packed_us = timeit.timeit(parse_packed, number=rounds) / rounds * 1e6
+        print(f"{count:>6} {len(json_payload):>9} {len(packed_payload):>9} {len(json_payload) / len(packed_payload):>6.1f}x "
+              f"{json_us:>9.1f} {packed_us:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
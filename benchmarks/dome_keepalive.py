@@ -0,0 +1,89 @@
+"""
+Poll latency of the dome firmware's HTTP client: a new connection per poll
+versus one kept-alive connection.
+
+Runs the firmware's own HttpConnection on CPython asyncio against the app on
+the stand-in database (or `--url`), polling /beds/changes the way the dome
+does once it is in sync. For numbers from the Pico itself, run
+benchmark_polls() from arduino_backend_health_dome.py on the device.
+
+    python benchmarks/dome_keepalive.py --rounds 500
+    python benchmarks/dome_keepalive.py --url http://192.168.205.1:5000
+"""
+import argparse
+import ast
+import asyncio
+import json
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from load_domes import percentile, start_standin_server
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_firmware_client():
+    # The firmware imports Pico-only modules, so pull out just the HTTP client
+    tree = ast.parse((ROOT / 'arduino_backend_health_dome.py').read_text())
+    wanted = [node for node in tree.body
+              if isinstance(node, ast.ClassDef) and node.name == 'HttpConnection'
+              or isinstance(node, ast.FunctionDef) and node.name == 'parse_server']
+    namespace = {'asyncio': asyncio}
+    exec(compile(ast.Module(body=wanted, type_ignores=[]), 'arduino_backend_health_dome.py', 'exec'), namespace)
+    return namespace['HttpConnection']
+
+
+async def measure(server, rounds):
+    HttpConnection = load_firmware_client()
+    connection = HttpConnection(server)
+    status, body = await connection.get('/beds/changes?since=0&from=1&to=3')
+    # Poll from the current version, like a dome that is in sync (mostly 204 No Content)
+    path = f"/beds/changes?since={json.loads(body)['version']}&from=1&to=3"
+    await connection.close()
+
+    results = {}
+    for mode in ('new connection', 'keep-alive'):
+        latencies = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            await connection.get(path)
+            if mode == 'new connection':
+                await connection.close()
+            latencies.append(time.perf_counter() - start)
+        await connection.close()
+        latencies.sort()
+        results[mode] = {f"p{int(q * 100)}_ms": round(percentile(latencies, q) * 1000, 3) for q in (0.5, 0.95, 0.99)}
+        results[mode]["mean_ms"] = round(sum(latencies) / rounds * 1000, 3)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="Base URL of a running server; default starts the app on a stand-in database")
+    parser.add_argument('--rounds', type=int, default=300)
+    parser.add_argument('--server', choices=('gunicorn', 'werkzeug'), default='gunicorn',
+                        help="How to serve the stand-in app; werkzeug closes every connection, so keep-alive never engages")
+    args = parser.parse_args()
+
+    server_process = None
+    if args.url:
+        target = urlsplit(args.url)
+        server = f"http://{target.hostname}:{target.port or 80}"
+    else:
+        server_process, host, port = start_standin_server(SimpleNamespace(beds=300, patients=1000, server=args.server))
+        server = f"http://{host}:{port}"
+    try:
+        results = asyncio.run(measure(server, args.rounds))
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait()
+
+    for mode, numbers in results.items():
+        print(f"{mode:>15}: " + '  '.join(f"{name} {value}" for name, value in numbers.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+One gateway request versus a dome polling every hospital itself.
+
+Starts `--hospitals` stand-in backends (see standin_db.py), each with its own
+HOSPITAL_NAME, plus one upstream that accepts connections and never answers,
+then a gateway (GATEWAY_UPSTREAMS) in front of all of them. Reports:
+
+- the dome's way: /beds/changes from every upstream concurrently, which
+  takes as long as the slowest one (here the hung one, up to --timeout);
+- /gateway/beds: the latency of one request, cached and uncached, and the
+  hung hospital flagged stale instead of delaying the others;
+- how long a set_bed on one hospital takes to show up through the gateway.
+
+    python benchmarks/federation.py --hospitals 3 --requests 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+from load_domes import percentile, start_standin_server
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend' / 'app'))
+from gateway import http_get  # noqa: E402
+
+
+async def start_hung_upstream():
+    # Accepts connections and never answers, like a hospital whose backend is wedged
+    async def hang(reader, writer):
+        await reader.read()  # Until the client gives up
+        writer.close()
+    server = await asyncio.start_server(hang, '127.0.0.1', 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+async def timed_get(host, port, path, timeout):
+    start = time.perf_counter()
+    try:
+        status, headers, body = await asyncio.wait_for(http_get(host, port, path), timeout)
+    except (OSError, asyncio.TimeoutError):
+        status, headers, body = 599, {}, b''
+    return time.perf_counter() - start, status, body
+
+
+async def set_bed(host, port, bed_id, status):
+    reader, writer = await asyncio.open_connection(host, port)
+    payload = json.dumps({"bedID": bed_id, "status": status}).encode()
+    writer.write(f"POST /set_bed HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload)
+    await reader.read()
+    writer.close()
+
+
+async def measure(upstreams, gateway, args):
+    direct = []
+    for _ in range(5):
+        start = time.perf_counter()
+        await asyncio.gather(*(timed_get(host, port, '/beds/changes?since=0', args.timeout) for host, port in upstreams))
+        direct.append(time.perf_counter() - start)
+
+    host, port = gateway
+    cold, status, body = await timed_get(host, port, '/gateway/beds', 30)
+    view = json.loads(body)
+    hospitals = {name: (len(merged["beds"]), merged["stale"]) for name, merged in view["hospitals"].items()}
+
+    latencies = []
+    for _ in range(args.requests):
+        elapsed, status, body = await timed_get(host, port, '/gateway/beds', 30)
+        latencies.append(elapsed)
+    latencies.sort()
+
+    # Propagation: flip a bed on the first hospital and poll the gateway until it shows
+    name = next(iter(view["hospitals"]))
+    bed = view["hospitals"][name]["beds"][0]
+    new_status = "Reserved" if bed[3] != "Reserved" else "Available"
+    start = time.perf_counter()
+    await set_bed(*upstreams[0], bed[0], new_status)
+    while True:
+        elapsed, status, body = await timed_get(host, port, '/gateway/beds', 30)
+        beds = json.loads(body)["hospitals"][name]["beds"] if status == 200 else []
+        if any(row[0] == bed[0] and row[3] == new_status for row in beds):
+            break
+        await asyncio.sleep(0.05)
+    propagation = time.perf_counter() - start
+
+    print(f"dome polling {len(upstreams)} upstreams itself: {percentile(sorted(direct), 0.5) * 1000:.0f} ms per round (slowest upstream)")
+    print(f"gateway first request: {cold * 1000:.0f} ms; hospitals {hospitals}")
+    print(f"gateway cached: p50 {percentile(latencies, 0.5) * 1000:.2f} ms  p99 {percentile(latencies, 0.99) * 1000:.2f} ms"
+          f"  (max {latencies[-1] * 1000:.0f} ms, refreshes every {args.ttl} s)")
+    print(f"set_bed visible through the gateway after {propagation * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hospitals', type=int, default=3)
+    parser.add_argument('--beds', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--timeout', type=float, default=2, help="GATEWAY_TIMEOUT, and the dome's own per-server timeout")
+    parser.add_argument('--ttl', type=float, default=1, help="GATEWAY_CACHE_TTL")
+    parser.add_argument('--server', choices=('gunicorn', 'werkzeug'), default='gunicorn')
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    hung, hung_port = loop.run_until_complete(start_hung_upstream())
+    servers, upstreams = [], []
+    try:
+        for i in range(args.hospitals):
+            os.environ['HOSPITAL_NAME'] = f"Hospital {chr(ord('A') + i)}"
+            server, host, port = start_standin_server(argparse.Namespace(beds=args.beds, patients=10, server=args.server))
+            servers.append(server)
+            upstreams.append((host, port))
+        upstreams.append(('127.0.0.1', hung_port))
+
+        os.environ['HOSPITAL_NAME'] = 'Gateway'
+        os.environ['GATEWAY_UPSTREAMS'] = ','.join(f"http://{host}:{port}" for host, port in upstreams)
+        os.environ['GATEWAY_TIMEOUT'] = str(args.timeout)
+        os.environ['GATEWAY_CACHE_TTL'] = str(args.ttl)
+        server, host, port = start_standin_server(argparse.Namespace(beds=0, patients=0, server=args.server))
+        servers.append(server)
+
+        loop.run_until_complete(measure(upstreams, (host, port), args))
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+        hung.close()
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""
+Load test: a fleet of bed domes polling /beds while nurses use the API.
+
+Every dome requests `--dome-path` once per `--dome-interval` seconds, the way
+check_beds() does on the Pico, with the domes spread evenly over the interval.
+Nurse traffic arrives at random (Poisson) at `--nurse-rps`, split between
+set_bed, add_patient and /patients searches by `--mix`. Arrivals are open-loop
+and latency is measured from each request's scheduled time, so a server that
+falls behind shows up in the percentiles instead of silently slowing the load.
+
+Reports throughput and p50/p95/p99 latency per endpoint for each dome count
+in `--domes`, and the first count whose dome p99 exceeds `--slo-ms` or whose
+error rate exceeds 1%.
+
+    # the app under gunicorn on a stand-in database (SQLite, see standin_db.py), no MySQL needed
+    python benchmarks/load_domes.py --domes 50,100,200,400
+
+    # a running server, e.g. `docker compose up` in backend/
+    python benchmarks/load_domes.py --url http://127.0.0.1:6000 --domes 100,500,1000 --json results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+ROOT = Path(__file__).resolve().parent.parent
+STATUSES = ('Available', 'Reserved', 'Occupied')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def http_request(host, port, method, path, body=None, timeout=10):
+    """
+    One request on a fresh connection, as urequests does on the Pico. Returns the status code.
+    """
+    async def exchange():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            payload = json.dumps(body).encode() if body is not None else b''
+            head = f"{method} {quote(path, safe='/?=&,^|')} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n"
+            if body is not None:
+                head += f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+            writer.write(head.encode() + b'\r\n' + payload)
+            status_line = await reader.readline()
+            await reader.read()
+            return int(status_line.split()[1])
+        finally:
+            writer.close()
+    return await asyncio.wait_for(exchange(), timeout)
+
+
+class Run:
+    def __init__(self, host, port, args):
+        self.host = host
+        self.port = port
+        self.args = args
+        self.latencies = {}  # endpoint -> [seconds]
+        self.errors = {}  # endpoint -> count
+        self.tasks = set()
+
+    def fire(self, name, scheduled, method, path, body=None):
+        task = asyncio.ensure_future(self._request(name, scheduled, method, path, body))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _request(self, name, scheduled, method, path, body):
+        try:
+            status = await http_request(self.host, self.port, method, path, body, self.args.timeout)
+            ok = status < 400
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+            ok = False
+        if ok:
+            self.latencies.setdefault(name, []).append(time.perf_counter() - scheduled)
+        else:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    async def sleep_until(self, moment):
+        delay = moment - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def dome(self, index, domes, start, end):
+        interval = self.args.dome_interval
+        scheduled = start + interval * index / domes
+        while scheduled < end:
+            await self.sleep_until(scheduled)
+            self.fire('dome poll', scheduled, 'GET', self.args.dome_path)
+            scheduled += interval
+
+    async def nurses(self, start, end):
+        weights = dict(part.split('=') for part in self.args.mix.split(','))
+        names, weights = list(weights), [float(weight) for weight in weights.values()]
+        scheduled = start
+        while True:
+            scheduled += random.expovariate(self.args.nurse_rps)
+            if scheduled >= end:
+                return
+            await self.sleep_until(scheduled)
+            action = random.choices(names, weights)[0]
+            if action == 'set_bed':
+                body = {"bedID": random.randint(1, self.args.beds), "status": random.choice(STATUSES)}
+                self.fire('set_bed', scheduled, 'POST', '/set_bed', body)
+            elif action == 'add_patient':
+                body = {"Name": "Load Test", "Phone": f"555{random.randint(0, 9999999):07d}",
+                        "Age": random.randint(1, 99), "Sex": random.choice('MF')}
+                self.fire('add_patient', scheduled, 'POST', '/add_patient', body)
+            else:
+                prefix = random.choice(string.ascii_uppercase)
+                self.fire('patients search', scheduled, 'GET', f'/patients?filters=Name^={prefix}&limit=20')
+
+    async def run(self, domes):
+        start = time.perf_counter() + 0.1
+        end = start + self.args.seconds
+        load = [self.dome(i, domes, start, end) for i in range(domes)]
+        if self.args.nurse_rps > 0:
+            load.append(self.nurses(start, end))
+        await asyncio.gather(*load)
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks))
+        return self.report(domes, time.perf_counter() - start)
+
+    def report(self, domes, elapsed):
+        endpoints = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(name, []))
+            errors = self.errors.get(name, 0)
+            endpoints[name] = {
+                "requests": len(values) + errors,
+                "errors": errors,
+                "rps": round((len(values) + errors) / elapsed, 1),
+                **{f"p{int(q * 100)}_ms": round(percentile(values, q) * 1000, 1) if values else None for q in (0.5, 0.95, 0.99)},
+                "max_ms": round(values[-1] * 1000, 1) if values else None,
+            }
+        return {"domes": domes, "seconds": round(elapsed, 1), "endpoints": endpoints}
+
+
+def broken(result, slo_ms):
+    poll = result["endpoints"].get('dome poll')
+    if not poll:
+        return True
+    error_rate = sum(e["errors"] for e in result["endpoints"].values()) / max(1, sum(e["requests"] for e in result["endpoints"].values()))
+    return poll["p99_ms"] is None or poll["p99_ms"] > slo_ms or error_rate > 0.01
+
+
+def print_result(result):
+    print(f"\n{result['domes']} domes, {result['seconds']} s")
+    print(f"  {'endpoint':<18}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for name, e in result["endpoints"].items():
+        cells = [e["p50_ms"], e["p95_ms"], e["p99_ms"], e["max_ms"]]
+        print(f"  {name:<18}{e['requests']:>9}{e['errors']:>8}{e['rps']:>9}" + ''.join(f"{'-' if c is None else c:>9}" for c in cells))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_standin_server(args):
+    port = free_port()
+    path = os.path.join(tempfile.mkdtemp(prefix='hospital-load-'), 'hospital.sqlite')
+    server = subprocess.Popen([sys.executable, __file__, '--serve-standin', path, '--port', str(port),
+                               '--beds', str(args.beds), '--patients', str(args.patients), '--server', args.server])
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("Stand-in server exited during startup")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server, '127.0.0.1', port
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Stand-in server did not come up")
+
+
+def serve_standin(path, port, beds, patients, server):
+    """
+    Child process: seed a stand-in database and serve the real Flask app on it,
+    either under gunicorn with the production gunicorn.conf.py or on the
+    werkzeug dev server (which closes every connection after one response).
+    """
+    app_dir = ROOT / 'backend' / 'app'
+    sys.path.insert(0, str(app_dir))
+    sys.path.insert(0, str(ROOT / 'benchmarks'))
+    import logging
+    import standin_db
+    standin_db.install(path, size=int(os.getenv('MYSQL_POOL_SIZE', 10)))
+    import initiate
+
+    with initiate.retrieve_connection() as connection:
+        initiate.seed_bulk(connection, patients=patients, beds=beds)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if server == 'werkzeug':
+        from backend import app
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+        return
+
+    from gunicorn.app.base import Application
+
+    class StandinApplication(Application):
+        def init(self, parser, opts, args):
+            pass
+
+        def load_config(self):
+            self.load_config_from_file(str(app_dir / 'gunicorn.conf.py'))
+            self.cfg.set('bind', f'127.0.0.1:{port}')
+
+        def load(self):
+            # Runs in each worker; the patched initiate.get_pool is inherited from here
+            from backend import app
+            return app
+
+    StandinApplication().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="Base URL of a running server; default starts the app on a stand-in database")
+    parser.add_argument('--domes', default='50,100,200', help="Comma-separated dome counts to step through")
+    parser.add_argument('--seconds', type=float, default=20, help="Duration of each step")
+    parser.add_argument('--dome-interval', type=float, default=1.0)
+    parser.add_argument('--dome-path', default='/beds?filters=bedID>0,bedID<4')
+    parser.add_argument('--nurse-rps', type=float, default=5)
+    parser.add_argument('--mix', default='set_bed=5,add_patient=1,patients=4')
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--slo-ms', type=float, default=500, help="Dome p99 above this counts as broken")
+    parser.add_argument('--beds', type=int, default=300, help="Beds to seed (stand-in) and to pick set_bed targets from")
+    parser.add_argument('--patients', type=int, default=10000, help="Patients to seed in the stand-in database")
+    parser.add_argument('--server', choices=('gunicorn', 'werkzeug'), default='gunicorn',
+                        help="How to serve the stand-in app; gunicorn uses backend/app/gunicorn.conf.py")
+    parser.add_argument('--json', help="Write all results to this file")
+    parser.add_argument('--serve-standin', metavar='PATH', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_standin:
+        serve_standin(args.serve_standin, args.port, args.beds, args.patients, args.server)
+        return
+
+    server = None
+    if args.url:
+        target = urlsplit(args.url)
+        host, port = target.hostname, target.port or 80
+    else:
+        server, host, port = start_standin_server(args)
+
+    results = []
+    try:
+        for domes in [int(count) for count in args.domes.split(',')]:
+            result = asyncio.run(Run(host, port, args).run(domes))
+            results.append(result)
+            print_result(result)
+            if broken(result, args.slo_ms):
+                print(f"\nBroke at {domes} domes (dome p99 over {args.slo_ms} ms or more than 1% errors)")
+                break
+        else:
+            print(f"\nHeld up to {results[-1]['domes']} domes")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"target": args.url or "standin", "args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
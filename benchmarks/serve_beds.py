@@ -0,0 +1,110 @@
+"""
+Requests/sec for /beds under the Werkzeug dev server versus gunicorn.
+
+Starts each server in turn from backend/app with the current environment
+(point MYSQL_HOST etc. at a seeded database), then hammers one path from
+`--clients` threads for `--seconds` seconds. With `--standin BEDS` each
+server instead runs on a freshly seeded stand-in database (see
+standin_db.py), so no MySQL is needed.
+
+    python benchmarks/serve_beds.py --clients 16 --seconds 10
+    python benchmarks/serve_beds.py --standin 300 --clients 8 --seconds 10
+    python benchmarks/serve_beds.py --path /details   # server overhead only, no MySQL
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / 'backend' / 'app'
+BENCH_DIR = Path(__file__).resolve().parent
+
+MODES = {
+    'dev': lambda port: [sys.executable, 'backend.py'],
+    'gunicorn-gthread': lambda port: [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-k', 'gthread', 'backend:app'],
+    'gunicorn-gevent': lambda port: [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-k', 'gevent', 'backend:app'],
+}
+
+# Stand-in equivalents: (load_domes.py --server, gunicorn worker class)
+STANDIN_MODES = {
+    'dev': ('werkzeug', None),
+    'gunicorn-gthread': ('gunicorn', 'gthread'),
+    'gunicorn-gevent': ('gunicorn', 'gevent'),
+}
+
+
+def standin_command(mode, port, beds):
+    server, worker_class = STANDIN_MODES[mode]
+    path = os.path.join(tempfile.mkdtemp(prefix='hospital-serve-'), 'hospital.sqlite')
+    command = [sys.executable, str(BENCH_DIR / 'load_domes.py'), '--serve-standin', path, '--port', str(port),
+               '--beds', str(beds), '--patients', '100', '--server', server]
+    return command, ({'WORKER_CLASS': worker_class} if worker_class else {})
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not come up")
+
+
+def hammer(url, clients, seconds):
+    counts = [0] * clients
+    errors = [0] * clients
+    stop = time.monotonic() + seconds
+
+    def client(i):
+        while time.monotonic() < stop:
+            try:
+                urllib.request.urlopen(url, timeout=10).read()
+                counts[i] += 1
+            except OSError:
+                errors[i] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / seconds, sum(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default='/beds?filters=bedID>0,bedID<4')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--port', type=int, default=5077)
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--standin', type=int, metavar='BEDS', help="Serve a stand-in database seeded with this many beds")
+    args = parser.parse_args()
+
+    for mode in args.modes.split(','):
+        env = dict(os.environ, PORT=str(args.port))
+        command = MODES[mode](args.port)
+        if args.standin:
+            command, extra = standin_command(mode, args.port, args.standin)
+            env.update(extra)
+        server = subprocess.Popen(command, cwd=APP_DIR, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            url = f"http://127.0.0.1:{args.port}{args.path}"
+            wait_until_up(f"http://127.0.0.1:{args.port}/details")
+            rate, errors = hammer(url, args.clients, args.seconds)
+            print(f"{mode:>18}: {rate:8.1f} req/s  ({errors} errors, {args.clients} clients, {args.path})")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
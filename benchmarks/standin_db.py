@@ -0,0 +1,129 @@
+"""
+In-process stand-in for MySQL, for benchmarking the API without a database server.
+
+A SQLite file behind just enough of the mysql-connector connection and cursor
+API for initiate.execute_query, stream_query and the pool. It has the same
+tables and secondary indexes as migrations.py, so relative costs stay
+meaningful, but absolute numbers say nothing about MySQL itself.
+
+    import standin_db
+    standin_db.install('/tmp/hospital.sqlite')
+    import backend  # every retrieve_connection() now hands out SQLite connections
+"""
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS Bed (BedID INTEGER PRIMARY KEY AUTOINCREMENT, Type TEXT, Location TEXT, Status TEXT, Pid INT);
+CREATE TABLE IF NOT EXISTS Medicine (MediID INTEGER PRIMARY KEY AUTOINCREMENT, MediName TEXT, Price INT, Qty INT, Expiry DATE);
+CREATE TABLE IF NOT EXISTS Meditag (MediID INT, MediTag TEXT, PRIMARY KEY (MediID, MediTag));
+CREATE TABLE IF NOT EXISTS Patient (PatientID INTEGER PRIMARY KEY AUTOINCREMENT, Name TEXT, Phone TEXT, Age INT, Sex TEXT);
+CREATE TABLE IF NOT EXISTS History (PID INT, Doctor TEXT, Date DATE, PrescriptionID TEXT, PRIMARY KEY (PID, Date, PrescriptionID));
+CREATE INDEX IF NOT EXISTS idx_bed_status ON Bed (Status);
+CREATE INDEX IF NOT EXISTS idx_bed_pid ON Bed (Pid);
+CREATE INDEX IF NOT EXISTS idx_medicine_expiry ON Medicine (Expiry);
+CREATE INDEX IF NOT EXISTS idx_medicine_qty ON Medicine (Qty);
+CREATE INDEX IF NOT EXISTS idx_patient_phone ON Patient (Phone);
+CREATE INDEX IF NOT EXISTS idx_history_date ON History (Date);
+"""
+
+
+def _translate(query):
+    return query.replace('%s', '?').replace('INSERT IGNORE', 'INSERT OR IGNORE')
+
+
+def _substring_index(value, delimiter, count):
+    # MySQL SUBSTRING_INDEX for a positive count
+    return None if value is None else delimiter.join(value.split(delimiter)[:count])
+
+
+class StandinCursor:
+    def __init__(self, connection, dictionary=False):
+        self._cursor = connection.cursor()
+        self._dictionary = dictionary
+        self.warning_count = 0
+        self.warnings = None
+
+    def execute(self, query, data=None):
+        self._cursor.execute(_translate(query), tuple(data) if data is not None else ())
+
+    def executemany(self, query, data):
+        self._cursor.executemany(_translate(query), [tuple(row) for row in data])
+
+    @property
+    def with_rows(self):
+        return self._cursor.description is not None
+
+    @property
+    def column_names(self):
+        return tuple(column[0] for column in self._cursor.description)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def _rows(self, rows):
+        if self._dictionary:
+            return [dict(zip(self.column_names, row)) for row in rows]
+        return rows
+
+    def fetchall(self):
+        return self._rows(self._cursor.fetchall())
+
+    def fetchmany(self, size=1):
+        return self._rows(self._cursor.fetchmany(size))
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return self._rows([row])[0] if row is not None else None
+
+    def close(self):
+        self._cursor.close()
+
+
+class StandinConnection:
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.create_function('SUBSTRING_INDEX', 3, _substring_index, deterministic=True)
+        self._connection.executescript(SCHEMA)
+
+    def cursor(self, prepared=False, dictionary=False, **kwargs):
+        return StandinCursor(self._connection, dictionary)
+
+    def start_transaction(self):
+        pass
+
+    @property
+    def in_transaction(self):
+        return self._connection.in_transaction
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def is_connected(self):
+        return True
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self._connection.close()
+
+
+def install(path, size=10):
+    """
+    Route initiate.retrieve_connection() to a pool of stand-in connections on `path`.
+    """
+    import initiate
+    from pool import ConnectionPool
+
+    pool = ConnectionPool(lambda: StandinConnection(path), size=size, name='standin')
+    initiate.get_pool = lambda *args, **kwargs: pool
+    return pool
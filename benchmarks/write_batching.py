@@ -0,0 +1,70 @@
+"""
+set_bed throughput and latency with and without group commit (WRITE_BATCHING).
+
+`--clients` concurrent clients each send set_bed back to back for
+`--seconds`, first against a server with one transaction per request, then
+against one with WRITE_BATCHING=1. Runs the app under gunicorn on the
+stand-in database (see standin_db.py), whose commits are fsync'd SQLite WAL
+commits, so the relative cost of a commit is realistic even though absolute
+numbers say nothing about MySQL.
+
+    python benchmarks/write_batching.py --clients 32 --beds 50
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from load_domes import STATUSES, http_request, percentile, start_standin_server
+
+
+async def hammer(host, port, clients, seconds, beds):
+    latencies, errors = [], 0
+    end = time.perf_counter() + seconds
+
+    async def client():
+        nonlocal errors
+        while time.perf_counter() < end:
+            body = {"bedID": random.randint(1, beds), "status": random.choice(STATUSES)}
+            start = time.perf_counter()
+            try:
+                status = await http_request(host, port, 'POST', '/set_bed', body)
+            except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+                status = 599
+            if status < 400:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    await asyncio.gather(*(client() for _ in range(clients)))
+    latencies.sort()
+    return {
+        "writes/s": round(len(latencies) / seconds, 1),
+        "errors": errors,
+        **{f"p{int(q * 100)}_ms": round(percentile(latencies, q) * 1000, 2) for q in (0.5, 0.99)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--beds', type=int, default=50, help="Beds to seed and pick from; fewer beds means more collapsing")
+    parser.add_argument('--server', choices=('gunicorn', 'werkzeug'), default='gunicorn')
+    args = parser.parse_args()
+
+    for batching in ('0', '1'):
+        os.environ['WRITE_BATCHING'] = batching
+        server, host, port = start_standin_server(argparse.Namespace(beds=args.beds, patients=100, server=args.server))
+        try:
+            result = asyncio.run(hammer(host, port, args.clients, args.seconds, args.beds))
+        finally:
+            server.terminate()
+            server.wait()
+        label = 'group commit' if batching == '1' else 'per request'
+        print(f"{label:>13}: " + '  '.join(f"{name} {value}" for name, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()